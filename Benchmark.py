@@ -0,0 +1,360 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from KnowledgeBase import ChatbotDatabase
+from OpenAIEmbedder import EMBEDDING_DIMENSIONS, FakeEmbedder
+import Utils
+
+SIZES = {'1k': 1_000, '100k': 100_000, '1m': 1_000_000}
+CASES = ('ingest', 'query', 'clean', 'tfidf')
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'tu', 'ven', 'dor', 'sil', 'ap', 'ex', 'no', 'bel']
+RESULTS_FORMAT_VERSION = 1
+
+
+# Synthetic data
+
+def vocabulary(size: int = 1500, seed: int = 0) -> List[str]:
+    """Deterministic pseudo-words built from a few syllables, so texts have a realistic mix of rare and common words."""
+    rng = np.random.default_rng(seed)
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES, rng.integers(2, 5))))
+    return sorted(words)
+
+
+def synthetic_sentence(rng: np.random.Generator, words: List[str], n_words: int) -> str:
+    # Zipf-like word frequencies: a few words are everywhere, most are rare
+    ranks = np.minimum(rng.zipf(1.3, n_words), len(words)) - 1
+    return " ".join(words[rank] for rank in ranks)
+
+
+def synthetic_terms(n: int, seed: int = 0) -> Iterator[Tuple[str, str]]:
+    """Yields n unique (term, fact) pairs."""
+    rng = np.random.default_rng(seed)
+    words = vocabulary(seed=seed)
+    for i in range(n):
+        yield (f"What did president {i} do about {synthetic_sentence(rng, words, 3)}?",
+               f"President {i} {synthetic_sentence(rng, words, 12)}.")
+
+
+def synthetic_embeddings(n: int, dim: int = EMBEDDING_DIMENSIONS, seed: int = 0,
+                         chunk_rows: int = 10_000) -> Iterator[np.ndarray]:
+    """
+    Yields n normalized float32 embeddings in chunks. Like EmbeddingIndex.benchmark_recall, the
+    vectors are a mixture of gaussian clusters, which is closer to text embeddings than uniform noise.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, n // 1000), dim)).astype(np.float32)
+    for start in range(0, n, chunk_rows):
+        rows = min(chunk_rows, n - start)
+        vectors = centers[rng.integers(len(centers), size=rows)] + 0.5 * rng.normal(size=(rows, dim)).astype(np.float32)
+        yield vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def write_corpus(directory: str, n_documents: int, document_words: int = 3000, seed: int = 0):
+    """Writes n_documents synthetic raw pages (sentences with capitals and punctuation) as .txt files."""
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    words = vocabulary(seed=seed)
+    for i in range(n_documents):
+        sentences = [synthetic_sentence(rng, words, 15).capitalize() + "." for _ in range(document_words // 15)]
+        with open(os.path.join(directory, f"page_{i:05d}.txt"), 'w', encoding='utf-8') as file:
+            for start in range(0, len(sentences), 8):
+                file.write(" ".join(sentences[start:start + 8]) + "\n")
+
+
+# Measurements
+
+def summarize(latencies: List[float], items: int, seconds: float) -> dict:
+    """Throughput over all items, and per-call latency percentiles in milliseconds."""
+    latencies = latencies or [seconds]
+    return {
+        'items': items,
+        'seconds': seconds,
+        'per_sec': items / seconds if seconds > 0 else float('inf'),
+        'p50_ms': 1000 * float(np.percentile(latencies, 50)),
+        'p99_ms': 1000 * float(np.percentile(latencies, 99)),
+    }
+
+
+def timed_calls(function: Callable, arguments: List) -> dict:
+    """Calls function once per argument and summarizes the per-call latencies."""
+    latencies = []
+    start = time.perf_counter()
+    for argument in arguments:
+        call_start = time.perf_counter()
+        function(argument)
+        latencies.append(time.perf_counter() - call_start)
+    return summarize(latencies, len(arguments), time.perf_counter() - start)
+
+
+def traced(function: Callable[[], dict], trace_memory: bool) -> dict:
+    """Runs a benchmark case, adding the peak traced Python/NumPy memory to its results."""
+    if not trace_memory:
+        return function()
+    tracemalloc.start()
+    try:
+        results = function()
+        results['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+    return results
+
+
+# Cases
+
+def bench_ingest(workdir: str, n_terms: int, seed: int, batch_size: int = 10_000, single_writes: int = 200) -> dict:
+    """Bulk-loads n_terms terms and facts, then times single add_term_with_embedding and add_fact calls."""
+    db = ChatbotDatabase(os.path.join(workdir, 'kb.db'))
+    try:
+        def terms():
+            pairs = synthetic_terms(n_terms, seed)
+            for vectors in synthetic_embeddings(n_terms, seed=seed):
+                for vector, (term, _) in zip(vectors, pairs):
+                    yield term, vector
+
+        results = {'bulk_terms': db.bulk_add_terms(terms(), batch_size),
+                   'bulk_facts': db.bulk_add_facts(synthetic_terms(n_terms, seed), batch_size)}
+        for report in results.values():
+            report['per_sec'] = report.pop('rows_per_sec')
+            report['items'] = report.pop('rows')
+
+        embedder = FakeEmbedder()
+        new_terms = [f"Single write {i}" for i in range(single_writes)]
+        results['add_term_with_embedding'] = timed_calls(
+            lambda term: db.add_term_with_embedding(term, embedder.get_embedding(term)), new_terms)
+        results['add_fact'] = timed_calls(lambda term: db.add_fact(term, f"A fact about {term}."), new_terms)
+        return results
+    finally:
+        db.close()
+
+
+def bench_query(workdir: str, n_terms: int, seed: int, n_queries: int = 200, top_k: int = 5) -> dict:
+    """Times exact, approximate (IVF) and hybrid retrieval against the knowledge base built by bench_ingest."""
+    db = ChatbotDatabase(os.path.join(workdir, 'kb.db'))
+    try:
+        rng = np.random.default_rng(seed + 1)
+        rows = np.sort(rng.choice(n_terms, min(n_queries, n_terms), replace=False))
+        # Regenerate the stored terms and embeddings, keeping only the queried rows
+        vectors, offset = [], 0
+        for chunk in synthetic_embeddings(n_terms, seed=seed):
+            vectors.append(chunk[rows[(rows >= offset) & (rows < offset + len(chunk))] - offset])
+            offset += len(chunk)
+        vectors = np.concatenate(vectors)
+        queries = vectors + 0.05 * rng.normal(size=vectors.shape).astype(np.float32)
+        wanted = set(rows.tolist())
+        texts = [term for i, (term, _) in enumerate(synthetic_terms(int(rows[-1]) + 1, seed)) if i in wanted]
+
+        results = {'exact': timed_calls(lambda query: db.retrieve_facts_by_embedding(query, top_k), list(queries))}
+        start = time.perf_counter()
+        db.build_ann_index()
+        results['ann_build'] = {'items': n_terms, 'seconds': time.perf_counter() - start}
+        results['approximate'] = timed_calls(
+            lambda query: db.retrieve_facts_by_embedding(query, top_k, search='approximate'), list(queries))
+        results['hybrid'] = timed_calls(
+            lambda i: db.retrieve_facts_hybrid([texts[i]], queries[i:i + 1], top_k), list(range(len(texts))))
+        return results
+    finally:
+        db.close()
+
+
+def cleaning_model():
+    """The cleaning model, or a blank English pipeline if it is not installed (recorded in the results)."""
+    try:
+        return Utils.load_cleaning_model(), Utils.CLEANING_MODEL
+    except OSError:
+        import spacy
+        return spacy.blank("en"), "blank:en"
+
+
+def bench_clean(workdir: str, n_documents: int, seed: int) -> dict:
+    """Times Utils.clean_text_file on a synthetic corpus of raw pages."""
+    raw_dir, clean_dir = os.path.join(workdir, 'raw'), os.path.join(workdir, 'clean')
+    write_corpus(raw_dir, n_documents, seed=seed)
+    os.makedirs(clean_dir, exist_ok=True)
+    nlp, model = cleaning_model()
+    filenames = sorted(os.listdir(raw_dir))
+    results = timed_calls(lambda filename: Utils.clean_text_file(raw_dir, clean_dir, filename, nlp=nlp), filenames)
+    empty = [filename for filename in filenames if not os.path.getsize(os.path.join(clean_dir, filename))]
+    if empty:
+        raise RuntimeError(f"Cleaning with {model} produced no text for {len(empty)} of {len(filenames)} documents.")
+    characters = sum(os.path.getsize(os.path.join(raw_dir, filename)) for filename in filenames)
+    results['chars_per_sec'] = characters / results['seconds'] if results['seconds'] > 0 else float('inf')
+    results['model'] = model
+    return results
+
+
+def bench_tfidf(workdir: str, seed: int, max_features: int = 40) -> dict:
+    """Times Utils.extract_important_terms on the cleaned corpus: a full build, then an incremental rerun."""
+    clean_dir, stats_path = os.path.join(workdir, 'clean'), os.path.join(workdir, 'termstats.db')
+    n_documents = len(os.listdir(clean_dir))
+    start = time.perf_counter()
+    terms = Utils.extract_important_terms(clean_dir, max_features, stats_path)
+    full = summarize([], n_documents, time.perf_counter() - start)
+    if not terms:
+        raise RuntimeError(f"No terms were extracted from the {n_documents} cleaned documents.")
+    start = time.perf_counter()
+    Utils.extract_important_terms(clean_dir, max_features, stats_path)
+    return {'full': full, 'incremental': summarize([], n_documents, time.perf_counter() - start)}
+
+
+# Runs and comparisons
+
+def git_commit() -> Tuple[Optional[str], bool]:
+    """The current commit of the repository and whether its working tree has changes."""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=directory, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=directory,
+                                capture_output=True, text=True, check=True).stdout
+        return commit, bool(status.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+
+
+def run(sizes: List[str] = ('1k',), cases: List[str] = CASES, seed: int = 0, n_documents: Optional[int] = None,
+        trace_memory: bool = True, workdir: Optional[str] = None) -> dict:
+    """
+    Runs the benchmark cases at each knowledge base size, offline.
+
+    Every case is timed with tracemalloc on (unless trace_memory is False) and
+    reports its peak traced memory, so timings are comparable between runs with
+    the same settings but include the tracing overhead.
+
+    Parameters:
+        sizes (List[str]): Keys of SIZES.
+        cases (List[str]): Some of 'ingest', 'query' (which needs 'ingest'), 'clean' and 'tfidf' (which needs 'clean').
+        seed (int): The seed of every synthetic dataset.
+        n_documents (Optional[int]): The size of the text corpus; scales with the knowledge base by default.
+        trace_memory (bool): Whether to measure peak memory.
+        workdir (Optional[str]): Where the synthetic data is written; a temporary directory by default.
+
+    Returns:
+        dict: The results per size and case, with the commit and environment they were measured on.
+    """
+    commit, dirty = git_commit()
+    report = {
+        'format_version': RESULTS_FORMAT_VERSION,
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'seed': seed,
+        'results': {},
+    }
+    for size in sizes:
+        n_terms = SIZES[size]
+        size_dir = tempfile.mkdtemp(prefix=f'benchmark_{size}_', dir=workdir)
+        documents = n_documents or max(10, min(n_terms // 500, 500))
+        results = report['results'][size] = {'terms': n_terms, 'documents': documents}
+        try:
+            if 'ingest' in cases:
+                results['ingest'] = traced(lambda: bench_ingest(size_dir, n_terms, seed), trace_memory)
+                if 'query' in cases:
+                    results['query'] = traced(lambda: bench_query(size_dir, n_terms, seed), trace_memory)
+            if 'clean' in cases:
+                results['clean'] = traced(lambda: bench_clean(size_dir, documents, seed), trace_memory)
+                if 'tfidf' in cases:
+                    results['tfidf'] = traced(lambda: bench_tfidf(size_dir, seed), trace_memory)
+        finally:
+            shutil.rmtree(size_dir, ignore_errors=True)
+        print(f"{size}: done")
+    return report
+
+
+def flatten(results: dict, prefix: str = "") -> Dict[str, float]:
+    """Flattens nested results into {'100k/query/exact/p99_ms': value} form (numbers only)."""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}/{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def metric_direction(name: str) -> int:
+    """1 if higher is better, -1 if lower is better, 0 if the metric is not a measurement."""
+    metric = name.rsplit('/', 1)[-1]
+    if metric.endswith('per_sec'):
+        return 1
+    if metric.endswith('_ms') or metric in ('seconds', 'peak_mb'):
+        return -1
+    return 0
+
+
+def compare(baseline: dict, current: dict, tolerance: float = 0.10) -> List[dict]:
+    """
+    Compares two result files metric by metric.
+
+    Parameters:
+        baseline (dict): The results of the reference commit.
+        current (dict): The results to check.
+        tolerance (float): The relative change beyond which a worse value counts as a regression.
+
+    Returns:
+        List[dict]: Per shared metric, the two values, the relative change and whether it regressed.
+    """
+    old, new = flatten(baseline['results']), flatten(current['results'])
+    rows = []
+    for name in sorted(old.keys() & new.keys()):
+        direction = metric_direction(name)
+        if not direction or not old[name]:
+            continue
+        change = (new[name] - old[name]) / abs(old[name])
+        rows.append({'metric': name, 'baseline': old[name], 'current': new[name], 'change': change,
+                     'regression': change * direction < -tolerance})
+    return rows
+
+
+def print_comparison(rows: List[dict], baseline: dict, current: dict):
+    print(f"baseline {baseline.get('commit')} -> current {current.get('commit')}")
+    for row in rows:
+        flag = "  REGRESSION" if row['regression'] else ""
+        print(f"{row['metric']:<55} {row['baseline']:>14.4g} {row['current']:>14.4g} {100 * row['change']:+8.1f}%{flag}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmarks of retrieval, ingestion, cleaning and TF-IDF.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help="Run the benchmarks and write the results as JSON.")
+    run_parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=['1k'])
+    run_parser.add_argument('--cases', nargs='+', choices=CASES, default=list(CASES))
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--documents', type=int, default=None, help="Size of the text corpus.")
+    run_parser.add_argument('--no-trace-memory', action='store_true')
+    run_parser.add_argument('--workdir', default=None)
+    run_parser.add_argument('--output', default='benchmark_results.json')
+    compare_parser = subparsers.add_parser('compare', help="Compare two result files.")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--tolerance', type=float, default=0.10)
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        report = run(args.sizes, args.cases, args.seed, args.documents, not args.no_trace_memory, args.workdir)
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=1)
+        print(f"Results written to {args.output}")
+    else:
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            baseline = json.load(file)
+        with open(args.current, 'r', encoding='utf-8') as file:
+            current = json.load(file)
+        rows = compare(baseline, current, args.tolerance)
+        print_comparison(rows, baseline, current)
+        sys.exit(1 if any(row['regression'] for row in rows) else 0)
@@ -1,49 +1,104 @@
-import OpenAIEmbedder
-import ChatbotDatabase
+from OpenAIEmbedder import OpenAIEmbedder
+from EmbeddingCache import EmbeddingCache
+from KnowledgeBase import ChatbotDatabase
+from NLPService import get_nlp_service
+from PresidentIndex import PresidentIndex
+from PreferenceStore import PreferenceStore
+from SemanticCache import SemanticCache
+from ShardedKnowledgeBase import ShardedKnowledgeBase
+from Instrumentation import REGISTRY, timed
+import os
 import numpy as np
+from dataclasses import dataclass, field
 from typing import Optional, List, Tuple
-import spacy
-import xml.etree.ElementTree as ET
 
+DATABASE_PATH = '/content/drive/MyDrive/Colab Notebooks/chatbot_database.db'
+EMBEDDING_CACHE_PATH = '/content/drive/MyDrive/Colab Notebooks/embedding_cache.db'
+PRESIDENT_INDEX_PATH = '/content/drive/MyDrive/Colab Notebooks/president_index.json'
 
-# Initialize NLP model for Named-entity Recognition (NER)
-nlp = spacy.load("en_core_web_sm")
 
-DATABASE_PATH = '/content/drive/MyDrive/Colab Notebooks/chatbot_database.db'
+@dataclass
+class QueryResult:
+    """The outcome of answering one question extracted from a user query."""
+    question: str
+    fact: Optional[str] = None
+    similarity: float = 0.0
+    related_questions: List[str] = field(default_factory=list)
+    processed: bool = True  # False if the question could not be embedded
+    source: str = "hybrid"  # "lexical" if an exact term match answered it without an embedding, "cache" if a paraphrase did
 
 
 class ChatBot:
-    def __init__(self):
+    def __init__(self, embedder=None, database: Optional[ChatbotDatabase] = None,
+                 president_index: Optional[PresidentIndex] = None, preferences: Optional[PreferenceStore] = None,
+                 semantic_cache: Optional[SemanticCache] = None):
+        """
+        Sets up the chatbot. The embedder, database, president index and preference store are
+        built from the default paths unless given; ChatServer shares one ChatBot between sessions.
+        Answers are cached in semantic_cache (a default SemanticCache unless given).
+        """
         self.greetings = ["Hello! I'm here to help you learn about U.S. Presidents.",
                           "Hi there! Ask me anything about U.S. Presidents."]
         self.user_name = ""
         self.favorite_president = ""
-        self.embedder = OpenAIEmbedder()
-        self.database = ChatbotDatabase(DATABASE_PATH)
+        self.favorite_president_ids = []
+        self.embedder = embedder or OpenAIEmbedder(cache=EmbeddingCache(EMBEDDING_CACHE_PATH))
+        if president_index is None and os.path.exists(PRESIDENT_INDEX_PATH):
+            president_index = PresidentIndex.load(PRESIDENT_INDEX_PATH)
+        self.president_index = president_index
+        self.database = database or ChatbotDatabase(
+            DATABASE_PATH, entity_resolver=president_index.resolve if president_index else None)
+        self.preferences = preferences or PreferenceStore(self.database)
+        self.semantic_cache = semantic_cache or SemanticCache()
+        REGISTRY.register_collector('semantic_cache', self.semantic_cache.stats)
         self.similarity_threshold = 0.5
+        self.nlp = get_nlp_service()  # Shared by every session; models load on first use
 
     def introduce_and_ask_info(self):
         print(np.random.choice(self.greetings))
         user_input = input("What's your name? ")
         self.user_name = self.extract_name(user_input)
-        print(f"Nice to meet you, {self.user_name}! Which U.S. President would you like to learn about?")
+        self.load_preference()
+        if self.favorite_president:
+            print(f"Welcome back, {self.user_name}! Last time you asked about {self.favorite_president}.")
+            answer = input(f"Would you like to continue with {self.favorite_president}? (Y/n) ")
+            if answer.strip().lower() in ("", "y", "yes"):
+                return
+            print("Which U.S. President would you like to learn about?")
+        else:
+            print(f"Nice to meet you, {self.user_name}! Which U.S. President would you like to learn about?")
         pres_input = input()
         self.favorite_president = self.extract_president(pres_input)
         self.save_preference()
 
     def extract_name(self, text: str) -> str:
-        doc = nlp(text)
-        for ent in doc.ents:
-            if ent.label_ == "PERSON":
-                return ent.text
-        return "there"  # Default if no name is found
+        return self.nlp.first_entity(text, "PERSON") or "there"  # Default if no name is found
+
+    def resolve_president(self, text: str) -> Tuple[str, List[str]]:
+        """
+        Resolves the president mentioned in a text with the gazetteer, falling back to NER.
+
+        Returns:
+        - Tuple[str, List[str]]: The president's name and the matching president ids
+          (empty if the gazetteer found none).
+        """
+        if self.president_index is not None:
+            president_ids = self.president_index.resolve(text)
+            if president_ids:
+                return self.president_index.name(president_ids[0]), president_ids
+        return self.nlp.first_entity(text, "PERSON") or "Unknown", []  # Default if no president is found
 
     def extract_president(self, text: str) -> str:
-        doc = nlp(text)
-        for ent in doc.ents:
-            if ent.label_ == "PERSON":
-                return ent.text
-        return "Unknown"  # Default if no president is found
+        president, self.favorite_president_ids = self.resolve_president(text)
+        return president
+
+    def mentioned_term_ids(self, question: str) -> Optional[List[int]]:
+        """The terms of the presidents a question mentions, to restrict its search to; None searches all terms."""
+        if self.president_index is None:
+            return None
+        president_ids = self.president_index.resolve(question)
+        term_ids = self.database.term_ids_for_entities(president_ids) if president_ids else []
+        return term_ids or None
     
     def extract_questions(self, text: str) -> List[str]:
         """
@@ -55,60 +110,177 @@ class ChatBot:
         Returns:
         - List[str]: A list of strings, each a question found in the input text.
         """
-        questions = []
-        doc = nlp(text)
-        for sent in doc.sents:
-            if sent.text.strip().endswith('?'):
-                questions.append(sent.text.strip())
-        return questions
+        with timed("nlp_split"):
+            return self.nlp.questions(text)
+
+    def load_preference(self):
+        """Restores the favorite president saved for the current user, if any."""
+        preferences = self.preferences.get(self.user_name)
+        self.favorite_president = preferences.get("favorite_president", self.favorite_president)
+        self.favorite_president_ids = preferences.get("favorite_president_ids", self.favorite_president_ids)
 
     def save_preference(self):
-        root = ET.Element("UserPreferences")
-        ET.SubElement(root, "Name").text = self.user_name
-        ET.SubElement(root, "FavoritePresident").text = self.favorite_president
-        tree = ET.ElementTree(root)
-        tree.write("user_preferences.xml")
+        """Queues the current user's preferences; the store writes them to the database in the background."""
+        self.preferences.set(self.user_name, name=self.user_name, favorite_president=self.favorite_president,
+                             favorite_president_ids=self.favorite_president_ids)
 
     
-    def handle_user_query(self, query: str):
-      # Extract questions from the query; if none, treat the entire query as a single question.
-      extracted_questions = self.extract_questions(query)
-    
-      if not extracted_questions:
-        extracted_questions = [query]
-    
-      # Process each question separately
-      for question in extracted_questions:
-        # Generate an embedding for the question
-        question_embedding = self.embedder.get_embedding(question)
-        
-        if question_embedding is not None:
-            # Retrieve relevant facts based on the embedding
-            retrieved_facts = self.database.retrieve_facts_by_embedding(question_embedding)
-
-            # Check if the top fact meets the similarity threshold
-            if retrieved_facts and retrieved_facts[0][2] >= self.similarity_threshold:
-                print(f"🔍 For your question: \"{question}\"")
-                print(f"✨ Interesting Fact: {retrieved_facts[0][1]}")
+    @timed("answer")
+    def answer_questions(self, questions: List[str], hint: Optional[List[str]] = None) -> List[QueryResult]:
+        """
+        Answers several questions as one batch.
 
-                # Suggest additional related questions
-                print("🤔 You might also find these questions intriguing:")
-                for fact in retrieved_facts[1:]:
-                    if fact[2] >= self.similarity_threshold - 0.2:
-                        print(f"- {self.database.retrieve_term_by_term_id(fact[0])}")
-                        print("\n")  # Enhance readability with a newline between questions
+        Questions that match a stored term exactly are answered from the full-text
+        index without calling the embedder. The others are embedded in a single
+        batched call; paraphrases of recently answered questions are served from the
+        semantic cache, and the rest are searched with one hybrid (BM25 plus
+        embedding) lookup per president filter (see mentioned_term_ids). Filtered
+        questions without a good enough answer are searched again among all
+        terms, in one more lookup. The related-question suggestions of every
+        answer are resolved with a single term lookup.
+
+        Parameters:
+        - questions (List[str]): The questions to answer.
+        - hint (Optional[List[str]]): The ids of the president the user is interested in; a
+          ShardedKnowledgeBase searches their shard when a question names no president.
+          Defaults to favorite_president_ids.
+
+        Returns:
+        - List[QueryResult]: One result per question, in the same order.
+        """
+        hint = self.favorite_president_ids if hint is None else hint
+        # Only a sharded store routes by the presidents the conversation is about
+        routing = {'hint': hint} if isinstance(self.database, ShardedKnowledgeBase) else {}
+        results = [QueryResult(question) for question in questions]
+        version = self.database.knowledge_version()
+        self.semantic_cache.validate(version)
+        # Questions naming a president are searched among that president's terms only
+        with timed("entity_filter", items=len(questions)):
+            filters = [self.mentioned_term_ids(question) for question in questions]
+
+        answered, all_retrieved, to_embed = [], [], []
+        for i, (result, term_ids) in enumerate(zip(results, filters)):
+            retrieved_facts = self.database.lexical_match(result.question, term_ids)
+            if retrieved_facts is None:
+                to_embed.append(i)
             else:
-                 # Handle cases where no satisfying facts were found
-                  print(f"🧐 For your question: \"{question}\", I couldn't find enough information.")
-        else:
-              # Handle cases where the query couldn't be processed
-              print("❗ I'm sorry, I couldn't process your request. Please try rephrasing.")
+                result.source = "lexical"
+                answered.append(result)
+                all_retrieved.append(retrieved_facts)
+
+        searched = {}  # Position of each question answered by search -> (embedding, scope)
+        if to_embed:
+            with timed("embedding", items=len(to_embed)):
+                embeddings = self.embedder.get_embeddings([questions[i] for i in to_embed])
+            embedded = ~np.isnan(embeddings).any(axis=1)
+            for i, ok in zip(to_embed, embedded):
+                results[i].processed = bool(ok)
+            to_embed, embeddings = [i for i, ok in zip(to_embed, embedded) if ok], embeddings[embedded]
+            keys = [tuple(filters[i]) if filters[i] else None for i in to_embed]
+            # A routed store may answer differently for another hint, so the hint is part of the scope
+            scopes = [(key, tuple(hint)) for key in keys] if routing else keys
+            with timed("semantic_cache"):
+                cached = self.semantic_cache.get_many(embeddings, scopes) if to_embed else []
+
+            # Questions with the same filter share one multi-query lookup
+            groups = {}
+            for i, embedding, key, scope, hit in zip(to_embed, embeddings, keys, scopes, cached):
+                if hit is not None:
+                    result = results[i]
+                    result.fact, result.similarity, related_questions = hit
+                    result.related_questions = list(related_questions)
+                    result.source = "cache"
+                else:
+                    searched[i] = (embedding, scope)
+                    groups.setdefault(key, []).append((i, embedding))
+            fallback = []
+            for term_ids, members in groups.items():
+                retrieved = self.database.retrieve_facts_hybrid(
+                    [questions[i] for i, _ in members], np.array([embedding for _, embedding in members]),
+                    term_ids=list(term_ids) if term_ids else None, **routing)
+                for (i, embedding), retrieved_facts in zip(members, retrieved):
+                    if term_ids and not (retrieved_facts and retrieved_facts[0][2] >= self.similarity_threshold):
+                        # The name was likely not about the president (e.g. "Washington state")
+                        fallback.append((i, embedding))
+                        continue
+                    answered.append(results[i])
+                    all_retrieved.append(retrieved_facts)
+            if fallback:
+                retrieved = self.database.retrieve_facts_hybrid(
+                    [questions[i] for i, _ in fallback], np.array([embedding for _, embedding in fallback]),
+                    **routing)
+                for (i, _), retrieved_facts in zip(fallback, retrieved):
+                    answered.append(results[i])
+                    all_retrieved.append(retrieved_facts)
+
+        # Keep the best fact of each question and remember which related terms to suggest
+        related_term_ids = [[] for _ in answered]
+        for result, retrieved_facts, term_ids in zip(answered, all_retrieved, related_term_ids):
+            if not retrieved_facts or retrieved_facts[0][2] < self.similarity_threshold:
+                continue
+            answer_term_id, result.fact, result.similarity = retrieved_facts[0]
+            # Every retrieval path scores facts by the cosine similarity of their term
+            for term_id, _, similarity in retrieved_facts[1:]:
+                if similarity >= self.similarity_threshold - 0.2 and term_id != answer_term_id and term_id not in term_ids:
+                    term_ids.append(term_id)
+
+        needed = {term_id for term_ids in related_term_ids for term_id in term_ids}
+        terms = self.database.retrieve_terms_by_term_ids(list(needed)) if needed else {}
+        for result, term_ids in zip(answered, related_term_ids):
+            result.related_questions = [terms[term_id] for term_id in term_ids if term_id in terms]
 
+        if searched:
+            self.semantic_cache.put_many(
+                np.array([embedding for embedding, _ in searched.values()]),
+                [(results[i].fact, results[i].similarity, tuple(results[i].related_questions)) for i in searched],
+                [scope for _, scope in searched.values()], version)
+        return results
 
-        
+    @staticmethod
+    def format_results(results: List[QueryResult]) -> List[str]:
+        """Renders the answers to a user query as lines of text."""
+        lines = []
+        for result in results:
+            if not result.processed:
+                # Handle cases where the query couldn't be processed
+                lines.append("❗ I'm sorry, I couldn't process your request. Please try rephrasing.")
+            elif result.fact is None:
+                # Handle cases where no satisfying facts were found
+                lines.append(f"🧐 For your question: \"{result.question}\", I couldn't find enough information.")
+            else:
+                lines.append(f"🔍 For your question: \"{result.question}\"")
+                lines.append(f"✨ Interesting Fact: {result.fact}")
+
+                # Suggest additional related questions
+                lines.append("🤔 You might also find these questions intriguing:")
+                for related_question in result.related_questions:
+                    lines.append(f"- {related_question}")
+                    lines.append("\n")  # Enhance readability with a newline between questions
+        return lines
 
+    def display_results(self, results: List[QueryResult]):
+        """Prints the answers to a user query."""
+        for line in self.format_results(results):
+            print(line)
+
+    def handle_user_query(self, query: str) -> List[QueryResult]:
+        """
+        Answers every question in a user query and prints the answers.
 
+        Parameters:
+        - query (str): The raw user input.
+
+        Returns:
+        - List[QueryResult]: One result per extracted question.
+        """
+        # Extract questions from the query; if none, treat the entire query as a single question.
+        extracted_questions = self.extract_questions(query)
+        if not extracted_questions:
+            extracted_questions = [query]
 
+        results = self.answer_questions(extracted_questions)
+        self.display_results(results)
+        return results
 
 
 if __name__ == "__main__":
@@ -117,6 +289,7 @@ if __name__ == "__main__":
     while True:
         user_query = input("What would you like to know? Please format your input like a question and make sure it has ? at the end of that. ")
         if user_query.lower() == "exit":
+            chatbot.preferences.close()
             print("Goodbye!")
             break
         chatbot.handle_user_query(user_query)
@@ -1,6 +1,13 @@
+import hashlib
+import json
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, Optional
 import openai
 import re
+from RateLimitBackoff import RateLimitBackoff
+from Instrumentation import count_error, count_retry, timed
 
 
 OPENAI_API_KEY = ""
@@ -12,12 +19,25 @@ class PresidentsQA:
     Methods:
     generateQA(num_pairs: int) -> dict: Generates a specified number of general question-answer pairs about U.S. Presidents.
     generateQA_withTerm(term: str, num_pairs: int) -> dict: Generates a specified number of question-answer pairs about U.S. Presidents, incorporating a given term.
+    generate_for_terms(terms: list, num_pairs: int) -> dict: Generates question-answer pairs for many terms concurrently, without duplicate questions.
     """
 
-    def __init__(self):
+    def __init__(self, client=None, model="gpt-3.5-turbo", max_retries=6):
         """
         Initializes the PresidentsQA class by setting up the OpenAI client with an API key.
+
+        Parameters:
+        client (openai.OpenAI): The API client to use instead of one built from OPENAI_API_KEY,
+            e.g. one with a base_url pointing at a local stub of the chat endpoint.
+        model (str): The chat model.
+        max_retries (int): How many times a rate-limited or failed call is retried.
         """
+        self.model = model
+        self.max_retries = max_retries
+        self.backoff = RateLimitBackoff()
+        if client is not None:
+            self.client = client
+            return
         try:
             api_key = OPENAI_API_KEY
             if not api_key:
@@ -30,6 +50,9 @@ class PresidentsQA:
         """
         Internal method to make a chat completion API call to OpenAI.
 
+        Rate-limit, connection and server errors are retried with backoff shared
+        by every thread using this instance.
+
         Parameters:
         prompt (str): The prompt to send to the API.
 
@@ -37,18 +60,37 @@ class PresidentsQA:
         str: The API's response text.
         """
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "As a knowledgeable AI you provide a series of well-structured question-and-answer pairs related to U.S. presidents. Your responses should adhere to the following format:\n Q: [Clearly stated question about a U.S. president] \n A: [Concise and accurate answer to the question] \n Q: Which U.S. President signed the Emancipation Proclamation during the Civil War? \n A: Abraham Lincoln signed the Emancipation Proclamation on January 1, 1863, freeing enslaved individuals in the Confederate states."},
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            return response.choices[0].message.content.strip()
+            for attempt in range(self.max_retries + 1):
+                self.backoff.wait()
+                try:
+                    with timed("chat_call", items=1):
+                        response = self._create_completion(prompt)
+                    self.backoff.succeeded()
+                    return response.choices[0].message.content.strip()
+                except openai.RateLimitError as e:
+                    if attempt == self.max_retries:
+                        raise
+                    count_retry("chat", "rate_limit")
+                    self.backoff.rate_limited(e)
+                except (openai.APIConnectionError, openai.InternalServerError) as e:
+                    if attempt == self.max_retries:
+                        raise
+                    count_retry("chat", type(e).__name__)
+                    self.backoff.sleep_after_failure(attempt)
         except Exception as e:
+            count_error("chat", e)
             print(f"API call failed: {e}")
             return ""
 
+    def _create_completion(self, prompt):
+        return self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": "As a knowledgeable AI you provide a series of well-structured question-and-answer pairs related to U.S. presidents. Your responses should adhere to the following format:\n Q: [Clearly stated question about a U.S. president] \n A: [Concise and accurate answer to the question] \n Q: Which U.S. President signed the Emancipation Proclamation during the Civil War? \n A: Abraham Lincoln signed the Emancipation Proclamation on January 1, 1863, freeing enslaved individuals in the Confederate states."},
+                {"role": "user", "content": prompt}
+            ]
+        )
+
     def _parse_qa_pairs(self, text):
       """
       Parses the text to extract question and answer pairs following a specified format.
@@ -84,7 +126,7 @@ class PresidentsQA:
         if qa_pairs:
             for q, a in qa_pairs.items():
                 print(f"Q: {q}\nA: {a}\n")
-            return self._parse_qa_pairs(response)
+            return qa_pairs
         else:
             print("Failed to generate question and answer pairs.")
 
@@ -104,18 +146,105 @@ class PresidentsQA:
             print("Term is required.")
             return {}
         
-        prompt = f"Generate {num_pairs} question(s) and answer(s) about U.S. Presidents that include the term '{term}' in the question. Ensure the term '{term}' is included in the question  "
-        response = self._api_call(prompt)
+        response = self._api_call(self._term_prompt(term, num_pairs))
         qa_pairs = self._parse_qa_pairs(response)
         #print(response)
         if qa_pairs:
             for q, a in qa_pairs.items():
                 print(f"Q: {q}\nA: {a}\n")
-            return self._parse_qa_pairs(response)
+            return qa_pairs
         
         else:
             print("Failed to generate question and answer pairs with specified term.")
 
+    @staticmethod
+    def _term_prompt(term, num_pairs):
+        return f"Generate {num_pairs} question(s) and answer(s) about U.S. Presidents that include the term '{term}' in the question. Ensure the term '{term}' is included in the question  "
+
+    @staticmethod
+    def question_key(question):
+        """
+        Returns a hash identifying a question up to case, punctuation and spacing,
+        so near-identical questions from different responses collapse to one.
+        """
+        normalized = " ".join(re.sub(r"[^\w\s]", " ", question.lower()).split())
+        return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _load_checkpoint(checkpoint_path, num_pairs):
+        """
+        Reads the pairs of the terms finished by earlier runs from a JSONL checkpoint.
+        Only terms generated with the same num_pairs count as finished.
+        """
+        finished = {}
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            with open(checkpoint_path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # A line cut short by an interrupted run
+                    if record.get("num_pairs") == num_pairs:
+                        finished[record["term"]] = record["pairs"]
+        return finished
+
+    def generate_for_terms(self, terms: Iterable[str], num_pairs: int = 5, max_workers: int = 4,
+                           checkpoint_path: Optional[str] = None) -> Dict[str, str]:
+        """
+        Generates question-answer pairs for many terms, with up to max_workers calls in flight.
+
+        Every term whose pairs were generated is appended to the JSONL checkpoint,
+        with num_pairs, so an interrupted run with the same num_pairs resumes with
+        only the unfinished terms. Questions
+        that are identical up to case, punctuation and spacing are kept once, the
+        first one in term order winning.
+
+        Parameters:
+        terms (Iterable[str]): The terms to include in the questions.
+        num_pairs (int): The number of question-answer pairs to generate per term.
+        max_workers (int): The maximum number of concurrent API calls.
+        checkpoint_path (Optional[str]): The JSONL file recording finished terms.
+
+        Returns:
+        dict: The deduplicated questions and their answers.
+        """
+        terms = list(dict.fromkeys(term for term in terms if term))
+        if num_pairs < 1:
+            print("Number of pairs must be at least 1.")
+            return {}
+
+        pairs_by_term = self._load_checkpoint(checkpoint_path, num_pairs)
+        pending = [term for term in terms if term not in pairs_by_term]
+        checkpoint_lock = threading.Lock()
+        checkpoint = open(checkpoint_path, 'a', encoding='utf-8') if checkpoint_path else None
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {executor.submit(self._api_call, self._term_prompt(term, num_pairs)): term
+                           for term in pending}
+                for future in as_completed(futures):
+                    term = futures[future]
+                    qa_pairs = self._parse_qa_pairs(future.result())
+                    if not qa_pairs:
+                        print(f"Failed to generate question and answer pairs for term '{term}'.")
+                        continue
+                    pairs_by_term[term] = qa_pairs
+                    if checkpoint is not None:
+                        with checkpoint_lock:
+                            checkpoint.write(json.dumps({"term": term, "num_pairs": num_pairs, "pairs": qa_pairs}) + "\n")
+                            checkpoint.flush()
+        finally:
+            if checkpoint is not None:
+                checkpoint.close()
+
+        all_pairs, seen = {}, set()
+        for term in terms:
+            for question, answer in pairs_by_term.get(term, {}).items():
+                key = self.question_key(question)
+                if key not in seen:
+                    seen.add(key)
+                    all_pairs[question] = answer
+        return all_pairs
+
 # Example usage
 if __name__ == "__main__":
     qa = PresidentsQA()
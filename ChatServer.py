@@ -0,0 +1,259 @@
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional
+import numpy as np
+from ChatBOT import ChatBot
+from Instrumentation import REGISTRY
+
+
+@dataclass
+class Session:
+    """The state of one connected user."""
+    session_id: int
+    user_name: str = ""
+    favorite_president: str = ""
+    favorite_president_ids: List[str] = field(default_factory=list)
+    turns: int = 0
+
+
+class ChatServer:
+    """
+    An asyncio server that lets many users chat with one shared ChatBot.
+
+    The protocol is line-based JSON over TCP. The client sends one line of text
+    per turn; every reply is one JSON object per line. A plain line is a user
+    query; "/name <text>" and "/president <text>" set the session's user name
+    and favorite president, "/metrics" returns the instrumentation registry
+    as JSON, and "exit" ends the session. Preferences are kept
+    per user name in the chatbot's PreferenceStore, so "/name" restores the
+    favorite president a returning user chose in an earlier session.
+
+    Each connection has its own Session, so user state never leaks between
+    users. Turns run on a thread pool (embedding calls and database lookups
+    block), and at most max_in_flight turns are processed at once; further
+    turns wait for a slot, so a burst cannot exhaust the API or the database.
+    """
+
+    def __init__(self, chatbot: ChatBot, host: str = "127.0.0.1", port: int = 8765, max_in_flight: int = 32):
+        """
+        Initializes the server.
+
+        Parameters:
+            chatbot (ChatBot): The chatbot whose embedder, database and NLP service all sessions share.
+            host (str): The interface to listen on.
+            port (int): The port to listen on; 0 picks a free port.
+            max_in_flight (int): The maximum number of turns processed concurrently.
+        """
+        self.chatbot = chatbot
+        self.host = host
+        self.port = port
+        self.max_in_flight = max_in_flight
+        self.sessions = {}
+        self.requests = 0
+        self._session_ids = itertools.count(1)
+        self._slots = None
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="chat-turn")
+        self._server = None
+
+    async def start(self):
+        """Starts listening; with port 0, self.port is updated to the chosen port."""
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        asyncio.get_running_loop().set_default_executor(self._executor)
+        self._server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self._executor.shutdown(wait=False)
+        self.chatbot.preferences.flush()
+
+    @staticmethod
+    async def _send(writer: asyncio.StreamWriter, message: dict):
+        writer.write((json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8"))
+        await writer.drain()
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        session = Session(next(self._session_ids))
+        self.sessions[session.session_id] = session
+        try:
+            await self._send(writer, {"session": session.session_id, "text": np.random.choice(self.chatbot.greetings)})
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                text = line.decode("utf-8", errors="replace").strip()
+                if text.lower() == "exit":
+                    await self._send(writer, {"text": "Goodbye!"})
+                    break
+                if not text:
+                    continue
+                async with self._slots:
+                    self.requests += 1
+                    try:
+                        reply = await asyncio.to_thread(self.handle_turn, session, text)
+                    except Exception as e:
+                        reply = {"error": f"{type(e).__name__}: {e}"}
+                await self._send(writer, reply)
+        except ConnectionError:
+            pass
+        finally:
+            del self.sessions[session.session_id]
+            writer.close()
+
+    def handle_turn(self, session: Session, text: str) -> dict:
+        """Processes one line from a session on a worker thread and returns the reply."""
+        session.turns += 1
+        if text == "/metrics":
+            return {"metrics": REGISTRY.to_dict()}
+        if text.startswith("/name "):
+            session.user_name = self.chatbot.extract_name(text[len("/name "):])
+            preferences = self.chatbot.preferences.get(session.user_name)
+            if preferences.get("favorite_president"):
+                session.favorite_president = preferences["favorite_president"]
+                session.favorite_president_ids = preferences.get("favorite_president_ids", [])
+                return {"text": f"Welcome back, {session.user_name}! Last time you asked about {session.favorite_president}."}
+            return {"text": f"Nice to meet you, {session.user_name}! Which U.S. President would you like to learn about?"}
+        if text.startswith("/president "):
+            session.favorite_president, session.favorite_president_ids = \
+                self.chatbot.resolve_president(text[len("/president "):])
+            if session.user_name:
+                self.chatbot.preferences.set(session.user_name, name=session.user_name,
+                                             favorite_president=session.favorite_president,
+                                             favorite_president_ids=session.favorite_president_ids)
+            return {"text": f"Great choice: {session.favorite_president}."}
+
+        questions = self.chatbot.extract_questions(text) or [text]
+        results = self.chatbot.answer_questions(questions, hint=session.favorite_president_ids)
+        return {"answers": [asdict(result) for result in results], "text": "\n".join(self.chatbot.format_results(results))}
+
+
+# Load generation
+
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+async def run_load(host: str, port: int, clients: int = 32, queries_per_client: int = 50,
+                   queries: Optional[List[str]] = None) -> dict:
+    """
+    Opens clients concurrent sessions that each send queries_per_client queries back to back.
+
+    Returns:
+        dict: The number of queries, errors, the QPS and the p50/p99 latency in milliseconds.
+    """
+    queries = queries or [f"What did president number {i} do?" for i in range(100)]
+    latencies, errors = [], 0
+
+    async def client(client_no: int):
+        nonlocal errors
+        reader, writer = await asyncio.open_connection(host, port)
+        await reader.readline()  # Greeting
+        for i in range(queries_per_client):
+            start = time.perf_counter()
+            writer.write((queries[(client_no + i) % len(queries)] + "\n").encode("utf-8"))
+            await writer.drain()
+            reply = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - start)
+            errors += "error" in reply
+        writer.write(b"exit\n")
+        await writer.drain()
+        await reader.readline()
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(client_no) for client_no in range(clients)))
+    elapsed = time.perf_counter() - start
+    return {
+        'queries': len(latencies),
+        'errors': errors,
+        'seconds': elapsed,
+        'qps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': 1000 * percentile(latencies, 50),
+        'p99_ms': 1000 * percentile(latencies, 99),
+    }
+
+
+def benchmark(n_terms: int = 10_000, clients: int = 32, queries_per_client: int = 50, max_in_flight: int = 32,
+              embed_latency: float = 0.005) -> dict:
+    """
+    Serves a synthetic knowledge base with FakeEmbedder and measures it under load.
+
+    Two loads are run and reported separately: paraphrases of the stored terms,
+    which are embedded and searched, and the stored terms themselves, which the
+    lexical fast path answers without embedding.
+
+    Parameters:
+        n_terms (int): The number of synthetic terms (each with one fact) in the knowledge base.
+        clients (int): The number of concurrent sessions.
+        queries_per_client (int): The number of queries each session sends.
+        max_in_flight (int): The server's concurrency cap.
+        embed_latency (float): The simulated latency of each embedding call, in seconds.
+
+    Returns:
+        dict: The load-test results of each path ('vector' and 'lexical', see run_load)
+        and the semantic cache statistics.
+    """
+    from KnowledgeBase import ChatbotDatabase
+    from OpenAIEmbedder import FakeEmbedder
+
+    embedder = FakeEmbedder(latency=embed_latency)
+    database = ChatbotDatabase(':memory:')
+    terms = [f"What did president number {i} do?" for i in range(n_terms)]
+    database.bulk_add_terms(zip(terms, embedder.get_embeddings(terms)))
+    database.bulk_add_facts((term, f"Fact {i}.") for i, term in enumerate(terms))
+    chatbot = ChatBot(embedder=embedder, database=database)
+    loads = {
+        'vector': [f"Tell me what the president numbered {i} did." for i in range(min(n_terms, 1000))],
+        'lexical': terms[:1000],
+    }
+
+    async def main():
+        server = ChatServer(chatbot, port=0, max_in_flight=max_in_flight)
+        await server.start()
+        try:
+            return {path: await run_load(server.host, server.port, clients, queries_per_client, queries)
+                    for path, queries in loads.items()}
+        finally:
+            await server.close()
+
+    results = asyncio.run(main())
+    results['semantic_cache'] = chatbot.semantic_cache.stats()
+    for path in loads:
+        load = results[path]
+        print(f"{path}: {load['queries']} queries from {clients} clients: {load['qps']:.0f} QPS, "
+              f"p50 {load['p50_ms']:.1f} ms, p99 {load['p99_ms']:.1f} ms, {load['errors']} errors")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the chatbot to many users, or benchmark the server.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser("serve", help="Serve the chatbot with the default knowledge base.")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--max-in-flight", type=int, default=32)
+    bench_parser = subparsers.add_parser("bench", help="Load-test a server backed by FakeEmbedder.")
+    bench_parser.add_argument("--terms", type=int, default=10_000)
+    bench_parser.add_argument("--clients", type=int, default=32)
+    bench_parser.add_argument("--queries", type=int, default=50, help="Queries per client.")
+    bench_parser.add_argument("--max-in-flight", type=int, default=32)
+    bench_parser.add_argument("--embed-latency", type=float, default=0.005)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        asyncio.run(ChatServer(ChatBot(), args.host, args.port, args.max_in_flight).serve_forever())
+    else:
+        benchmark(args.terms, args.clients, args.queries, args.max_in_flight, args.embed_latency)
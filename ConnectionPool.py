@@ -0,0 +1,170 @@
+import itertools
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+
+class ConnectionPool:
+    """
+    A SQLite connection pool with one read connection per thread and a single writer.
+
+    Every thread that reads gets its own connection, so concurrent readers never
+    share cursor state; in WAL mode they also never block on the writer. All
+    writes are funnelled through one writer thread that owns the only write
+    connection. Writes queued while a transaction is being applied are grouped
+    into the next transaction (each in its own savepoint, so one failing write
+    does not undo the others), which amortizes the commit cost under load.
+    """
+
+    _memory_ids = itertools.count()
+
+    def __init__(self, db_path: str, configure: Optional[Callable[[sqlite3.Connection], None]] = None,
+                 cached_statements: int = 256, max_group_size: int = 64):
+        """
+        Initializes the pool and starts the writer thread.
+
+        Parameters:
+            db_path (str): The SQLite database file; ':memory:' uses a shared-cache in-memory database.
+            configure (Optional[Callable[[sqlite3.Connection], None]]): Called on every new connection,
+                e.g. to set pragmas.
+            cached_statements (int): The size of each connection's prepared-statement cache.
+            max_group_size (int): The maximum number of queued writes committed together.
+        """
+        self.in_memory = db_path == ':memory:'
+        self.db_path = f'file:memdb{next(self._memory_ids)}?mode=memory&cache=shared' if self.in_memory else db_path
+        self.configure = configure
+        self.cached_statements = cached_statements
+        self.max_group_size = max_group_size
+        self._local = threading.local()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+        self._closed = False
+
+        # The in-memory database lives as long as one connection to it stays open
+        self._keep_alive = self._connect() if self.in_memory else None
+        self._write_queue = queue.Queue()
+        started = Future()
+        self._writer = threading.Thread(target=self._write_loop, args=(started,), name='sqlite-writer', daemon=True)
+        self._writer.start()
+        started.result()
+
+    def _connect(self, **kwargs) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.db_path, uri=self.in_memory, timeout=30, check_same_thread=False,
+                                     cached_statements=self.cached_statements, **kwargs)
+        if self.configure is not None:
+            self.configure(connection)
+        return connection
+
+    def reader(self) -> sqlite3.Connection:
+        """Returns the calling thread's read connection, opening it on first use."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            if self._closed:
+                raise sqlite3.ProgrammingError("Cannot read from a closed connection pool.")
+            connection = self._local.connection = self._connect()
+            with self._readers_lock:
+                self._readers.append(connection)
+        return connection
+
+    def read(self, sql: str, params=()) -> list:
+        """Runs a query on the calling thread's read connection and returns all rows."""
+        return self.reader().execute(sql, params).fetchall()
+
+    def in_writer_thread(self) -> bool:
+        return threading.current_thread() is self._writer
+
+    def write(self, operation: Callable[[sqlite3.Connection], Any], transaction: bool = True) -> Any:
+        """
+        Runs an operation on the write connection and waits for it to be committed.
+
+        The operation must not commit or roll back itself. Writes issued from inside
+        another write operation run directly, as part of the enclosing transaction.
+
+        Parameters:
+            operation (Callable[[sqlite3.Connection], Any]): Receives the write connection.
+            transaction (bool): Whether to run inside a transaction; statements such
+                as VACUUM must run with transaction=False.
+
+        Returns:
+            Any: The operation's return value. Its exceptions are re-raised in the caller.
+        """
+        if self.in_writer_thread():
+            return operation(self._writer_connection)
+        if self._closed:
+            raise sqlite3.ProgrammingError("Cannot write to a closed connection pool.")
+        future = Future()
+        self._write_queue.put((operation, transaction, future))
+        return future.result()
+
+    def _write_loop(self, started: Future):
+        self._writer_connection = self._connect(isolation_level=None)
+        started.set_result(None)
+        pending = None
+        while True:
+            item = pending if pending is not None else self._write_queue.get()
+            pending = None
+            if item is None:
+                break
+            if not item[1]:
+                self._run_untransacted(*item)
+                continue
+            group = [item]
+            while len(group) < self.max_group_size:
+                try:
+                    next_item = self._write_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if next_item is None or not next_item[1]:
+                    pending = next_item  # Handled after this group commits
+                    break
+                group.append(next_item)
+            self._run_group(group)
+        self._writer_connection.close()
+
+    def _run_untransacted(self, operation, _, future: Future):
+        try:
+            future.set_result(operation(self._writer_connection))
+        except BaseException as e:
+            future.set_exception(e)
+
+    def _run_group(self, group: list):
+        connection = self._writer_connection
+        outcomes = []
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            for operation, _, future in group:
+                connection.execute('SAVEPOINT queued_write')
+                try:
+                    outcomes.append((future, True, operation(connection)))
+                    connection.execute('RELEASE queued_write')
+                except BaseException as e:
+                    connection.execute('ROLLBACK TO queued_write')
+                    connection.execute('RELEASE queued_write')
+                    outcomes.append((future, False, e))
+            connection.execute('COMMIT')
+        except BaseException as e:
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            outcomes = [(future, False, e) for _, _, future in group]
+        # Callers are only released once their write is durable
+        for future, ok, value in outcomes:
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def close(self):
+        """Stops the writer after the queued writes finish and closes every connection."""
+        if self._closed:
+            return
+        self._closed = True
+        self._write_queue.put(None)
+        self._writer.join()
+        with self._readers_lock:
+            for connection in self._readers:
+                connection.close()
+            self._readers.clear()
+        if self._keep_alive is not None:
+            self._keep_alive.close()
@@ -0,0 +1,190 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    A two-tier, content-addressed cache of text embeddings.
+
+    Entries are keyed by a hash of (model, model version, normalized text). The
+    first tier is an in-process LRU bounded by the total size of the cached
+    vectors; the second is an optional SQLite table on disk that several
+    processes can share. Entries older than the TTL, or written for another
+    model version, are treated as misses.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_memory_bytes: int = 64 * 1024 * 1024,
+                 ttl: Optional[float] = None, model_version: str = ""):
+        """
+        Initializes the cache.
+
+        Parameters:
+            path (Optional[str]): The SQLite file of the on-disk tier; None keeps the cache in memory only.
+            max_memory_bytes (int): The maximum total size of the vectors held in the LRU tier.
+            ttl (Optional[float]): The lifetime of an entry in seconds; None means entries never expire.
+            model_version (str): A version tag mixed into every key, so bumping it invalidates the cache.
+        """
+        self.max_memory_bytes = max_memory_bytes
+        self.ttl = ttl
+        self.model_version = model_version
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.connection = None
+        if path is not None:
+            self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS EmbeddingCache (
+                    key TEXT PRIMARY KEY,
+                    model_version TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    embedding BLOB NOT NULL
+                );
+            ''')
+            self.connection.commit()
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """Collapses all runs of whitespace, so texts that differ only in spacing share an entry."""
+        return " ".join(text.split())
+
+    def make_key(self, model: str, text: str) -> str:
+        """Returns the content hash identifying the embedding of a text under a model."""
+        content = "\0".join((model, self.model_version, self.normalize_text(text)))
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def _remember(self, key: str, embedding: np.ndarray, created_at: float):
+        """Adds an entry to the LRU tier, evicting the least recently used entries to stay under the size cap."""
+        if key in self._memory:
+            self._memory_bytes -= self._memory.pop(key)[0].nbytes
+        self._memory[key] = (embedding, created_at)
+        self._memory_bytes += embedding.nbytes
+        while self._memory_bytes > self.max_memory_bytes and self._memory:
+            _, (evicted, _) = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.nbytes
+
+    def _is_fresh(self, created_at: float, now: float) -> bool:
+        return self.ttl is None or now - created_at < self.ttl
+
+    def get_many(self, model: str, texts: List[str]) -> Dict[int, np.ndarray]:
+        """
+        Looks up the embeddings of several texts.
+
+        Returns:
+            Dict[int, np.ndarray]: The cached (read-only, float32) embeddings keyed by
+            position in texts; texts that missed are absent.
+        """
+        now = time.time()
+        keys = [self.make_key(model, text) for text in texts]
+        found, missing = {}, []
+        with self._lock:
+            for i, key in enumerate(keys):
+                entry = self._memory.get(key)
+                if entry is not None and self._is_fresh(entry[1], now):
+                    self._memory.move_to_end(key)
+                    found[i] = entry[0]
+                else:
+                    missing.append(i)
+            self.memory_hits += len(found)
+
+            if missing and self.connection is not None:
+                unique_keys = list({keys[i] for i in missing})
+                rows = {}
+                for start in range(0, len(unique_keys), 500):
+                    chunk = unique_keys[start:start + 500]
+                    placeholders = ', '.join('?' * len(chunk))
+                    rows.update((key, (created_at, blob)) for key, created_at, blob in self.connection.execute(
+                        f'SELECT key, created_at, embedding FROM EmbeddingCache '
+                        f'WHERE key IN ({placeholders}) AND model_version = ?', chunk + [self.model_version]))
+                still_missing = []
+                for i in missing:
+                    row = rows.get(keys[i])
+                    if row is not None and self._is_fresh(row[0], now):
+                        embedding = np.frombuffer(row[1], dtype=np.float32)
+                        self._remember(keys[i], embedding, row[0])
+                        found[i] = embedding
+                        self.disk_hits += 1
+                    else:
+                        still_missing.append(i)
+                missing = still_missing
+            self.misses += len(missing)
+        return found
+
+    def get(self, model: str, text: str) -> Optional[np.ndarray]:
+        """Returns the cached (read-only, float32) embedding of a text, or None on a miss."""
+        return self.get_many(model, [text]).get(0)
+
+    def put_many(self, model: str, texts: List[str], embeddings: np.ndarray):
+        """Stores the embeddings of several texts in both tiers, writing the disk tier in one transaction."""
+        now = time.time()
+        rows = []
+        with self._lock:
+            for text, embedding in zip(texts, embeddings):
+                embedding = np.array(embedding, dtype=np.float32)
+                embedding.flags.writeable = False
+                key = self.make_key(model, text)
+                self._remember(key, embedding, now)
+                rows.append((key, self.model_version, now, embedding.tobytes()))
+            if self.connection is not None and rows:
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO EmbeddingCache (key, model_version, created_at, embedding) '
+                    'VALUES (?, ?, ?, ?)', rows)
+                self.connection.commit()
+
+    def put(self, model: str, text: str, embedding: np.ndarray):
+        """Stores the embedding of a single text."""
+        self.put_many(model, [text], [embedding])
+
+    def purge(self):
+        """Deletes expired entries and entries of other model versions from both tiers."""
+        now = time.time()
+        with self._lock:
+            for key in [key for key, (_, created_at) in self._memory.items() if not self._is_fresh(created_at, now)]:
+                self._memory_bytes -= self._memory.pop(key)[0].nbytes
+            if self.connection is not None:
+                self.connection.execute('DELETE FROM EmbeddingCache WHERE model_version != ?', (self.model_version,))
+                if self.ttl is not None:
+                    self.connection.execute('DELETE FROM EmbeddingCache WHERE created_at < ?', (now - self.ttl,))
+                self.connection.commit()
+
+    def clear(self):
+        """Empties both tiers."""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            if self.connection is not None:
+                self.connection.execute('DELETE FROM EmbeddingCache')
+                self.connection.commit()
+
+    def stats(self) -> dict:
+        """Returns the hit/miss counters and the current size of the memory tier."""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            'memory_entries': len(self._memory),
+            'memory_bytes': self._memory_bytes,
+        }
+
+
+# Example usage
+if __name__ == "__main__":
+    cache = EmbeddingCache(os.path.join(os.getcwd(), 'embedding_cache.db'), ttl=30 * 24 * 3600)
+    cache.put("text-embedding-3-small", "Who was the first U.S. President?", np.random.rand(256))
+    start = time.perf_counter()
+    embedding = cache.get("text-embedding-3-small", "Who was the first  U.S. President?")
+    print(f"Cache lookup took {1e6 * (time.perf_counter() - start):.1f} µs; {cache.stats()}")
@@ -0,0 +1,97 @@
+import struct
+from typing import Optional, Tuple
+import numpy as np
+
+# Versioned embedding BLOB layout: a fixed header followed by the packed vector.
+#   magic (4 bytes) | version (uint8) | dtype code (uint8) | dim (uint32) | scale (float32)
+# BLOBs without the magic prefix are legacy raw float64 vectors.
+MAGIC = b'EMBQ'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sBBIf')
+
+DTYPES = {
+    'float32': (1, np.float32),
+    'float16': (2, np.float16),
+    'int8': (3, np.int8),
+}
+DTYPE_NAMES = {code: name for name, (code, _) in DTYPES.items()}
+
+
+def quantize(vectors: np.ndarray, dtype: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Converts float vectors (or rows of a matrix) to a storage dtype.
+
+    int8 uses symmetric per-row scalar quantization: each row is divided by
+    max(|x|) / 127 and rounded, and that divisor is returned as the row's scale.
+
+    Parameters:
+        vectors (np.ndarray): A vector or an (n, dim) matrix.
+        dtype (str): 'float32', 'float16' or 'int8'.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The converted data and the per-row scales
+        (all 1.0 for the float dtypes).
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f"Unsupported embedding dtype '{dtype}'; expected one of {list(DTYPES)}.")
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dtype != 'int8':
+        return vectors.astype(DTYPES[dtype][1]), np.ones(vectors.shape[:-1], dtype=np.float32)
+    scales = np.abs(vectors).max(axis=-1) / 127.0
+    scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+    codes = np.rint(vectors / scales[..., None]).clip(-127, 127).astype(np.int8)
+    return codes, scales
+
+
+def dequantize(data: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    """Converts quantized data back to float32 using its per-row scales."""
+    return data.astype(np.float32) * np.asarray(scales, dtype=np.float32)[..., None]
+
+
+def encode_embedding(embedding: np.ndarray, dtype: str = 'float32') -> bytes:
+    """
+    Packs an embedding into a versioned BLOB.
+
+    Parameters:
+        embedding (np.ndarray): The embedding vector.
+        dtype (str): The storage dtype: 'float32', 'float16' or 'int8'.
+
+    Returns:
+        bytes: The header followed by the quantized vector.
+    """
+    data, scale = quantize(np.ravel(embedding), dtype)
+    return HEADER.pack(MAGIC, FORMAT_VERSION, DTYPES[dtype][0], data.shape[0], float(scale)) + data.tobytes()
+
+
+def decode_header(blob: bytes) -> Optional[Tuple[str, int, float]]:
+    """Returns the (dtype, dim, scale) of a versioned BLOB, or None for a legacy float64 BLOB."""
+    if len(blob) < HEADER.size or blob[:len(MAGIC)] != MAGIC:
+        return None
+    _, version, code, dim, scale = HEADER.unpack_from(blob)
+    if version != FORMAT_VERSION or code not in DTYPE_NAMES:
+        raise ValueError(f"Unsupported embedding format version {version} / dtype code {code}.")
+    return DTYPE_NAMES[code], dim, scale
+
+
+def decode_embedding(blob: bytes) -> Optional[np.ndarray]:
+    """
+    Unpacks a stored embedding BLOB into a float32 vector.
+
+    Both the versioned format and legacy raw float64 BLOBs are accepted.
+
+    Returns:
+        Optional[np.ndarray]: The embedding, or None if the BLOB is not a valid embedding.
+    """
+    try:
+        header = decode_header(blob)
+    except ValueError:
+        return None
+    if header is None:
+        if not blob or len(blob) % np.dtype(np.float64).itemsize:
+            return None
+        return np.frombuffer(blob, dtype=np.float64).astype(np.float32)
+    dtype, dim, scale = header
+    data = np.frombuffer(blob, dtype=DTYPES[dtype][1], offset=HEADER.size)
+    if data.shape[0] != dim:
+        return None
+    return data.astype(np.float32) * np.float32(scale)
@@ -0,0 +1,164 @@
+import json
+import os
+from typing import Iterator, List, Optional, Tuple
+import numpy as np
+
+FORMAT_VERSION = 1
+
+
+class EmbeddingDataset:
+    """
+    An append-only, on-disk dataset of texts and their embeddings.
+
+    The dataset is a directory with three files:
+      embeddings.f32  the embeddings as one fixed-width row of float32 per text (C order, no header)
+      records.jsonl   one JSON object per row, holding the text and any extra fields (e.g. a fact)
+      meta.json       the format version, the embedding dimension and the number of committed rows
+
+    Rows are appended in chunks; meta.json is rewritten atomically after both data
+    files, so the committed row count never points past complete data. Rows
+    written by an interrupted append are truncated away the next time the
+    dataset is opened. Reads memory-map the embedding file, so a matrix of any
+    size is available without copying it into memory.
+    """
+
+    EMBEDDINGS_FILE = 'embeddings.f32'
+    RECORDS_FILE = 'records.jsonl'
+    META_FILE = 'meta.json'
+
+    def __init__(self, path: str, dim: Optional[int] = None):
+        """
+        Opens a dataset, creating it if it does not exist.
+
+        Parameters:
+            path (str): The dataset directory.
+            dim (Optional[int]): The embedding dimension; taken from the first append if omitted.
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        meta_path = os.path.join(path, self.META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as file:
+                meta = json.load(file)
+            if meta['format_version'] != FORMAT_VERSION:
+                raise ValueError(f"Unsupported embedding dataset version {meta['format_version']}.")
+            if dim is not None and meta['dim'] is not None and dim != meta['dim']:
+                raise ValueError(f"Dataset has dimension {meta['dim']}, not {dim}.")
+            self.dim, self.rows = meta['dim'], meta['rows']
+        else:
+            self.dim, self.rows = dim, 0
+        self._truncate_uncommitted()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _truncate_uncommitted(self):
+        """Drops data appended after the last committed row count."""
+        embeddings_path = self._file(self.EMBEDDINGS_FILE)
+        size = self.rows * (self.dim or 0) * 4
+        if os.path.exists(embeddings_path) and os.path.getsize(embeddings_path) > size:
+            os.truncate(embeddings_path, size)
+        records_path = self._file(self.RECORDS_FILE)
+        if os.path.exists(records_path):
+            with open(records_path, 'rb+') as file:
+                for _ in range(self.rows):
+                    file.readline()
+                file.truncate(file.tell())
+
+    def _write_meta(self):
+        meta_path = self._file(self.META_FILE)
+        with open(meta_path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump({'format_version': FORMAT_VERSION, 'dim': self.dim, 'rows': self.rows,
+                       'dtype': 'float32'}, file)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def append(self, texts: List[str], embeddings: np.ndarray, extra: Optional[List[dict]] = None):
+        """
+        Appends a chunk of rows.
+
+        Parameters:
+            texts (List[str]): The texts.
+            embeddings (np.ndarray): A (len(texts), dim) matrix; stored as float32.
+            extra (Optional[List[dict]]): Additional JSON fields stored with each text, one dict per text.
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if embeddings.ndim != 2 or embeddings.shape[0] != len(texts):
+            raise ValueError("Expected one embedding row per text.")
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+        elif embeddings.shape[1] != self.dim:
+            raise ValueError(f"Expected embeddings of dimension {self.dim}, got {embeddings.shape[1]}.")
+        if extra is None:
+            extra = [{}] * len(texts)
+        elif len(extra) != len(texts):
+            raise ValueError(f"Expected one extra dict per text, got {len(extra)} for {len(texts)} texts.")
+
+        with open(self._file(self.EMBEDDINGS_FILE), 'ab') as file:
+            file.write(embeddings.tobytes())
+        with open(self._file(self.RECORDS_FILE), 'a', encoding='utf-8') as file:
+            file.writelines(json.dumps({**fields, 'text': text}, ensure_ascii=False) + '\n'
+                            for text, fields in zip(texts, extra))
+        self.rows += len(texts)
+        self._write_meta()
+
+    def embeddings(self) -> np.ndarray:
+        """Returns the (rows, dim) float32 embedding matrix, memory-mapped read-only."""
+        if not self.rows:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        return np.memmap(self._file(self.EMBEDDINGS_FILE), dtype=np.float32, mode='r', shape=(self.rows, self.dim))
+
+    def iter_records(self) -> Iterator[dict]:
+        """Yields the committed records (text plus extra fields) in row order."""
+        if not self.rows:
+            return
+        with open(self._file(self.RECORDS_FILE), 'r', encoding='utf-8') as file:
+            for _, line in zip(range(self.rows), file):
+                yield json.loads(line)
+
+    def texts(self) -> List[str]:
+        return [record['text'] for record in self.iter_records()]
+
+    def iter_chunks(self, chunk_rows: int = 10000) -> Iterator[Tuple[List[dict], np.ndarray]]:
+        """Yields (records, embeddings) in chunks; the embeddings are views of the memory map."""
+        embeddings = self.embeddings()
+        records, start = [], 0
+        for record in self.iter_records():
+            records.append(record)
+            if len(records) == chunk_rows:
+                yield records, embeddings[start:start + chunk_rows]
+                records, start = [], start + chunk_rows
+        if records:
+            yield records, embeddings[start:]
+
+    def load_into_database(self, db, batch_size: int = 10000, fact_field: str = 'fact') -> dict:
+        """
+        Bulk-inserts the dataset into a ChatbotDatabase: each text as a term with its
+        embedding, and the fact_field of each record, when present, as the term's fact.
+        Rows whose embedding failed (NaN) are skipped.
+
+        Returns:
+            dict: The ingestion reports of the terms and facts.
+        """
+        def terms():
+            for records, embeddings in self.iter_chunks(batch_size):
+                valid = ~np.isnan(embeddings).any(axis=1)
+                for record, embedding, ok in zip(records, embeddings, valid):
+                    if ok:
+                        yield record['text'], embedding
+
+        def facts():
+            for record in self.iter_records():
+                if record.get(fact_field) is not None:
+                    yield record['text'], record[fact_field]
+
+        return {'terms': db.bulk_add_terms(terms(), batch_size), 'facts': db.bulk_add_facts(facts(), batch_size)}
+
+
+# Example usage
+if __name__ == "__main__":
+    dataset = EmbeddingDataset("embeddings_dataset")
+    matrix = dataset.embeddings()
+    print(f"{len(dataset)} embeddings of dimension {dataset.dim}, {matrix.nbytes / 2 ** 20:.1f} MiB memory-mapped")
@@ -0,0 +1,400 @@
+import hashlib
+import queue
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Iterable, List, Optional, Tuple
+import numpy as np
+from ChatGPTCrawler import PresidentsQA
+from KnowledgeBase import ChatbotDatabase
+from TermStatistics import TermStatistics
+from Utils import clean_doc, load_cleaning_model
+
+_DONE = object()  # Sent downstream when a stage has no more items
+
+
+@dataclass
+class StageStats:
+    """Counters of one pipeline stage."""
+    name: str
+    received: int = 0
+    emitted: int = 0
+    skipped: int = 0
+    busy_seconds: float = 0.0
+    wall_seconds: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def items_per_sec(self) -> float:
+        """Throughput while the stage was doing work (excluding time spent waiting on its neighbours)."""
+        return self.received / self.busy_seconds if self.busy_seconds else 0.0
+
+    def as_dict(self) -> dict:
+        return {'received': self.received, 'emitted': self.emitted, 'skipped': self.skipped,
+                'busy_seconds': self.busy_seconds, 'wall_seconds': self.wall_seconds,
+                'items_per_sec': self.items_per_sec, 'error': self.error}
+
+
+class TermBatch:
+    """
+    Terms sent to Q&A generation together. They are checkpointed only once every
+    question generated for them has been inserted, so an interrupted run sends
+    them again; questions already inserted are then skipped.
+    """
+
+    def __init__(self, terms: List[str]):
+        self.terms = terms
+        self._pending = 1  # Held by the Q&A stage until it has emitted all the batch's questions
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            self._pending += 1
+
+    def release(self) -> bool:
+        """Returns True when the last question of the batch is done."""
+        with self._lock:
+            self._pending -= 1
+            return self._pending == 0
+
+
+class PipelineCheckpoint:
+    """The keys of the items each stage has finished, in a SQLite file, so a rerun skips them."""
+
+    def __init__(self, path: str = ':memory:'):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS PipelineCheckpoints (
+                stage TEXT NOT NULL,
+                key TEXT NOT NULL,
+                PRIMARY KEY (stage, key)
+            ) WITHOUT ROWID;
+        ''')
+        self.connection.commit()
+
+    def done(self, stage: str, key: str) -> bool:
+        with self._lock:
+            return self.connection.execute('SELECT 1 FROM PipelineCheckpoints WHERE stage = ? AND key = ?',
+                                           (stage, key)).fetchone() is not None
+
+    def mark(self, stage: str, keys: Iterable[str]):
+        with self._lock, self.connection:
+            self.connection.executemany('INSERT OR IGNORE INTO PipelineCheckpoints (stage, key) VALUES (?, ?)',
+                                        ((stage, key) for key in keys))
+
+    def close(self):
+        self.connection.close()
+
+
+class IngestionPipeline:
+    """
+    Streams pages from the crawler into a searchable knowledge base.
+
+    The stages run concurrently, each on its own thread, connected by bounded
+    queues so a slow stage applies backpressure to the ones before it:
+
+        crawl -> clean -> terms -> Q&A -> embed -> insert
+
+    Pages are cleaned with one spaCy pipeline, folded into the incremental term
+    statistics, and every terms_every documents the top terms not seen before
+    are sent on for Q&A generation. Generated questions are embedded in batches
+    and bulk-inserted as terms, with their answers as facts. Nothing is written
+    to intermediate CSV or text files.
+
+    Progress is checkpointed per stage: unchanged pages, terms whose questions
+    were all inserted and already inserted questions are skipped on a rerun,
+    and finished Q&A terms are kept in PresidentsQA's checkpoint.
+    """
+
+    def __init__(self, db: ChatbotDatabase, embedder, qa: Optional[PresidentsQA] = None, nlp=None,
+                 term_stats_path: str = 'term_statistics.db', checkpoint_path: str = 'pipeline_checkpoint.db',
+                 qa_checkpoint_path: Optional[str] = 'qa_checkpoint.jsonl', queue_size: int = 64,
+                 top_k_terms: int = 40, terms_every: int = 10, pairs_per_term: int = 5, qa_workers: int = 4,
+                 embed_batch_size: int = 256, insert_batch_size: int = 1000, batch_wait: float = 0.5):
+        """
+        Initializes the pipeline.
+
+        Parameters:
+            db (ChatbotDatabase): The knowledge base the Q&A pairs are inserted into.
+            embedder: An object with get_embeddings(texts), such as OpenAIEmbedder.
+            qa (Optional[PresidentsQA]): The Q&A generator; one with the default client is created if omitted.
+            nlp: The spaCy pipeline used for cleaning; the shared cleaning model by default.
+            term_stats_path (str): The SQLite file of the incremental term statistics.
+            checkpoint_path (str): The SQLite file of the per-stage checkpoints.
+            qa_checkpoint_path (Optional[str]): The JSONL checkpoint of finished Q&A terms.
+            queue_size (int): The capacity of each queue between two stages.
+            top_k_terms (int): The number of top terms considered for Q&A generation.
+            terms_every (int): How many new documents are folded in before the top terms are re-ranked.
+            pairs_per_term (int): The number of Q&A pairs requested per term.
+            qa_workers (int): The number of concurrent Q&A generation calls.
+            embed_batch_size (int): The maximum number of questions per get_embeddings call.
+            insert_batch_size (int): The maximum number of pairs per bulk insert.
+            batch_wait (float): How long a batching stage waits for more items before flushing a partial batch.
+        """
+        self.db = db
+        self.embedder = embedder
+        self.qa = qa
+        self.nlp = nlp
+        self.term_stats_path = term_stats_path
+        self.checkpoint = PipelineCheckpoint(checkpoint_path)
+        self.qa_checkpoint_path = qa_checkpoint_path
+        self.queue_size = queue_size
+        self.top_k_terms = top_k_terms
+        self.terms_every = terms_every
+        self.pairs_per_term = pairs_per_term
+        self.qa_workers = qa_workers
+        self.embed_batch_size = embed_batch_size
+        self.insert_batch_size = insert_batch_size
+        self.batch_wait = batch_wait
+        self.stats = {}
+        self._stop = threading.Event()
+
+    @staticmethod
+    def content_key(name: str, text: str) -> str:
+        return name + ':' + hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    # Queue helpers
+
+    def _put(self, out: queue.Queue, item):
+        """Blocks while the queue is full (backpressure), giving up once the pipeline is stopping."""
+        while not self._stop.is_set():
+            try:
+                out.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _items(self, inbox: queue.Queue, stats: StageStats):
+        """Yields the items of a queue until the upstream stage is done."""
+        while True:
+            try:
+                item = inbox.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                continue
+            if item is _DONE:
+                return
+            stats.received += 1
+            yield item
+
+    def _batches(self, inbox: queue.Queue, stats: StageStats, max_items: int):
+        """Yields lists of up to max_items, flushing a partial batch when nothing arrives for batch_wait seconds."""
+        batch = []
+        while True:
+            try:
+                item = inbox.get(timeout=self.batch_wait)
+            except queue.Empty:
+                if batch:
+                    yield batch
+                    batch = []
+                elif self._stop.is_set():
+                    return
+                continue
+            if item is _DONE:
+                break
+            stats.received += 1
+            batch.append(item)
+            if len(batch) >= max_items:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _run_stage(self, name: str, work: Callable[[StageStats], None], outbox: Optional[queue.Queue]):
+        stats = self.stats[name]
+        start = time.perf_counter()
+        try:
+            work(stats)
+        except Exception as e:
+            stats.error = f"{type(e).__name__}: {e}"
+            print(f"Pipeline stage '{name}' failed: {stats.error}")
+            self._stop.set()
+        finally:
+            stats.wall_seconds = time.perf_counter() - start
+            if outbox is not None:
+                self._put(outbox, _DONE)
+
+    # Stages
+
+    def _crawl_stage(self, pages: Iterable[Tuple[str, str]], outbox: queue.Queue):
+        def work(stats: StageStats):
+            iterator = iter(pages)
+            while not self._stop.is_set():
+                start = time.perf_counter()
+                page = next(iterator, None)
+                stats.busy_seconds += time.perf_counter() - start
+                if page is None:
+                    return
+                stats.received += 1
+                self._put(outbox, page)
+                stats.emitted += 1
+        return work
+
+    def _clean_stage(self, inbox: queue.Queue, outbox: queue.Queue):
+        def work(stats: StageStats):
+            nlp = self.nlp or load_cleaning_model()
+
+            def unseen_pages():
+                for name, text in self._items(inbox, stats):
+                    key = self.content_key(name, text)
+                    if self.checkpoint.done('documents', key):
+                        stats.skipped += 1
+                        continue
+                    yield text.lower(), (name, key)
+
+            start = time.perf_counter()
+            for doc, (name, key) in nlp.pipe(unseen_pages(), as_tuples=True, batch_size=8):
+                stats.busy_seconds += time.perf_counter() - start
+                self._put(outbox, (name, key, clean_doc(doc)))
+                stats.emitted += 1
+                start = time.perf_counter()
+        return work
+
+    def _terms_stage(self, inbox: queue.Queue, outbox: queue.Queue):
+        def work(stats: StageStats):
+            term_stats = TermStatistics(self.term_stats_path)  # Its connection belongs to this thread
+            try:
+                since_ranking, sent = 0, set()
+                for name, key, cleaned_text in self._items(inbox, stats):
+                    start = time.perf_counter()
+                    term_stats.update_document(name, TermStatistics.count_text(cleaned_text))
+                    self.checkpoint.mark('documents', [key])
+                    since_ranking += 1
+                    new_terms = []
+                    if since_ranking >= self.terms_every:
+                        new_terms, since_ranking = self._new_top_terms(term_stats, sent), 0
+                    stats.busy_seconds += time.perf_counter() - start
+                    if new_terms:
+                        self._put(outbox, TermBatch(new_terms))
+                        stats.emitted += len(new_terms)
+                # Even without new documents, so a rerun resends the terms an interrupted run did not finish
+                if not self._stop.is_set():
+                    new_terms = self._new_top_terms(term_stats, sent)
+                    if new_terms:
+                        self._put(outbox, TermBatch(new_terms))
+                        stats.emitted += len(new_terms)
+            finally:
+                term_stats.close()
+        return work
+
+    def _new_top_terms(self, term_stats: TermStatistics, sent: set) -> List[str]:
+        """The top terms neither sent earlier in this run nor fully inserted by a previous one."""
+        terms = [term for term, _ in term_stats.top_terms(self.top_k_terms)
+                 if term not in sent and not self.checkpoint.done('terms', term)]
+        sent.update(terms)
+        return terms
+
+    def _release(self, batches: Iterable[TermBatch]):
+        """Checkpoints the terms of every batch whose questions are now all inserted."""
+        finished = [term for batch in batches if batch.release() for term in batch.terms]
+        if finished:
+            self.checkpoint.mark('terms', finished)
+
+    def _qa_stage(self, inbox: queue.Queue, outbox: queue.Queue):
+        def work(stats: StageStats):
+            qa = self.qa or PresidentsQA()
+            seen = set()
+            for batch in self._items(inbox, stats):
+                start = time.perf_counter()
+                pairs = qa.generate_for_terms(batch.terms, self.pairs_per_term, self.qa_workers,
+                                              self.qa_checkpoint_path)
+                stats.busy_seconds += time.perf_counter() - start
+                for question, answer in pairs.items():
+                    key = PresidentsQA.question_key(question)
+                    if key in seen or self.checkpoint.done('inserted', key):
+                        stats.skipped += 1
+                        continue
+                    seen.add(key)
+                    batch.acquire()
+                    self._put(outbox, (key, question, answer, batch))
+                    stats.emitted += 1
+                if pairs:  # Terms nothing was generated for stay unfinished and are retried by a rerun
+                    self._release([batch])
+        return work
+
+    def _embed_stage(self, inbox: queue.Queue, outbox: queue.Queue):
+        def work(stats: StageStats):
+            for batch in self._batches(inbox, stats, self.embed_batch_size):
+                start = time.perf_counter()
+                embeddings = self.embedder.get_embeddings([question for _, question, _, _ in batch])
+                stats.busy_seconds += time.perf_counter() - start
+                for (key, question, answer, term_batch), embedding in zip(batch, embeddings):
+                    if np.isnan(embedding).any():
+                        stats.skipped += 1  # Its terms stay unfinished, so a rerun retries the question
+                        continue
+                    self._put(outbox, (key, question, embedding, answer, term_batch))
+                    stats.emitted += 1
+        return work
+
+    def _insert_stage(self, inbox: queue.Queue):
+        def work(stats: StageStats):
+            for batch in self._batches(inbox, stats, self.insert_batch_size):
+                start = time.perf_counter()
+                self.db.bulk_add_terms([(question, embedding) for _, question, embedding, _, _ in batch])
+                self.db.bulk_add_facts([(question, answer) for _, question, _, answer, _ in batch])
+                self.checkpoint.mark('inserted', [key for key, _, _, _, _ in batch])
+                self._release(term_batch for _, _, _, _, term_batch in batch)
+                stats.busy_seconds += time.perf_counter() - start
+                stats.emitted += len(batch)
+        return work
+
+    def run(self, pages: Iterable[Tuple[str, str]]) -> dict:
+        """
+        Runs every stage until the pages are exhausted and all their Q&A pairs are inserted.
+
+        Parameters:
+            pages (Iterable[Tuple[str, str]]): (name, raw text) pairs, e.g. WebCrawler.iter_pages().
+
+        Returns:
+            dict: The counters of each stage, keyed by stage name.
+        """
+        self._stop.clear()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(5)]
+        stages = [
+            ('crawl', self._crawl_stage(pages, queues[0]), queues[0]),
+            ('clean', self._clean_stage(queues[0], queues[1]), queues[1]),
+            ('terms', self._terms_stage(queues[1], queues[2]), queues[2]),
+            ('qa', self._qa_stage(queues[2], queues[3]), queues[3]),
+            ('embed', self._embed_stage(queues[3], queues[4]), queues[4]),
+            ('insert', self._insert_stage(queues[4]), None),
+        ]
+        self.stats = {name: StageStats(name) for name, _, _ in stages}
+        threads = [threading.Thread(target=self._run_stage, args=stage, name=f'pipeline-{stage[0]}', daemon=True)
+                   for stage in stages]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return {name: stats.as_dict() for name, stats in self.stats.items()}
+
+    def report(self):
+        """Prints the per-stage counters of the last run."""
+        for stats in self.stats.values():
+            print(f"{stats.name:7} in={stats.received:7} out={stats.emitted:7} skipped={stats.skipped:6} "
+                  f"busy={stats.busy_seconds:8.2f}s wall={stats.wall_seconds:8.2f}s "
+                  f"{stats.items_per_sec:10.1f} items/s" + (f"  ERROR {stats.error}" if stats.error else ""))
+
+    def close(self):
+        self.checkpoint.close()
+
+
+# Example usage
+if __name__ == "__main__":
+    from EmbeddingCache import EmbeddingCache
+    from OpenAIEmbedder import OpenAIEmbedder
+    from WebCrawler import WebCrawler
+
+    crawler = WebCrawler("scraped_content")
+    crawler.seed_from_listing()
+    crawler.revisit()
+    db = ChatbotDatabase("chatbot.db")
+    pipeline = IngestionPipeline(db, OpenAIEmbedder(cache=EmbeddingCache("embedding_cache.db")))
+    pipeline.run(crawler.iter_pages())
+    pipeline.report()
+    pipeline.close()
+    crawler.close()
+    db.close()
@@ -0,0 +1,346 @@
+import bisect
+import functools
+import json
+import sys
+import threading
+import time
+import traceback
+import weakref
+from collections import Counter as TallyCounter
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Latency buckets in seconds, from 50 µs to 60 s, roughly three per decade
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _Counter:
+    """A monotonically increasing count."""
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self) -> float:
+        return self.value
+
+
+class _Histogram:
+    """Counts observations into fixed buckets, keeping their sum, like a Prometheus histogram."""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last slot counts observations above every bucket
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[slot] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self) -> Tuple[List[int], float, int]:
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile by interpolating linearly inside the bucket that contains it."""
+        counts, _, count = self.snapshot()
+        if not count:
+            return 0.0
+        rank, seen = q * count, 0
+        for slot, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[slot - 1] if slot > 0 else 0.0
+                upper = self.buckets[slot] if slot < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+class MetricFamily:
+    """A named metric with one child (counter or histogram) per combination of label values."""
+
+    def __init__(self, name: str, kind: str, help_text: str, label_names: Tuple[str, ...],
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.kind = kind
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str):
+        """Returns the child for the given label values (in label_names order), creating it on first use."""
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} expects labels {self.label_names}, got {values}.")
+            with self._lock:
+                child = self.children.get(values)
+                if child is None:
+                    child = _Counter() if self.kind == 'counter' else _Histogram(self.buckets)
+                    self.children[values] = child
+        return child
+
+
+class MetricsRegistry:
+    """
+    An in-process registry of counters and histograms.
+
+    Metrics are created once (usually at import time) and updated from any
+    thread; an update is a dictionary lookup and a short locked increment, so
+    instrumentation can stay on in production. Values derived from other
+    components, such as cache hit rates, are collected only when the registry
+    is dumped, through callbacks registered with register_collector.
+    Setting enabled to False turns every timer into a no-op.
+    """
+
+    def __init__(self):
+        self.families: Dict[str, MetricFamily] = {}
+        self.collectors: Dict[str, Callable[[], Optional[dict]]] = {}
+        self.enabled = True
+        self._lock = threading.Lock()
+
+    def _family(self, name: str, kind: str, help_text: str, label_names: Iterable[str], **kwargs) -> MetricFamily:
+        with self._lock:
+            family = self.families.get(name)
+            if family is None:
+                family = self.families[name] = MetricFamily(name, kind, help_text, tuple(label_names), **kwargs)
+            elif family.kind != kind:
+                raise ValueError(f"Metric {name} is already registered as a {family.kind}.")
+            return family
+
+    def counter(self, name: str, help_text: str, label_names: Iterable[str] = ()) -> MetricFamily:
+        return self._family(name, 'counter', help_text, label_names)
+
+    def histogram(self, name: str, help_text: str, label_names: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> MetricFamily:
+        return self._family(name, 'histogram', help_text, label_names, buckets=tuple(buckets))
+
+    def register_collector(self, name: str, collect: Callable[[], dict]):
+        """
+        Registers a callback whose numeric results are reported as gauges named
+        '<name>_<key>' (e.g. a cache's stats method). Bound methods are held weakly,
+        so registering does not keep their object alive; a later registration under
+        the same name replaces the earlier one.
+        """
+        if hasattr(collect, '__self__'):
+            method = weakref.WeakMethod(collect)
+            collect = lambda: method()() if method() is not None else None
+        self.collectors[name] = collect
+
+    def collect_gauges(self) -> Dict[str, float]:
+        gauges = {}
+        for name, collect in list(self.collectors.items()):
+            values = collect()
+            if values is None:
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    gauges[f"{name}_{key}"] = value
+        return gauges
+
+    @staticmethod
+    def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+        pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def to_prometheus(self) -> str:
+        """Renders every metric in the Prometheus text exposition format."""
+        lines = []
+        for family in list(self.families.values()):
+            lines.append(f"# HELP {family.name} {family.help_text}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for values, child in list(family.children.items()):
+                if family.kind == 'counter':
+                    lines.append(f"{family.name}{self._format_labels(family.label_names, values)} {child.snapshot()}")
+                    continue
+                counts, total, count = child.snapshot()
+                cumulative = 0
+                for bound, bucket_count in zip(list(family.buckets) + ['+Inf'], counts):
+                    cumulative += bucket_count
+                    labels = self._format_labels(family.label_names, values, f'le="{bound}"')
+                    lines.append(f"{family.name}_bucket{labels} {cumulative}")
+                labels = self._format_labels(family.label_names, values)
+                lines.append(f"{family.name}_sum{labels} {total}")
+                lines.append(f"{family.name}_count{labels} {count}")
+        for name, value in self.collect_gauges().items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> dict:
+        """Summarizes every metric: counters by value, histograms by count, sum and p50/p90/p99 estimates."""
+        metrics = {}
+        for family in list(self.families.values()):
+            entries = []
+            for values, child in list(family.children.items()):
+                entry = {'labels': dict(zip(family.label_names, values))}
+                if family.kind == 'counter':
+                    entry['value'] = child.snapshot()
+                else:
+                    _, total, count = child.snapshot()
+                    entry.update({'count': count, 'sum': total,
+                                  'p50': child.quantile(0.5), 'p90': child.quantile(0.9), 'p99': child.quantile(0.99)})
+                entries.append(entry)
+            metrics[family.name] = {'type': family.kind, 'help': family.help_text, 'values': entries}
+        return {'metrics': metrics, 'gauges': self.collect_gauges()}
+
+    def to_json(self, indent: Optional[int] = None) -> str:
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def reset(self):
+        """Drops every recorded value (the metric definitions are kept)."""
+        for family in self.families.values():
+            with family._lock:
+                family.children.clear()
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram('chatbot_stage_seconds', 'Time spent in each stage of answering a query.', ('stage',))
+STAGE_CALLS = REGISTRY.counter('chatbot_stage_items_total', 'Items (questions, texts, rows) processed by each stage.', ('stage',))
+API_RETRIES = REGISTRY.counter('chatbot_api_retries_total', 'OpenAI API calls retried, by API and reason.', ('api', 'reason'))
+API_ERRORS = REGISTRY.counter('chatbot_api_errors_total', 'OpenAI API calls that failed for good, by API and error type.', ('api', 'error'))
+
+
+class timed:
+    """
+    Times a stage into chatbot_stage_seconds, as a context manager or a decorator.
+
+        with timed("similarity_scan"):
+            ...
+
+        @timed("fact_fetch")
+        def retrieve_facts_by_term_ids(...): ...
+    """
+
+    __slots__ = ('stage', 'items', '_start')
+
+    def __init__(self, stage: str, items: int = 0):
+        self.stage = stage
+        self.items = items
+        self._start = 0.0
+
+    def __enter__(self) -> "timed":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if REGISTRY.enabled:
+            STAGE_SECONDS.labels(self.stage).observe(time.perf_counter() - self._start)
+            if self.items:
+                STAGE_CALLS.labels(self.stage).inc(self.items)
+        return False
+
+    def __call__(self, function: Callable) -> Callable:
+        stage = self.stage
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return function(*args, **kwargs)
+        return wrapper
+
+
+def count_retry(api: str, reason: str):
+    API_RETRIES.labels(api, reason).inc()
+
+
+def count_error(api: str, error: BaseException):
+    API_ERRORS.labels(api, type(error).__name__).inc()
+
+
+class SamplingProfiler:
+    """
+    A statistical profiler that samples the stacks of running threads.
+
+    A background thread wakes every interval seconds and records the current
+    stack of every other thread (or of the threads whose names start with one
+    of thread_prefixes). The cost is paid by the sampling thread only, so it
+    can be switched on in a live process for a while and switched off again.
+    Samples are reported as the most frequent functions, or in the collapsed
+    format that flame graph tools read.
+    """
+
+    def __init__(self, interval: float = 0.005, thread_prefixes: Optional[Tuple[str, ...]] = None,
+                 max_depth: int = 64):
+        """
+        Parameters:
+            interval (float): The time between samples, in seconds.
+            thread_prefixes (Optional[Tuple[str, ...]]): If given, only threads whose names start
+                with one of these prefixes (e.g. 'chat-turn') are sampled.
+            max_depth (int): The maximum number of frames recorded per stack.
+        """
+        self.interval = interval
+        self.thread_prefixes = thread_prefixes
+        self.max_depth = max_depth
+        self.stacks = TallyCounter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> "SamplingProfiler":
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> "SamplingProfiler":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        return False
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                name = names.get(thread_id, '')
+                if thread_id == own_id or (self.thread_prefixes and not name.startswith(self.thread_prefixes)):
+                    continue
+                stack = traceback.extract_stack(frame, limit=self.max_depth)
+                self.stacks[tuple(f"{entry.name} ({entry.filename.rsplit('/', 1)[-1]}:{entry.lineno})"
+                                  for entry in stack)] += 1
+            self.samples += 1
+
+    def top(self, n: int = 20) -> List[Tuple[str, int]]:
+        """The n functions found on the most sampled stacks, with their sample counts."""
+        inclusive = TallyCounter()
+        for stack, count in self.stacks.items():
+            for frame in set(stack):
+                inclusive[frame] += count
+        return inclusive.most_common(n)
+
+    def collapsed(self) -> str:
+        """The samples in collapsed-stack format ('frame;frame;frame count' per line)."""
+        return "\n".join(f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+
+# Example usage
+if __name__ == "__main__":
+    with SamplingProfiler(interval=0.001) as profiler:
+        for _ in range(200):
+            with timed("example", items=1):
+                sum(i * i for i in range(10_000))
+    print(REGISTRY.to_prometheus())
+    print(profiler.top(5))
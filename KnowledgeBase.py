@@ -1,30 +1,96 @@
+import argparse
+import itertools
+import json
+import os
+import re
 import sqlite3
-from typing import List, Tuple, Any
+import threading
+import time
+from typing import List, Tuple, Any, Optional, Union, Iterable, Callable
 import numpy as np
-from scipy.spatial.distance import cosine
+import EmbeddingCodec
+from ConnectionPool import ConnectionPool
+from EmbeddingIndex import EmbeddingMatrix, IVFIndex
+from Instrumentation import timed
+from TermStatistics import TermStatistics
+
 
 class ChatbotDatabase:
-    def __init__(self, db_path: str):
-        self.connection = sqlite3.connect(db_path)
-        self.cursor = self.connection.cursor()
-        self.setup_database()
-
-    def setup_database(self):
-        """Initialize the database tables with adjusted schema for unique embeddings."""
-        self.cursor.execute('''
+    # BM25 search ignores words found in more than this share of the facts, once there are enough facts
+    COMMON_WORD_RATIO = 0.2
+    COMMON_WORD_MIN_FACTS = 100
+
+    def __init__(self, db_path: str, storage_dtype: str = 'float32', matrix_dtype: str = 'float32',
+                 rerank_factor: int = 4, snapshot_path: Optional[str] = None,
+                 entity_resolver: Optional[Callable[[str], List[str]]] = None):
+        """
+        Opens (or creates) the knowledge base and loads its embeddings into memory.
+
+        The database may be used from many threads at once: each thread reads
+        through its own connection, and all writes go through a single writer
+        thread (see ConnectionPool). Searches scan the resident matrix without
+        locking; only in-memory updates are serialized.
+
+        Parameters:
+        - db_path (str): The SQLite database file.
+        - storage_dtype (str): The dtype new embeddings are stored with: 'float32', 'float16' or 'int8'.
+        - matrix_dtype (str): The dtype of the resident embedding matrix that queries scan.
+        - rerank_factor (int): When the resident matrix is quantized, this many times top_k
+          candidates are re-scored against the stored embeddings; 1 disables re-ranking.
+        - snapshot_path (Optional[str]): The base path of the memory-mapped embedding snapshot;
+          defaults to '<db_path>.snapshot'. A snapshot matching the current generation is
+          memory-mapped instead of decoding every embedding from SQLite.
+        - entity_resolver (Optional[Callable[[str], List[str]]]): Maps a term to the ids of the
+          entities it mentions (e.g. PresidentIndex.resolve); new terms are tagged with them
+          in the TermEntities table, which retrieval can filter on.
+        """
+        if storage_dtype not in EmbeddingCodec.DTYPES or matrix_dtype not in EmbeddingCodec.DTYPES:
+            raise ValueError(f"Embedding dtypes must be one of {list(EmbeddingCodec.DTYPES)}.")
+        self.pool = ConnectionPool(db_path, configure=self.configure_pragmas)
+        self.pool.write(self.setup_database)
+        self.storage_dtype = storage_dtype
+        self.matrix_dtype = matrix_dtype
+        self.rerank_factor = rerank_factor
+        self.entity_resolver = entity_resolver
+        self._memory_lock = threading.RLock()
+        self._document_frequencies = (None, 0, {})  # (knowledge version, number of facts, frequency by word)
+        self.embedding_matrix = EmbeddingMatrix(matrix_dtype)
+        on_disk = db_path != ':memory:'
+        self.snapshot_path = snapshot_path or (db_path + '.snapshot' if on_disk else None)
+        self.generation = None
+        self.load_embeddings()
+        self.ann_index_path = db_path + '.ivf.npz' if on_disk else None
+        self.ann_index = None
+        self._ann_index_dirty = False
+        self.load_ann_index()
+
+    @staticmethod
+    def configure_pragmas(connection: sqlite3.Connection):
+        """
+        Tunes a connection for ingestion and concurrent reads: WAL journaling lets
+        readers proceed during writes, and synchronous=NORMAL fsyncs only at checkpoints.
+        """
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute('PRAGMA temp_store=MEMORY')
+        connection.execute('PRAGMA cache_size=-65536')  # 64 MiB page cache
+
+    def setup_database(self, connection: sqlite3.Connection):
+        """Initialize the database tables with one embedding per term, and the full-text index over the facts."""
+        connection.execute('''
             CREATE TABLE IF NOT EXISTS Terms (
                 term_id INTEGER PRIMARY KEY,
                 term TEXT UNIQUE NOT NULL
             );
         ''')
-        self.cursor.execute('''
+        connection.execute('''
             CREATE TABLE IF NOT EXISTS Embeddings (
                 term_id INTEGER UNIQUE NOT NULL,
-                embedding BLOB UNIQUE NOT NULL,
+                embedding BLOB NOT NULL,
                 FOREIGN KEY (term_id) REFERENCES Terms(term_id)
             );
         ''')
-        self.cursor.execute('''
+        connection.execute('''
             CREATE TABLE IF NOT EXISTS Facts (
                 fact_id INTEGER PRIMARY KEY,
                 term_id INTEGER NOT NULL,
@@ -32,94 +98,818 @@ class ChatbotDatabase:
                 FOREIGN KEY (term_id) REFERENCES Terms(term_id)
             );
         ''')
-        self.connection.commit()
-
-    def add_term_with_embedding(self, term: str, embedding: bytes):
-        """Add a term along with its unique embedding."""
-        self.cursor.execute('INSERT OR IGNORE INTO Terms (term) VALUES (?)', (term,))
-        term_id = self.cursor.lastrowid
-        if term_id:  # If the term was newly added
-            self.cursor.execute('INSERT INTO Embeddings (term_id, embedding) VALUES (?, ?)', (term_id, embedding))
-        else:  # If the term already existed, update its embedding
-            self.cursor.execute('''
-                UPDATE Embeddings
-                SET embedding = ?
-                WHERE term_id = (SELECT term_id FROM Terms WHERE term = ?)
-            ''', (embedding, term))
-        self.connection.commit()
+        # Facts are looked up by term (retrieve_facts_by_term_ids) far more often than by id
+        connection.execute('CREATE INDEX IF NOT EXISTS idx_facts_term_id ON Facts(term_id)')
+        connection.execute('''
+            CREATE TABLE IF NOT EXISTS TermEntities (
+                term_id INTEGER NOT NULL,
+                entity_id TEXT NOT NULL,
+                PRIMARY KEY (entity_id, term_id),
+                FOREIGN KEY (term_id) REFERENCES Terms(term_id)
+            ) WITHOUT ROWID;
+        ''')
+        connection.execute('''
+            CREATE TABLE IF NOT EXISTS Metadata (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+        ''')
+        connection.execute('''
+            CREATE TABLE IF NOT EXISTS UserPreferences (
+                user_id TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (user_id, key)
+            ) WITHOUT ROWID;
+        ''')
+        self.setup_lexical_index(connection)
+
+    @staticmethod
+    def setup_lexical_index(connection: sqlite3.Connection):
+        """
+        Creates FactsFTS, an FTS5 index over the text of every fact and of its term
+        (rowid = fact_id), kept in sync with the Facts table by triggers, so every
+        insert path (add_fact, bulk_add_facts, execute_query) updates it in the same
+        transaction. A database created before the index existed is indexed once here.
+        """
+        exists = connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'FactsFTS'").fetchone()
+        connection.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS FactsFTS USING fts5(term, fact, tokenize = 'porter unicode61');
+        ''')
+        connection.execute('''
+            CREATE TRIGGER IF NOT EXISTS FactsFTS_insert AFTER INSERT ON Facts BEGIN
+                INSERT INTO FactsFTS (rowid, term, fact)
+                VALUES (new.fact_id, (SELECT term FROM Terms WHERE term_id = new.term_id), new.fact);
+            END;
+        ''')
+        connection.execute('''
+            CREATE TRIGGER IF NOT EXISTS FactsFTS_delete AFTER DELETE ON Facts BEGIN
+                DELETE FROM FactsFTS WHERE rowid = old.fact_id;
+            END;
+        ''')
+        connection.execute('''
+            CREATE TRIGGER IF NOT EXISTS FactsFTS_update AFTER UPDATE ON Facts BEGIN
+                DELETE FROM FactsFTS WHERE rowid = old.fact_id;
+                INSERT INTO FactsFTS (rowid, term, fact)
+                VALUES (new.fact_id, (SELECT term FROM Terms WHERE term_id = new.term_id), new.fact);
+            END;
+        ''')
+        if not exists:
+            connection.execute('''
+                INSERT INTO FactsFTS (rowid, term, fact)
+                SELECT fact_id, term, fact FROM Facts INNER JOIN Terms ON Facts.term_id = Terms.term_id
+            ''')
+        # ORDER BY rank then ranks by BM25 with the term weighted twice, inside the index
+        connection.execute("INSERT INTO FactsFTS (FactsFTS, rank) VALUES ('rank', 'bm25(2.0, 1.0)')")
+
+    def read_generation(self, connection: Optional[sqlite3.Connection] = None) -> int:
+        """Returns the embedding generation, a counter bumped by every write to the Embeddings table."""
+        connection = connection or self.pool.reader()
+        row = connection.execute("SELECT value FROM Metadata WHERE key = 'embedding_generation'").fetchone()
+        return row[0] if row else 0
+
+    def knowledge_version(self) -> Tuple[int, int]:
+        """
+        Returns the (embedding, facts) generations. Every change to the terms or facts made
+        through this class (in any process) changes it, so caches of answers can compare it.
+        """
+        rows = dict(self.pool.read("SELECT key, value FROM Metadata WHERE key IN ('embedding_generation', 'facts_generation')"))
+        return rows.get('embedding_generation', 0), rows.get('facts_generation', 0)
+
+    @staticmethod
+    def _bump_generation(connection: sqlite3.Connection, key: str = 'embedding_generation'):
+        """Increments the embedding generation (or another Metadata counter) inside the caller's transaction."""
+        connection.execute('''
+            INSERT INTO Metadata (key, value) VALUES (?, 1)
+            ON CONFLICT(key) DO UPDATE SET value = value + 1
+        ''', (key,))
+
+    @staticmethod
+    def decode_embedding(blob: bytes) -> Optional[np.ndarray]:
+        """Decodes a stored embedding BLOB (versioned or legacy float64), or returns None if it is invalid."""
+        return EmbeddingCodec.decode_embedding(blob)
+
+    def load_embeddings(self):
+        """
+        Reads every stored embedding into the resident embedding matrix.
+
+        This is done when the database is opened and whenever another connection
+        has written embeddings since; writes through this object keep the matrix
+        in sync directly. If a snapshot of the current generation exists it is
+        memory-mapped instead. Rows that cannot be decoded, or whose dimension
+        differs from the first valid row, are skipped.
+
+        The new matrix is built aside and swapped in, so concurrent searches keep
+        scanning the old one until it is ready.
+        """
+        with self._memory_lock:
+            self.generation = self.read_generation()
+            if self.load_snapshot():
+                return
+            term_ids, vectors = [], []
+            for term_id, blob in self.pool.reader().execute('SELECT term_id, embedding FROM Embeddings'):
+                vector = self.decode_embedding(blob)
+                if vector is None or (vectors and vector.shape[0] != vectors[0].shape[0]):
+                    continue
+                term_ids.append(term_id)
+                vectors.append(vector)
+            matrix = EmbeddingMatrix(self.matrix_dtype)
+            matrix.load(np.array(term_ids, dtype=np.int64), np.array(vectors, dtype=np.float32))
+            self.embedding_matrix = matrix
+
+    def export_snapshot(self):
+        """
+        Writes the resident embedding matrix to a memory-mappable snapshot tagged
+        with the current generation.
+
+        Other processes opening the database (or noticing a new generation) map
+        the snapshot read-only, so they share the same page-cache pages instead of
+        each decoding a private copy. The metadata file is replaced last, so
+        readers never see a half-written snapshot as current.
+        """
+        if not self.snapshot_path:
+            return
+        matrix = self.embedding_matrix
+        matrix.save(self.snapshot_path)
+        meta_path = self.snapshot_path + '.json'
+        with open(meta_path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump({'generation': self.generation, 'dtype': matrix.dtype, 'dim': matrix.dim, 'size': matrix.size}, file)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def load_snapshot(self) -> bool:
+        """Memory-maps the snapshot if it matches the current generation and matrix dtype; returns whether it did."""
+        meta_path = (self.snapshot_path or '') + '.json'
+        if not self.snapshot_path or not os.path.exists(meta_path):
+            return False
+        try:
+            with open(meta_path, encoding='utf-8') as file:
+                meta = json.load(file)
+            if meta['generation'] != self.generation or meta['dtype'] != self.matrix_dtype:
+                return False
+            self.embedding_matrix = EmbeddingMatrix.open_mapped(self.snapshot_path, meta['dtype'])
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring unreadable embedding snapshot: {e}")
+            return False
+        return True
+
+    def refresh_if_stale(self, connection: Optional[sqlite3.Connection] = None):
+        """
+        Reloads the embeddings (and reassigns the IVF index) if another process
+        committed embedding writes that this object has not seen.
+
+        Parameters:
+        - connection (Optional[sqlite3.Connection]): The connection to read the generation
+          through; write operations pass the write connection.
+        """
+        if self.read_generation(connection) <= self.generation:
+            return
+        with self._memory_lock:
+            if self.read_generation(connection) > self.generation:
+                self._reload_embeddings()
+
+    def _reload_embeddings(self):
+        with self._memory_lock:
+            self.load_embeddings()
+            if self.ann_index is not None:
+                self.ann_index.add_all(self.embedding_matrix.term_ids, self.embedding_matrix.float_vectors())
+                self._ann_index_dirty = True
+
+    def add_term_with_embedding(self, term: str, embedding: Union[bytes, np.ndarray]):
+        """
+        Add a term along with its embedding.
+
+        The embedding may be a vector or an encoded BLOB (including legacy raw
+        float64 bytes); valid embeddings are re-encoded with the storage dtype.
+        """
+        vector = self.decode_embedding(embedding) if isinstance(embedding, bytes) else np.ravel(embedding)
+        if vector is not None:
+            embedding = EmbeddingCodec.encode_embedding(vector, self.storage_dtype)
+
+        def write(connection: sqlite3.Connection):
+            self.refresh_if_stale(connection)
+            cursor = connection.execute('INSERT OR IGNORE INTO Terms (term) VALUES (?)', (term,))
+            if cursor.rowcount == 1:  # If the term was newly added
+                term_id = cursor.lastrowid
+                connection.execute('INSERT INTO Embeddings (term_id, embedding) VALUES (?, ?)', (term_id, embedding))
+            else:  # If the term already existed, update its embedding
+                term_id = connection.execute('SELECT term_id FROM Terms WHERE term = ?', (term,)).fetchone()[0]
+                connection.execute('UPDATE Embeddings SET embedding = ? WHERE term_id = ?', (embedding, term_id))
+            self._tag_terms(connection, [(term_id, term)])
+            self._bump_generation(connection)
+
+            with self._memory_lock:
+                self.generation += 1
+                if vector is not None and self.embedding_matrix.dim in (0, vector.shape[0]):
+                    self.embedding_matrix.upsert(term_id, vector)
+                    if self.ann_index is not None:
+                        self.ann_index.upsert(term_id, vector)
+                else:
+                    self.embedding_matrix.remove(term_id)
+                    if self.ann_index is not None:
+                        self.ann_index.remove(term_id)
+                self._ann_index_dirty = self.ann_index is not None
+
+        self.pool.write(write)
+
+    def build_ann_index(self, n_lists: Optional[int] = None) -> IVFIndex:
+        """
+        Trains an IVF approximate nearest-neighbour index over the stored embeddings
+        and persists it next to the database file.
+
+        Parameters:
+        - n_lists (Optional[int]): The number of k-means clusters; defaults to 4 * sqrt(#terms).
+
+        Returns:
+        - IVFIndex: The newly built index, which is kept up to date by add_term_with_embedding,
+          or None if there are no embeddings to train on.
+        """
+        with self._memory_lock:
+            matrix = self.embedding_matrix
+            if not matrix.size:
+                return None
+            vectors = matrix.float_vectors()
+            index = IVFIndex.train(vectors, n_lists, dtype=matrix.dtype)
+            index.add_all(matrix.term_ids, vectors)
+            self.ann_index = index
+            self._ann_index_dirty = True
+            self.save_ann_index()
+            return index
+
+    def load_ann_index(self):
+        """
+        Loads the persisted IVF index, if there is one.
+
+        If the index does not cover exactly the terms in the Embeddings table (for
+        example after writes from another process), every embedding is reassigned
+        using the persisted centroids instead of retraining the quantizer.
+        """
+        if not self.ann_index_path or not os.path.exists(self.ann_index_path):
+            return
+        self.ann_index = IVFIndex.load(self.ann_index_path, self.matrix_dtype)
+        matrix = self.embedding_matrix
+        if self.ann_index.centroids.shape[1] != matrix.dim:
+            self.ann_index = None
+            self.build_ann_index()
+        elif self.ann_index.size != matrix.size:
+            self.ann_index.add_all(matrix.term_ids, matrix.float_vectors())
+            self._ann_index_dirty = True
+
+    def save_ann_index(self):
+        """Persists the IVF index if it changed since it was last written."""
+        with self._memory_lock:
+            if self.ann_index is not None and self._ann_index_dirty and self.ann_index_path:
+                self.ann_index.save(self.ann_index_path)
+            self._ann_index_dirty = False
+
+    def close(self):
+        """Persists pending index changes, waits for queued writes and closes every connection."""
+        self.save_ann_index()
+        self.pool.close()
+
+    @staticmethod
+    def _batches(items: Iterable, batch_size: int):
+        """Yields lists of up to batch_size items, consuming the iterable lazily."""
+        iterator = iter(items)
+        while True:
+            batch = list(itertools.islice(iterator, batch_size))
+            if not batch:
+                return
+            yield batch
+
+    def _term_ids_for(self, connection: sqlite3.Connection, terms: List[str]) -> dict:
+        """Resolves many terms to their term_ids with chunked IN (...) queries."""
+        term_ids = {}
+        for chunk in self._batches(terms, 900):
+            placeholders = ', '.join('?' * len(chunk))
+            term_ids.update(connection.execute(f'SELECT term, term_id FROM Terms WHERE term IN ({placeholders})', chunk))
+        return term_ids
+
+    def bulk_add_terms(self, items: Iterable[Tuple[str, Union[bytes, np.ndarray]]], batch_size: int = 10000) -> dict:
+        """
+        Adds many terms with their embeddings in a single transaction.
+
+        The input is consumed in batches of batch_size, so a generator of any length
+        can be streamed with flat memory. Existing terms get their embedding replaced,
+        as with add_term_with_embedding, and the resident matrix and IVF index are
+        updated per batch.
+
+        Parameters:
+        - items (Iterable[Tuple[str, Union[bytes, np.ndarray]]]): (term, embedding) pairs.
+        - batch_size (int): The number of rows written per executemany call.
+
+        Returns:
+        - dict: The number of rows written, the elapsed seconds and the rows per second.
+        """
+        start = time.perf_counter()
+
+        def write(connection: sqlite3.Connection) -> int:
+            self.refresh_if_stale(connection)
+            rows = 0
+            for batch in self._batches(items, batch_size):
+                self._add_term_batch(connection, batch)
+                rows += len(batch)
+            self._bump_generation(connection)
+            with self._memory_lock:
+                self.generation += 1
+                self._ann_index_dirty = self.ann_index is not None
+            return rows
+
+        try:
+            rows = self.pool.write(write)
+        except Exception:
+            # The transaction was rolled back; drop the rows already applied in memory.
+            # This reads the committed state, so it must wait until the rollback is done.
+            self._reload_embeddings()
+            raise
+        return self._ingest_report(rows, start)
+
+    def _add_term_batch(self, connection: sqlite3.Connection, batch: List[Tuple[str, Union[bytes, np.ndarray]]]):
+        """Writes one batch of (term, embedding) pairs and mirrors it into the resident matrix and IVF index."""
+        terms, blobs, valid_terms, vectors, invalid_terms = [], [], [], [], []
+        for term, embedding in batch:
+            vector = self.decode_embedding(embedding) if isinstance(embedding, bytes) else np.ravel(embedding)
+            if vector is not None:
+                embedding = EmbeddingCodec.encode_embedding(vector, self.storage_dtype)
+                dim = self.embedding_matrix.dim or (vectors[0].shape[0] if vectors else vector.shape[0])
+                if vector.shape[0] == dim:
+                    valid_terms.append(term)
+                    vectors.append(vector)
+                    terms.append(term)
+                    blobs.append(embedding)
+                    continue
+            invalid_terms.append(term)
+            terms.append(term)
+            blobs.append(embedding)
+        connection.executemany('INSERT OR IGNORE INTO Terms (term) VALUES (?)', ((term,) for term in terms))
+        term_ids = self._term_ids_for(connection, list(set(terms)))
+        connection.executemany('''
+            INSERT INTO Embeddings (term_id, embedding) VALUES (?, ?)
+            ON CONFLICT(term_id) DO UPDATE SET embedding = excluded.embedding
+        ''', ((term_ids[term], blob) for term, blob in zip(terms, blobs)))
+        self._tag_terms(connection, [(term_ids[term], term) for term in set(terms)])
+
+        with self._memory_lock:
+            if vectors:
+                ids = [term_ids[term] for term in valid_terms]
+                vectors = np.array(vectors, dtype=np.float32)
+                self.embedding_matrix.upsert_many(ids, vectors)
+                if self.ann_index is not None:
+                    self.ann_index.upsert_many(ids, vectors)
+            for term in invalid_terms:
+                self.embedding_matrix.remove(term_ids[term])
+                if self.ann_index is not None:
+                    self.ann_index.remove(term_ids[term])
+
+    def _tag_terms(self, connection: sqlite3.Connection, terms: List[Tuple[int, str]]):
+        """Records the entities each (term_id, term) mentions, if an entity resolver is set."""
+        if self.entity_resolver is None or not terms:
+            return
+        connection.executemany('INSERT OR IGNORE INTO TermEntities (term_id, entity_id) VALUES (?, ?)',
+                               ((term_id, entity_id) for term_id, term in terms
+                                for entity_id in self.entity_resolver(term)))
+
+    def index_term_entities(self, entity_resolver: Optional[Callable[[str], List[str]]] = None,
+                            batch_size: int = 10000) -> int:
+        """
+        Re-tags every stored term with the entities it mentions, replacing the previous tags.
+
+        Parameters:
+        - entity_resolver (Optional[Callable[[str], List[str]]]): The resolver to use, which
+          also becomes the one applied to new terms; defaults to the current one.
+        - batch_size (int): The number of terms tagged per statement batch.
+
+        Returns:
+        - int: The number of (term, entity) pairs recorded.
+        """
+        if entity_resolver is not None:
+            self.entity_resolver = entity_resolver
+        if self.entity_resolver is None:
+            raise ValueError("An entity resolver is required to index term entities.")
+
+        def write(connection: sqlite3.Connection) -> int:
+            connection.execute('DELETE FROM TermEntities')
+            for batch in self._batches(connection.execute('SELECT term_id, term FROM Terms').fetchall(), batch_size):
+                self._tag_terms(connection, batch)
+            return connection.execute('SELECT COUNT(*) FROM TermEntities').fetchone()[0]
+
+        return self.pool.write(write)
+
+    def upsert_preferences(self, rows: Iterable[Tuple[str, str, str, float]]):
+        """Writes many (user_id, key, JSON value, updated_at) preferences in one transaction."""
+        self.pool.write(lambda connection: connection.executemany('''
+            INSERT INTO UserPreferences (user_id, key, value, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id, key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+            WHERE excluded.updated_at >= UserPreferences.updated_at
+        ''', list(rows)))
+
+    def read_preferences(self, user_id: str) -> dict:
+        """Returns a user's preferences as a {key: JSON value} dict."""
+        return dict(self.pool.read('SELECT key, value FROM UserPreferences WHERE user_id = ?', (user_id,)))
+
+    def term_ids_for_entities(self, entity_ids: List[str]) -> List[int]:
+        """Returns the ids of the terms tagged with any of the given entities."""
+        if not entity_ids:
+            return []
+        placeholders = ', '.join('?' * len(entity_ids))
+        rows = self.pool.read(f'SELECT DISTINCT term_id FROM TermEntities WHERE entity_id IN ({placeholders})',
+                              list(entity_ids))
+        return [term_id for term_id, in rows]
+
+    def bulk_add_facts(self, items: Iterable[Tuple[str, str]], batch_size: int = 10000) -> dict:
+        """
+        Adds many facts in a single transaction.
+
+        Terms are resolved to term_ids once per batch rather than with a subquery per
+        row. Facts whose term does not exist are skipped (add_fact would fail on them).
+
+        Parameters:
+        - items (Iterable[Tuple[str, str]]): (term, fact) pairs.
+        - batch_size (int): The number of rows written per executemany call.
+
+        Returns:
+        - dict: The number of rows written and skipped, the elapsed seconds and the rows per second.
+        """
+        start = time.perf_counter()
+
+        def write(connection: sqlite3.Connection) -> Tuple[int, int]:
+            rows = skipped = 0
+            term_ids = {}
+            for batch in self._batches(items, batch_size):
+                if len(term_ids) > 1_000_000:
+                    term_ids.clear()  # Keep the term_id cache bounded on very long streams
+                unresolved = list({term for term, _ in batch if term not in term_ids})
+                term_ids.update(self._term_ids_for(connection, unresolved))
+                facts = [(term_ids[term], fact) for term, fact in batch if term in term_ids]
+                connection.executemany('INSERT INTO Facts (term_id, fact) VALUES (?, ?)', facts)
+                rows += len(facts)
+                skipped += len(batch) - len(facts)
+            if rows:
+                self._bump_generation(connection, 'facts_generation')
+            return rows, skipped
+
+        rows, skipped = self.pool.write(write)
+        report = self._ingest_report(rows, start)
+        report['skipped'] = skipped
+        return report
+
+    @staticmethod
+    def _ingest_report(rows: int, start: float) -> dict:
+        seconds = time.perf_counter() - start
+        return {'rows': rows, 'seconds': seconds, 'rows_per_sec': rows / seconds if seconds > 0 else float('inf')}
 
     def add_fact(self, term: str, fact: str):
         """Add a fact associated with a term, identified by the term text."""
-        self.cursor.execute('''
-            INSERT INTO Facts (term_id, fact) 
-            VALUES ((SELECT term_id FROM Terms WHERE term = ?), ?)
-        ''', (term, fact))
-        self.connection.commit()
+        def write(connection: sqlite3.Connection):
+            connection.execute('''
+                INSERT INTO Facts (term_id, fact) 
+                VALUES ((SELECT term_id FROM Terms WHERE term = ?), ?)
+            ''', (term, fact))
+            self._bump_generation(connection, 'facts_generation')
+
+        self.pool.write(write)
 
     def retrieve_facts(self, term: str) -> List[str]:
         """Retrieve facts for a given term."""
-        self.cursor.execute('''
+        rows = self.pool.read('''
             SELECT fact FROM Facts
             INNER JOIN Terms ON Facts.term_id = Terms.term_id
             WHERE term = ?
         ''', (term,))
-        return [row[0] for row in self.cursor.fetchall()]
+        return [row[0] for row in rows]
+
+    def _selective_tokens(self, query: str) -> List[str]:
+        """
+        Returns the distinct content words of a query, leaving out those too common in
+        the corpus to rank by (e.g. "president"). Their document frequencies are counted
+        through the full-text index and cached until the knowledge base changes.
+
+        Words in at least half the facts are always left out: BM25 gives them no weight
+        (FTS5 floors their score at 1e-06), so they would only add unranked matches.
+        """
+        tokens = list(dict.fromkeys(TermStatistics.tokenize(query)))
+        version = self.knowledge_version()
+        cached_version, total, frequencies = self._document_frequencies
+        if cached_version != version:
+            total, frequencies = self.pool.read('SELECT count(*) FROM Facts')[0][0], {}
+            self._document_frequencies = (version, total, frequencies)
+        for token in tokens:
+            if token not in frequencies:
+                frequencies[token] = self.pool.read(
+                    'SELECT count(*) FROM FactsFTS WHERE FactsFTS MATCH ?', (f'"{token}"',))[0][0]
+        limit = self.COMMON_WORD_RATIO * total if total >= self.COMMON_WORD_MIN_FACTS else total
+        return [token for token in tokens if frequencies[token] <= limit and 2 * frequencies[token] < total]
+
+    @timed("bm25_search")
+    def retrieve_facts_lexical(self, query: str, top_k: int = 5,
+                               term_ids: Optional[List[int]] = None) -> List[Tuple[int, str, float]]:
+        """
+        Retrieves the facts whose text or term best matches the words of a query, by BM25.
+
+        Matches in the term count twice as much as matches in the fact. Stop words,
+        and words too common to rank by (see _selective_tokens), are ignored, so
+        only facts with a real BM25 match are returned; words are compared after
+        Porter stemming. Facts are ranked inside the
+        full-text index and only the top_k best are joined with the Facts table.
+
+        Parameters:
+        - query (str): The query text.
+        - top_k (int): The number of facts returned.
+        - term_ids (Optional[List[int]]): If given, only the facts of these terms are searched.
+
+        Returns:
+        - list of tuples: (term_id, fact, score) tuples ordered by decreasing BM25 score.
+        """
+        tokens = self._selective_tokens(query)
+        if not tokens or top_k <= 0 or (term_ids is not None and not term_ids):
+            return []
+        params = [' OR '.join(f'"{token}"' for token in tokens)]
+        restriction = ''
+        if term_ids is not None:
+            restriction = f"AND rowid IN (SELECT fact_id FROM Facts WHERE term_id IN ({', '.join('?' * len(term_ids))}))"
+            params += list(term_ids)
+        return self.pool.read(f'''
+            SELECT Facts.term_id, Facts.fact, ranked.score
+            FROM (SELECT rowid, -rank AS score FROM FactsFTS
+                  WHERE FactsFTS MATCH ? {restriction} ORDER BY rank LIMIT ?) AS ranked
+            INNER JOIN Facts ON Facts.fact_id = ranked.rowid
+            ORDER BY ranked.score DESC
+        ''', params + [top_k])
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """Lowercases text and collapses its punctuation and whitespace, keeping every word and number."""
+        return ' '.join(re.findall(r'\w+', text.lower()))
+
+    @timed("lexical_match")
+    def lexical_match(self, query: str, term_ids: Optional[List[int]] = None,
+                      limit: int = 20, top_k: int = 5) -> Optional[List[Tuple[int, str, float]]]:
+        """
+        Answers a query without embedding it when a term has exactly its text.
+
+        A term matches when it equals the query once both are lowercased and their
+        punctuation and whitespace collapsed, e.g. "Who was Lincoln?" and "who was
+        lincoln". Stop words, numbers and word order all count, so "the 16th
+        president" does not match "the 61st president". Candidates are found
+        through the full-text index. The matching term's stored embedding then
+        stands in for the query's to find related terms, so every returned score
+        is a cosine similarity.
+
+        Parameters:
+        - query (str): The query text.
+        - term_ids (Optional[List[int]]): If given, only these terms may match or be related.
+        - limit (int): The number of full-text candidates checked.
+        - top_k (int): The number of terms closest to the matching one whose facts follow its own.
+
+        Returns:
+        - Optional[list of tuples]: The (term_id, fact, 1.0) facts of the matching term, followed
+          by the (term_id, fact, similarity) facts of its closest terms; None if no term matches exactly.
+        """
+        normalized = self.normalize_text(query)
+        if not normalized or (term_ids is not None and not term_ids):
+            return None
+        sql = '''
+            SELECT Facts.term_id, FactsFTS.term
+            FROM FactsFTS INNER JOIN Facts ON Facts.fact_id = FactsFTS.rowid
+            WHERE FactsFTS MATCH ?
+        '''
+        params = [f'term : "{normalized}"']
+        if term_ids is not None:
+            sql += f" AND Facts.term_id IN ({', '.join('?' * len(term_ids))})"
+            params += list(term_ids)
+        rows = self.pool.read(sql + ' ORDER BY rank LIMIT ?', params + [limit])
+
+        matched_term_id = next((term_id for term_id, term in rows if self.normalize_text(term) == normalized), None)
+        if matched_term_id is None:
+            return None
+        facts = self.retrieve_facts_by_term_ids([matched_term_id]).get(matched_term_id, [])
+        matches = [(matched_term_id, fact, 1.0) for fact in facts]
+        rows = self.pool.read('SELECT embedding FROM Embeddings WHERE term_id = ?', (matched_term_id,))
+        embedding = self.decode_embedding(rows[0][0]) if rows else None
+        if embedding is not None and top_k > 0:
+            related = self.retrieve_facts_by_embeddings(embedding[None, :], top_k + 1, term_ids=term_ids)[0]
+            matches += [match for match in related if match[0] != matched_term_id]
+        return matches
+
+    def retrieve_facts_hybrid(self, queries: List[str], input_embeddings: np.ndarray, top_k: int = 5,
+                              depth: Optional[int] = None, rrf_k: int = 60, search: str = 'exact',
+                              nprobe: int = 8, term_ids: Optional[List[int]] = None) -> List[List[Tuple[int, str, float]]]:
+        """
+        Retrieves facts for several queries by fusing BM25 and embedding similarity.
+
+        Each query's facts are ranked twice, by BM25 over the query text and by the
+        similarity of their term to the query embedding, and the two rankings are
+        merged with reciprocal-rank fusion: a fact scores sum(1 / (rrf_k + rank))
+        over the rankings it appears in. Exact words (dates, names of bills or
+        places) thus lift facts that the embedding alone ranks only loosely.
+
+        Parameters:
+        - queries (List[str]): The query texts.
+        - input_embeddings (np.ndarray): The (len(queries), dim) query embeddings.
+        - top_k (int): The number of facts returned per query.
+        - depth (Optional[int]): The number of candidates taken from each ranking; 4 * top_k by default.
+        - rrf_k (int): The rank offset of reciprocal-rank fusion; larger values flatten the rankings.
+        - search (str): 'exact' or 'approximate', as in retrieve_facts_by_embedding.
+        - nprobe (int): For approximate search, the number of IVF clusters scanned.
+        - term_ids (Optional[List[int]]): If given, only these terms are searched.
+
+        Returns:
+        - list of lists of tuples: For each query, (term_id, fact, similarity) tuples ordered by
+          decreasing fused score; similarity is the cosine similarity of the fact's term.
+        """
+        depth = depth or 4 * top_k
+        vector_results = self.retrieve_facts_by_embeddings(input_embeddings, depth, search, nprobe, term_ids)
+        results = []
+        for query, embedding, vector_facts in zip(queries, input_embeddings, vector_results):
+            lexical_facts = self.retrieve_facts_lexical(query, depth, term_ids)
+            fused, similarities = {}, {}
+            for ranking in (vector_facts, lexical_facts):
+                for rank, (term_id, fact, _) in enumerate(ranking[:depth]):
+                    key = (term_id, fact)
+                    fused[key] = fused.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+            for term_id, _, similarity in vector_facts:
+                similarities[term_id] = similarity
+
+            # Facts found only lexically are scored against their term's embedding too
+            missing = list({term_id for term_id, _ in fused if term_id not in similarities})
+            if missing:
+                found, scores = self.embedding_matrix.top_k_many(np.ravel(embedding)[None, :], len(missing), missing)
+                similarities.update(zip(found[0].tolist(), scores[0].tolist()))
+            ranked = sorted(fused.items(), key=lambda item: -item[1])[:top_k]
+            results.append([(term_id, fact, similarities.get(term_id, 0.0)) for (term_id, fact), _ in ranked])
+        return results
 
     def execute_query(self, query: str, params: Tuple[Any, ...] = ()) -> List[Tuple]:
-        """Execute an arbitrary query for flexibility."""
-        self.cursor.execute(query, params)
-        return self.cursor.fetchall()
+        """
+        Execute an arbitrary query for flexibility. Read-only statements run on the
+        calling thread's read connection; anything else goes through the writer.
+        """
+        if query.lstrip().split(None, 1)[0].upper() in ('SELECT', 'WITH', 'EXPLAIN'):
+            return self.pool.read(query, params)
+        return self.pool.write(lambda connection: connection.execute(query, params).fetchall())
    
-    def retrieve_facts_by_embedding(self, input_embedding: np.ndarray) -> list:
+    def retrieve_facts_by_embedding(self, input_embedding: np.ndarray, top_k: int = 5,
+                                    search: str = 'exact', nprobe: int = 8,
+                                    term_ids: Optional[List[int]] = None) -> list:
         """
         Retrieves facts and their similarity scores from the database based on the
         similarity of the input embedding to the stored embeddings. This function
-        calculates cosine similarity between embeddings and selects the closest matches.
+        scores the query against the resident embedding matrix with a single
+        matrix-vector product and selects the closest matches.
 
         Parameters:
         - input_embedding (np.ndarray): The input embedding vector.
+        - top_k (int): The number of closest terms whose facts are returned.
+        - search (str): 'exact' scans every embedding; 'approximate' uses the IVF index,
+          building it first if necessary.
+        - nprobe (int): For approximate search, the number of IVF clusters scanned.
+          Higher values trade latency for recall.
+        - term_ids (Optional[List[int]]): If given, only these terms are searched (e.g. the
+          terms of one president, from term_ids_for_entities); the search is then exact.
 
         Returns:
         - list of tuples: Each tuple contains a fact and its corresponding similarity score.
         """
-        # Fetch all embeddings from the database
-        self.cursor.execute('SELECT term_id, embedding FROM Embeddings')
-        embeddings = self.cursor.fetchall()
+        matches = self.retrieve_facts_by_embeddings(np.ravel(input_embedding)[None, :], top_k, search, nprobe,
+                                                    term_ids)[0]
+        return [(fact, similarity) for _, fact, similarity in matches]
+
+    def retrieve_facts_by_embeddings(self, input_embeddings: np.ndarray, top_k: int = 5,
+                                     search: str = 'exact', nprobe: int = 8,
+                                     term_ids: Optional[List[int]] = None) -> List[List[Tuple[int, str, float]]]:
+        """
+        Retrieves the facts closest to each of several query embeddings at once.
 
-        # Calculate similarities and store them with their term_id
-        similarities = []
-        for term_id, stored_embedding in embeddings:
-            stored_embedding_arr = np.frombuffer(stored_embedding, dtype=np.float64)
-            similarity = 1 - cosine(input_embedding, stored_embedding_arr)
-            similarities.append((similarity, term_id))
+        Exact search scores all queries with one matrix-matrix product, and the
+        facts of every matched term are fetched with a single query. When the
+        resident matrix is quantized, rerank_factor * top_k candidates are
+        re-scored against the stored embeddings before the top_k are kept.
 
-        # Sort based on similarity (descending)
-        similarities.sort(reverse=True, key=lambda x: x[0])
+        Parameters:
+        - input_embeddings (np.ndarray): The (m, dim) query embeddings.
+        - top_k (int): The number of closest terms per query whose facts are returned.
+        - search (str): 'exact' or 'approximate', as in retrieve_facts_by_embedding.
+        - nprobe (int): For approximate search, the number of IVF clusters scanned.
+        - term_ids (Optional[List[int]]): If given, only these terms are searched, exactly.
+
+        Returns:
+        - list of lists of tuples: For each query, (term_id, fact, similarity) tuples
+          ordered by decreasing similarity.
+        """
+        if search not in ('exact', 'approximate'):
+            raise ValueError(f"Unknown search mode '{search}'; expected 'exact' or 'approximate'.")
+        self.refresh_if_stale()
+        rerank = self.embedding_matrix.dtype != 'float32' and self.rerank_factor > 1
+        candidates = top_k * self.rerank_factor if rerank else top_k
+        if term_ids is not None:
+            search = 'exact'  # A prefiltered subset is small enough to scan
+        if search == 'approximate' and self.ann_index is None:
+            self.build_ann_index()
+        with timed("similarity_scan", items=len(input_embeddings)):
+            if search == 'approximate' and self.ann_index is not None:
+                matches = [self.ann_index.top_k(query, candidates, nprobe) for query in input_embeddings]
+            else:
+                matches = list(zip(*self.embedding_matrix.top_k_many(input_embeddings, candidates, term_ids)))
+        if rerank and matches:
+            with timed("rerank"):
+                matches = self._rerank(input_embeddings, matches, top_k)
+        if not matches:
+            return [[] for _ in input_embeddings]
+
+        # Fetch the facts of all matched terms in one query, then order them by similarity
+        all_term_ids = {term_id for term_ids, _ in matches for term_id in term_ids.tolist()}
+        facts_by_term_id = self.retrieve_facts_by_term_ids(list(all_term_ids)) if all_term_ids else {}
+        results = []
+        for term_ids, similarities in matches:
+            facts_with_scores = []
+            for term_id, similarity in zip(term_ids.tolist(), similarities.tolist()):
+                for fact in facts_by_term_id.get(term_id, []):
+                    facts_with_scores.append((term_id, fact, similarity))
+            results.append(facts_with_scores)
+        return results
+
+    def _rerank(self, queries: np.ndarray, matches: list, top_k: int) -> list:
+        """Re-scores quantized-scan candidates against their stored embeddings and keeps the top_k of each query."""
+        all_term_ids = list({term_id for term_ids, _ in matches for term_id in term_ids.tolist()})
+        if not all_term_ids:
+            return matches
+        placeholders = ', '.join('?' * len(all_term_ids))
+        rows = self.pool.read(f'SELECT term_id, embedding FROM Embeddings WHERE term_id IN ({placeholders})', all_term_ids)
+        stored = {term_id: self.decode_embedding(blob) for term_id, blob in rows}
+
+        reranked = []
+        for query, (term_ids, similarities) in zip(EmbeddingMatrix.normalize(queries), matches):
+            rescored = [(float(EmbeddingMatrix.normalize(stored[term_id]) @ query)
+                         if stored.get(term_id) is not None else similarity, term_id)
+                        for term_id, similarity in zip(term_ids.tolist(), similarities.tolist())]
+            rescored.sort(reverse=True)
+            rescored = rescored[:top_k]
+            reranked.append((np.array([term_id for _, term_id in rescored], dtype=np.int64),
+                             np.array([similarity for similarity, _ in rescored], dtype=np.float32)))
+        return reranked
+
+    def migrate_embeddings(self, dtype: str = 'float32'):
+        """
+        Rewrites every stored embedding in the versioned format with the given dtype.
+
+        The Embeddings table is rebuilt in a single transaction, which also drops
+        the UNIQUE constraint that older databases had on the embedding BLOB.
+        Rows that cannot be decoded are copied unchanged.
 
-        # Retrieve facts for the top N matches, N could be adjusted based on requirements
-        top_matches = similarities[:5]  # Assuming we take the top 5 matches
-        facts_with_scores = []
-        for similarity, term_id in top_matches:
-            self.cursor.execute('SELECT fact FROM Facts WHERE term_id = ?', (term_id,))
-            facts = self.cursor.fetchall()
-            for fact in facts:
-                # Append both the fact and its similarity score to the result
-                facts_with_scores.append((fact[0], similarity))
+        Parameters:
+        - dtype (str): The new storage dtype: 'float32', 'float16' or 'int8'.
+        """
+        if dtype not in EmbeddingCodec.DTYPES:
+            raise ValueError(f"Embedding dtype must be one of {list(EmbeddingCodec.DTYPES)}.")
+        def write(connection: sqlite3.Connection):
+            rows = []
+            for term_id, blob in connection.execute('SELECT term_id, embedding FROM Embeddings').fetchall():
+                vector = self.decode_embedding(blob)
+                rows.append((term_id, blob if vector is None else EmbeddingCodec.encode_embedding(vector, dtype)))
+            connection.execute('''
+                CREATE TABLE Embeddings_migrated (
+                    term_id INTEGER UNIQUE NOT NULL,
+                    embedding BLOB NOT NULL,
+                    FOREIGN KEY (term_id) REFERENCES Terms(term_id)
+                );
+            ''')
+            connection.executemany('INSERT INTO Embeddings_migrated (term_id, embedding) VALUES (?, ?)', rows)
+            connection.execute('DROP TABLE Embeddings')
+            connection.execute('ALTER TABLE Embeddings_migrated RENAME TO Embeddings')
+            self._bump_generation(connection)
+
+        self.pool.write(write)
+        self.pool.write(lambda connection: connection.execute('VACUUM'), transaction=False)
+        self.storage_dtype = dtype
+        self._reload_embeddings()
 
-        return facts_with_scores
+    @timed("fact_fetch")
+    def retrieve_facts_by_term_ids(self, term_ids: List[int]) -> dict:
+        """Retrieve the facts of several terms at once, keyed by term_id."""
+        placeholders = ', '.join('?' * len(term_ids))
+        rows = self.pool.read(f'SELECT term_id, fact FROM Facts WHERE term_id IN ({placeholders}) ORDER BY fact_id', term_ids)
+        facts_by_term_id = {}
+        for term_id, fact in rows:
+            facts_by_term_id.setdefault(term_id, []).append(fact)
+        return facts_by_term_id
 
     def retrive_term_by_term_id(self, term_id: int) -> str:
         """Retrieve the term associated with a given term_id."""
-        self.cursor.execute('SELECT term FROM Terms WHERE term_id = ?', (term_id,))
-        return self.cursor.fetchone()[0]
+        return self.pool.read('SELECT term FROM Terms WHERE term_id = ?', (term_id,))[0][0]
 
+    @timed("term_lookup")
+    def retrieve_terms_by_term_ids(self, term_ids: List[int]) -> dict:
+        """Retrieve the terms associated with several term_ids in one query, keyed by term_id."""
+        placeholders = ', '.join('?' * len(term_ids))
+        return dict(self.pool.read(f'SELECT term_id, term FROM Terms WHERE term_id IN ({placeholders})', list(term_ids)))
 
-# Example Usage
-if __name__ == "__main__":
+
+def example_usage():
     db = ChatbotDatabase('chatbot_database.db')
     # Adding a term and its unique embedding
     term = "Python programming"
-    embedding = b'some_binary_representation'  # Simplified for illustration
+    embedding = np.random.rand(256).tobytes()  # Raw float64 bytes are re-encoded on insert
     db.add_term_with_embedding(term, embedding)
 
     # Adding facts related to the term
@@ -130,3 +920,36 @@ if __name__ == "__main__":
     facts = db.retrieve_facts(term)
     print(facts)
 
+    # Retrieving facts by words, and by words and embedding similarity combined
+    print(db.retrieve_facts_lexical("Who created Python?"))
+    print(db.retrieve_facts_hybrid(["Who created Python?"], np.random.rand(1, 256)))
+
+    # Retrieving facts by embedding similarity, exactly and through the IVF index
+    print(db.retrieve_facts_by_embedding(np.random.rand(256)))
+    print(db.retrieve_facts_by_embedding(np.random.rand(256), search='approximate', nprobe=4))
+    db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Knowledge base utilities.")
+    subparsers = parser.add_subparsers(dest='command')
+    migrate_parser = subparsers.add_parser('migrate', help="Re-encode the stored embeddings of a database.")
+    migrate_parser.add_argument('db_path')
+    migrate_parser.add_argument('--dtype', choices=list(EmbeddingCodec.DTYPES), default='float32')
+    snapshot_parser = subparsers.add_parser('snapshot', help="Export a memory-mapped embedding snapshot.")
+    snapshot_parser.add_argument('db_path')
+    snapshot_parser.add_argument('--matrix-dtype', choices=list(EmbeddingCodec.DTYPES), default='float32')
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        database = ChatbotDatabase(args.db_path)
+        database.migrate_embeddings(args.dtype)
+        print(f"Migrated {database.embedding_matrix.size} embeddings to {args.dtype}.")
+        database.close()
+    elif args.command == 'snapshot':
+        database = ChatbotDatabase(args.db_path, matrix_dtype=args.matrix_dtype)
+        database.export_snapshot()
+        print(f"Exported {database.embedding_matrix.size} embeddings at generation {database.generation}.")
+        database.close()
+    else:
+        example_usage()
@@ -0,0 +1,152 @@
+import queue
+import threading
+from concurrent.futures import Future
+from functools import lru_cache
+from typing import Callable, List, Optional, Tuple
+import spacy
+
+NER_MODEL = "en_core_web_sm"
+# Components of the English pipelines that entity recognition does not depend on
+NON_NER_PIPES = ["tagger", "parser", "attribute_ruler", "lemmatizer", "senter"]
+
+
+class _MicroBatcher:
+    """
+    Funnels texts from many threads through one pipeline in batches.
+
+    Each caller enqueues its text and waits; a worker thread takes whatever is
+    queued (up to max_batch_size texts, waiting at most max_wait seconds for
+    more after the first) and runs it through nlp.pipe in one go, so concurrent
+    sessions share the per-batch overhead instead of each running the pipeline.
+    """
+
+    def __init__(self, nlp, convert: Callable, max_batch_size: int, max_wait: float, name: str):
+        self.nlp = nlp
+        self.convert = convert
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, text: str) -> Future:
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=self.max_wait))
+                except queue.Empty:
+                    break
+            try:
+                docs = self.nlp.pipe([text for text, _ in batch], batch_size=len(batch))
+                for (_, future), doc in zip(batch, docs):
+                    future.set_result(self.convert(doc))
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+
+class NLPService:
+    """
+    The process-wide NLP service used by the chatbot.
+
+    Each task gets the smallest pipeline that serves it: sentence splitting uses
+    a blank English tokenizer with a rule-based sentencizer (no model load),
+    and entity recognition uses the statistical model with every component but
+    NER excluded. Each pipeline is built on first use, requests from concurrent
+    sessions are batched through nlp.pipe, and results are memoized, so
+    repeated inputs cost nothing.
+
+    Results are returned as plain tuples of strings rather than spaCy objects,
+    so they can be cached and shared between threads.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, ner_model: str = NER_MODEL, max_batch_size: int = 32, max_wait: float = 0.002,
+                 cache_size: int = 4096):
+        """
+        Initializes the service; pipelines are loaded lazily.
+
+        Parameters:
+            ner_model (str): The spaCy model used for entity recognition.
+            max_batch_size (int): The maximum number of texts run through a pipeline at once.
+            max_wait (float): How long a batch waits for more texts after the first one arrives.
+            cache_size (int): The number of memoized results per task.
+        """
+        self.ner_model = ner_model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._batchers = {}
+        self._lock = threading.Lock()
+        self.sentences = lru_cache(maxsize=cache_size)(self._sentences)
+        self.entities = lru_cache(maxsize=cache_size)(self._entities)
+
+    @classmethod
+    def instance(cls) -> "NLPService":
+        """Returns the shared service, creating it on first use."""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def load_sentencizer(self):
+        nlp = spacy.blank("en")
+        nlp.add_pipe("sentencizer")
+        return nlp
+
+    def load_ner(self):
+        return spacy.load(self.ner_model, exclude=NON_NER_PIPES)
+
+    def _batcher(self, task: str) -> _MicroBatcher:
+        batcher = self._batchers.get(task)
+        if batcher is None:
+            with self._lock:
+                batcher = self._batchers.get(task)
+                if batcher is None:
+                    if task == "sentences":
+                        nlp, convert = self.load_sentencizer(), self._convert_sentences
+                    else:
+                        nlp, convert = self.load_ner(), self._convert_entities
+                    batcher = self._batchers[task] = _MicroBatcher(
+                        nlp, convert, self.max_batch_size, self.max_wait, f"nlp-{task}")
+        return batcher
+
+    @staticmethod
+    def _convert_sentences(doc) -> Tuple[str, ...]:
+        return tuple(sent.text.strip() for sent in doc.sents if sent.text.strip())
+
+    @staticmethod
+    def _convert_entities(doc) -> Tuple[Tuple[str, str], ...]:
+        return tuple((ent.text, ent.label_) for ent in doc.ents)
+
+    def _sentences(self, text: str) -> Tuple[str, ...]:
+        """Splits a text into sentences (memoized as self.sentences)."""
+        return self._batcher("sentences").submit(text).result()
+
+    def _entities(self, text: str) -> Tuple[Tuple[str, str], ...]:
+        """Returns the (text, label) named entities of a text (memoized as self.entities)."""
+        return self._batcher("entities").submit(text).result()
+
+    def first_entity(self, text: str, label: str) -> Optional[str]:
+        """Returns the first entity with the given label, or None."""
+        for entity, entity_label in self.entities(text):
+            if entity_label == label:
+                return entity
+        return None
+
+    def questions(self, text: str) -> List[str]:
+        """Returns the sentences of a text that end with a question mark."""
+        return [sentence for sentence in self.sentences(text) if sentence.endswith('?')]
+
+
+def get_nlp_service() -> NLPService:
+    return NLPService.instance()
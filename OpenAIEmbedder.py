@@ -1,26 +1,60 @@
+import hashlib
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 import openai
 import numpy as np
 from typing import List, Optional
 import pandas as pd
+from EmbeddingCache import EmbeddingCache
+from RateLimitBackoff import RateLimitBackoff
+from Instrumentation import REGISTRY, count_error, count_retry, timed
+
+try:
+    import tiktoken
+except ImportError:  # Token counts fall back to a characters-per-token estimate
+    tiktoken = None
+
+EMBEDDING_DIMENSIONS = 256
 
 class OpenAIEmbedder:
     """
     A class to interact with the OpenAI API to obtain and process text embeddings.
     
     This class is designed to fetch embeddings from OpenAI's API, reduce the embedding
-    dimension to 256, and apply L2 normalization.
+    dimension to 256, and apply L2 normalization. Many texts can be embedded at once
+    with get_embeddings, which packs them into batched requests sent concurrently.
     """
-    
-    def __init__(self, model: str = "text-embedding-3-small"):
+
+    # Limits of the embeddings endpoint: inputs per request and tokens per input
+    MAX_BATCH_SIZE = 2048
+    MAX_INPUT_TOKENS = 8191
+
+    def __init__(self, model: str = "text-embedding-3-small", client: Optional[openai.OpenAI] = None,
+                 max_concurrency: int = 4, max_batch_tokens: int = 100_000, max_retries: int = 6,
+                 cache: Optional[EmbeddingCache] = None):
         """
         Initializes the OpenAIEmbedder with a specific model.
         
         Parameters:
             model (str): The model to be used for text embeddings.
+            client (Optional[openai.OpenAI]): The API client; pass one with a custom
+                base_url to run against a local or fake embeddings server.
+            max_concurrency (int): The maximum number of batch requests in flight.
+            max_batch_tokens (int): The token budget of a single batch request.
+            max_retries (int): How many times a rate-limited or failed request is retried.
+            cache (Optional[EmbeddingCache]): A cache consulted before calling the API.
         """
-        self.client = openai.OpenAI()
+        self.client = client if client is not None else openai.OpenAI()
         self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_batch_tokens = max_batch_tokens
+        self.max_retries = max_retries
+        self.cache = cache
+        if cache is not None:
+            REGISTRY.register_collector('embedding_cache', cache.stats)
+        self._encoding = self._load_encoding(model)
+        self.backoff = RateLimitBackoff()
 
     @staticmethod
     def normalize_l2(x: np.ndarray) -> np.ndarray:
@@ -36,6 +70,75 @@ class OpenAIEmbedder:
         norm = np.linalg.norm(x)
         return x / norm if norm > 0 else x
     
+    @staticmethod
+    def _load_encoding(model: str):
+        if tiktoken is None:
+            return None
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+
+    def count_tokens(self, text: str) -> int:
+        """Counts the tokens of a text, estimating ~4 characters per token without tiktoken."""
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return len(text) // 4 + 1
+
+    def _pack_batches(self, texts: List[str]) -> List[List[int]]:
+        """
+        Groups text positions into batches that respect both the per-request input
+        count and the token budget, filling each batch as far as possible.
+        """
+        batches, batch, batch_tokens = [], [], 0
+        for i, text in enumerate(texts):
+            tokens = min(self.count_tokens(text), self.MAX_INPUT_TOKENS)
+            if batch and (len(batch) == self.MAX_BATCH_SIZE or batch_tokens + tokens > self.max_batch_tokens):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(i)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _create_embeddings(self, inputs: List[str]) -> np.ndarray:
+        """
+        Sends one embeddings request, retrying rate-limit, connection and server
+        errors with adaptive backoff.
+
+        Returns:
+            np.ndarray: The raw embeddings in input order, truncated to at most
+            EMBEDDING_DIMENSIONS columns and not yet normalized. Rows of inputs the
+            response left out are filled with NaN.
+
+        Raises:
+            openai.OpenAIError: If the request is invalid or still fails after max_retries.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.backoff.wait()
+            try:
+                with timed("embedding_call", items=len(inputs)):
+                    response = self.client.embeddings.create(
+                        input=inputs, model=self.model, encoding_format="float"
+                    )
+                self.backoff.succeeded()
+                width = min((len(item.embedding) for item in response.data), default=EMBEDDING_DIMENSIONS)
+                embeddings = np.full((len(inputs), min(width, EMBEDDING_DIMENSIONS)), np.nan)
+                for item in response.data:
+                    embeddings[item.index] = item.embedding[:embeddings.shape[1]]
+                return embeddings
+            except openai.RateLimitError as e:
+                if attempt == self.max_retries:
+                    raise
+                count_retry("embeddings", "rate_limit")
+                self.backoff.rate_limited(e)
+            except (openai.APIConnectionError, openai.InternalServerError) as e:
+                if attempt == self.max_retries:
+                    raise
+                count_retry("embeddings", type(e).__name__)
+                self.backoff.sleep_after_failure(attempt)
+
     def get_embedding(self, text: str) -> Optional[np.ndarray]:
         """
         Obtains and processes the embedding for a given text.
@@ -49,30 +152,124 @@ class OpenAIEmbedder:
         Returns:
             Optional[np.ndarray]: The processed embedding, or None if an error occurs.
         """
+        if self.cache is not None:
+            cached = self.cache.get(self.model, text)
+            if cached is not None:
+                return cached.astype(np.float64)
+
         processed_text = text.replace("\n", " ")
         try:
-            response = self.client.embeddings.create(
-                input=[processed_text], model=self.model, encoding_format="float"
-            )
-            embedding = np.array(response.data[0].embedding[:256])
+            embedding = self._create_embeddings([processed_text])[0]
+            if np.isnan(embedding).any():
+                raise ValueError("The response did not include an embedding for the text.")
             normalized_embedding = self.normalize_l2(embedding)
+            if self.cache is not None:
+                self.cache.put(self.model, text, normalized_embedding)
             return normalized_embedding
-        except openai.error.RateLimitError:
+        except openai.RateLimitError as e:
+            count_error("embeddings", e)
             print("Rate limit exceeded. Please try again later.")
-        except openai.error.InvalidRequestError as e:
+        except openai.BadRequestError as e:
+            count_error("embeddings", e)
             print(f"Invalid request: {e}")
         except Exception as e:
+            count_error("embeddings", e)
             print(f"An unexpected error occurred: {e}")
         return None
 
+    def get_embeddings(self, texts: List[str]) -> np.ndarray:
+        """
+        Obtains and processes the embeddings for many texts at once.
+
+        Cached texts are served from the cache; the rest are de-duplicated, packed into
+        as few requests as the batch-size and token limits allow, and sent with up to
+        max_concurrency requests running at the same time.
+
+        Parameters:
+            texts (List[str]): The texts to get embeddings for.
+
+        Returns:
+            np.ndarray: A (len(texts), 256) float32 matrix of L2-normalized embeddings.
+            Rows whose batch failed are filled with NaN.
+        """
+        embeddings = np.full((len(texts), EMBEDDING_DIMENSIONS), np.nan, dtype=np.float32)
+        cached = self.cache.get_many(self.model, texts) if self.cache is not None else {}
+        for i, embedding in cached.items():
+            embeddings[i] = embedding
+
+        # Request every distinct uncached text once and fan the result out to its duplicates
+        positions_by_text = {}
+        for i, text in enumerate(texts):
+            if i not in cached:
+                positions_by_text.setdefault(text, []).append(i)
+        unique_texts = list(positions_by_text)
+        processed_texts = [text.replace("\n", " ") for text in unique_texts]
+        batches = self._pack_batches(processed_texts)
+
+        def embed_batch(batch: List[int]):
+            try:
+                raw = self._create_embeddings([processed_texts[i] for i in batch])
+                if raw.shape[1] != EMBEDDING_DIMENSIONS:
+                    raise ValueError(f"Embeddings have dimension {raw.shape[1]}, expected {EMBEDDING_DIMENSIONS}.")
+                norms = np.linalg.norm(raw, axis=1, keepdims=True)
+                normalized = (raw / np.where(norms > 0, norms, 1.0)).astype(np.float32)
+                for j, i in enumerate(batch):
+                    embeddings[positions_by_text[unique_texts[i]]] = normalized[j]
+                # Inputs the response left out stay NaN and are not cached
+                received = ~np.isnan(normalized).any(axis=1)
+                if self.cache is not None and received.any():
+                    self.cache.put_many(self.model, [unique_texts[i] for i, ok in zip(batch, received) if ok],
+                                        normalized[received])
+                if not received.all():
+                    print(f"The response left out {int((~received).sum())} of {len(batch)} embeddings.")
+            except Exception as e:
+                count_error("embeddings", e)
+                print(f"Failed to embed a batch of {len(batch)} texts: {e}")
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            list(executor.map(embed_batch, batches))
+        return embeddings
+
+class FakeEmbedder:
+    """
+    A deterministic, offline stand-in for OpenAIEmbedder, for tests and benchmarks.
+
+    Each text's embedding is a unit vector drawn from a random generator seeded
+    with a hash of the whitespace-normalized text, so equal texts always get
+    equal embeddings. An optional per-call latency simulates the API round trip.
+    """
+
+    def __init__(self, dimensions: int = EMBEDDING_DIMENSIONS, latency: float = 0.0):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.model = "fake-embedding"
+
+    def _embed(self, text: str) -> np.ndarray:
+        seed = int.from_bytes(hashlib.sha256(" ".join(text.split()).encode('utf-8')).digest()[:8], 'little')
+        return OpenAIEmbedder.normalize_l2(np.random.default_rng(seed).standard_normal(self.dimensions))
+
+    def get_embedding(self, text: str) -> Optional[np.ndarray]:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._embed(text)
+
+    def get_embeddings(self, texts: List[str]) -> np.ndarray:
+        if self.latency:
+            time.sleep(self.latency)
+        embeddings = np.empty((len(texts), self.dimensions), dtype=np.float32)
+        for i, text in enumerate(texts):
+            embeddings[i] = self._embed(text)
+        return embeddings
+
 # Example usage
 if __name__ == "__main__":
-    # Load your data
-    df = pd.read_csv('your_input_file.csv')  # Make sure there's a 'text' column
-    
+    from EmbeddingDataset import EmbeddingDataset
+
+    # Load your data in chunks; there must be a 'text' column
     embedder = OpenAIEmbedder()
-    df['embeddings'] = df['text'].apply(lambda x: list(embedder.get_embedding(x)))
-    
-    # Save the DataFrame with embeddings
-    df.to_csv('output_with_embeddings.csv', index=False)
-    print("Embeddings added and saved to output_with_embeddings.csv.")
+    dataset = EmbeddingDataset('output_embeddings', dim=EMBEDDING_DIMENSIONS)
+    for chunk in pd.read_csv('your_input_file.csv', chunksize=10_000):
+        texts = chunk['text'].astype(str).tolist()
+        dataset.append(texts, embedder.get_embeddings(texts))
+
+    print(f"Embeddings added and saved to output_embeddings/ ({len(dataset)} rows).")
@@ -0,0 +1,131 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict
+from KnowledgeBase import ChatbotDatabase
+
+
+class PreferenceStore:
+    """
+    Per-user preferences with a read-through cache and write-behind flushing.
+
+    Preferences are stored as one (user_id, key) row each in the UserPreferences
+    table of a ChatbotDatabase, with JSON values. Reads are served from an LRU
+    cache that loads a user's row set on a miss. Writes update the cache at once
+    and are queued; a background thread flushes the queue in one transaction
+    every flush_interval seconds, or sooner once max_pending writes are queued.
+    A later write to the same key replaces the queued one, so a busy session
+    costs one row write per flush. All methods are safe to call from many
+    sessions at once.
+    """
+
+    def __init__(self, database: ChatbotDatabase, flush_interval: float = 1.0, max_pending: int = 1000,
+                 cache_size: int = 10_000):
+        """
+        Initializes the store and starts the flusher thread.
+
+        Parameters:
+            database (ChatbotDatabase): The database holding the UserPreferences table.
+            flush_interval (float): The maximum delay, in seconds, before a write reaches the database.
+            max_pending (int): The number of queued writes that triggers an early flush.
+            cache_size (int): The number of users whose preferences are kept in memory.
+        """
+        self.database = database
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._pending: Dict[tuple, tuple] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._flusher = threading.Thread(target=self._flush_loop, name='preference-flusher', daemon=True)
+        self._flusher.start()
+
+    def get(self, user_id: str) -> Dict[str, Any]:
+        """Returns a copy of a user's preferences (empty if the user is unknown)."""
+        with self._lock:
+            preferences = self._cache.get(user_id)
+            if preferences is not None:
+                self._cache.move_to_end(user_id)
+                return dict(preferences)
+        stored = {key: json.loads(value) for key, value in self.database.read_preferences(user_id).items()}
+        with self._lock:
+            # Writes queued (or cached) meanwhile are newer than what was just read
+            preferences = self._cache.get(user_id)
+            if preferences is None:
+                preferences = stored
+                preferences.update({key: value for (pending_user, key), (value, _) in self._pending.items()
+                                    if pending_user == user_id})
+                self._remember(user_id, preferences)
+            return dict(preferences)
+
+    def get_value(self, user_id: str, key: str, default: Any = None) -> Any:
+        return self.get(user_id).get(key, default)
+
+    def set(self, user_id: str, **preferences: Any):
+        """Upserts some of a user's preferences; values must be JSON-serializable."""
+        self.update(user_id, preferences)
+
+    def update(self, user_id: str, preferences: Dict[str, Any]):
+        now = time.time()
+        with self._lock:
+            cached = self._cache.get(user_id)
+            if cached is not None:
+                cached.update(preferences)
+                self._cache.move_to_end(user_id)
+            for key, value in preferences.items():
+                self._pending[(user_id, key)] = (value, now)
+            pending = len(self._pending)
+        if pending >= self.max_pending:
+            self._wake.set()
+
+    def _remember(self, user_id: str, preferences: Dict[str, Any]):
+        self._cache[user_id] = preferences
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def flush(self) -> int:
+        """Writes the queued preferences now. Returns the number of rows written."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            try:
+                self.database.upsert_preferences(
+                    (user_id, key, json.dumps(value), updated_at)
+                    for (user_id, key), (value, updated_at) in pending.items())
+            except Exception:
+                with self._lock:
+                    # Requeue the batch unless newer writes replaced it
+                    for item, value in pending.items():
+                        self._pending.setdefault(item, value)
+                raise
+            return len(pending)
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Failed to flush user preferences: {e}")
+
+    def close(self):
+        """Stops the flusher after writing everything still queued."""
+        self._closed = True
+        self._wake.set()
+        self._flusher.join()
+        self.flush()
+
+
+# Example usage
+if __name__ == "__main__":
+    store = PreferenceStore(ChatbotDatabase(":memory:"))
+    store.set("alice", name="Alice", favorite_president="Abraham Lincoln")
+    print(store.get("alice"))
+    store.close()
@@ -0,0 +1,189 @@
+import json
+import os
+import re
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import unquote
+
+# Well-known aliases that cannot be derived from a president's name
+EXTRA_ALIASES = {
+    'Abraham_Lincoln': ['Honest Abe', 'Abe Lincoln'],
+    'Theodore_Roosevelt': ['Teddy Roosevelt', 'TR'],
+    'Franklin_D._Roosevelt': ['FDR'],
+    'Dwight_D._Eisenhower': ['Ike'],
+    'John_F._Kennedy': ['JFK'],
+    'Lyndon_B._Johnson': ['LBJ'],
+    'Ronald_Reagan': ['The Gipper'],
+    'Bill_Clinton': ['William Jefferson Clinton'],
+}
+NAME_SUFFIXES = {'jr', 'sr', 'ii', 'iii'}
+
+
+@dataclass
+class Mention:
+    """A president alias found in a text, with the president ids it may refer to."""
+    start: int  # Offsets into the normalized text
+    end: int
+    alias: str
+    ids: Tuple[str, ...]
+
+
+class PresidentIndex:
+    """
+    A gazetteer of U.S. Presidents with an Aho-Corasick automaton over their aliases.
+
+    Every president is identified by the slug of their Wikipedia page (e.g.
+    'Abraham_Lincoln'). Aliases are generated from the scraped names: the full
+    name, first name plus surname, the bare surname and "President <surname>",
+    plus a few well-known nicknames. find() resolves all mentions in one linear
+    pass over the text, keeping the leftmost-longest whole-word matches. An
+    alias shared by several presidents (e.g. "Adams") resolves to all of them.
+    Single-word aliases only match when capitalized, so "land grant college"
+    does not mention Grant.
+    """
+
+    def __init__(self, presidents: Dict[str, dict]):
+        """
+        Builds the index.
+
+        Parameters:
+            presidents (Dict[str, dict]): Per president id, a dict with the 'name', 'url'
+                and 'aliases' (List[str]) of that president.
+        """
+        self.presidents = presidents
+        ids_by_alias = {}
+        for president_id, president in presidents.items():
+            for alias in president['aliases']:
+                alias = self.normalize(alias)
+                if alias:
+                    ids_by_alias.setdefault(alias, set()).add(president_id)
+        self.ids_by_alias = {alias: tuple(sorted(ids)) for alias, ids in ids_by_alias.items()}
+        self.capitalized_aliases = {alias for alias in self.ids_by_alias if ' ' not in alias}
+        self._build_automaton()
+
+    @staticmethod
+    def collapse(text: str) -> str:
+        """Turns every run of non-alphanumeric characters of a text into one space, keeping case."""
+        return " ".join(re.sub(r"[^0-9A-Za-z]+", " ", text).split())
+
+    @classmethod
+    def normalize(cls, text: str) -> str:
+        """Lowercases a text and turns every run of non-alphanumeric characters into one space."""
+        return cls.collapse(text).lower()
+
+    @staticmethod
+    def president_id(url: str) -> str:
+        return unquote(url.rstrip('/').rsplit('/', 1)[-1])
+
+    @classmethod
+    def aliases_for(cls, president_id: str, name: str) -> List[str]:
+        """Derives the aliases of a president from their page slug and listed name ("Last, First" or "First Last")."""
+        if ',' in name:
+            last, first = name.split(',', 1)
+            name = f"{first.strip()} {last.strip()}"
+        title = re.sub(r"\s*\(.*?\)", "", president_id.replace('_', ' '))
+        aliases = {title, name}
+        for full_name in (title, name):
+            words = [word for word in full_name.split() if word.lower().strip('.') not in NAME_SUFFIXES]
+            if len(words) >= 2:
+                surname = words[-1]
+                aliases.update({surname, f"{words[0]} {surname}", f"President {surname}"})
+        aliases.update(EXTRA_ALIASES.get(president_id, []))
+        return sorted(alias for alias in aliases if alias)
+
+    @classmethod
+    def from_links(cls, links: Iterable[Tuple[str, str]]) -> "PresidentIndex":
+        """Builds the index from the (name, url) pairs yielded by Utils.iter_president_links."""
+        presidents = {}
+        for name, url in links:
+            president_id = cls.president_id(url)
+            president = presidents.setdefault(president_id, {'name': name, 'url': url, 'aliases': []})
+            # A president who served non-consecutive terms is listed twice
+            president['aliases'] = sorted(set(president['aliases']) | set(cls.aliases_for(president_id, name)))
+        return cls(presidents)
+
+    def _build_automaton(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[str]] = [[]]
+        for alias in self.ids_by_alias:
+            node = 0
+            for char in alias:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = self._goto[node][char] = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                node = next_node
+            self._output[node].append(alias)
+
+        # Breadth-first, so every node's failure link points at an already finished node
+        pending = deque(self._goto[0].values())
+        while pending:
+            node = pending.popleft()
+            for char, child in self._goto[node].items():
+                pending.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def find(self, text: str) -> List[Mention]:
+        """Returns the non-overlapping, leftmost-longest whole-word alias mentions in a text."""
+        cased = self.collapse(text)
+        text = cased.lower()
+        matches = []
+        node = 0
+        for end, char in enumerate(text, 1):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            for alias in self._output[node]:
+                start = end - len(alias)
+                if alias in self.capitalized_aliases and not cased[start].isupper():
+                    continue
+                if (start == 0 or text[start - 1] == ' ') and (end == len(text) or text[end] == ' '):
+                    matches.append((start, end, alias))
+
+        mentions, covered_until = [], 0
+        for start, end, alias in sorted(matches, key=lambda match: (match[0], match[0] - match[1])):
+            if start >= covered_until:
+                mentions.append(Mention(start, end, alias, self.ids_by_alias[alias]))
+                covered_until = end
+        return mentions
+
+    def resolve(self, text: str) -> List[str]:
+        """Returns the ids of every president mentioned in a text, in order of first mention."""
+        return list(dict.fromkeys(president_id for mention in self.find(text) for president_id in mention.ids))
+
+    def name(self, president_id: str) -> Optional[str]:
+        """The display name of a president (the title of their page)."""
+        if president_id not in self.presidents:
+            return None
+        return re.sub(r"\s*\(.*?\)", "", president_id.replace('_', ' '))
+
+    def save(self, path: str):
+        with open(path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump({'presidents': self.presidents}, file, ensure_ascii=False, indent=1)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path: str) -> "PresidentIndex":
+        with open(path, 'r', encoding='utf-8') as file:
+            return cls(json.load(file)['presidents'])
+
+
+# Example usage
+if __name__ == "__main__":
+    from Utils import fetch_page_content, parse_president_links
+
+    html_content = fetch_page_content("https://en.wikipedia.org/wiki/List_of_presidents_of_the_United_States")
+    if html_content:
+        index = PresidentIndex.from_links(parse_president_links(html_content, "https://en.wikipedia.org"))
+        index.save("president_index.json")
+        print(f"Indexed {len(index.presidents)} presidents and {len(index.ids_by_alias)} aliases")
+        for question in ["What did Lincoln do in 1863?", "Was FDR related to Teddy Roosevelt?", "Which Adams was first?"]:
+            print(question, "->", index.resolve(question))
@@ -0,0 +1,49 @@
+import random
+import threading
+import time
+
+
+class RateLimitBackoff:
+    """
+    Backoff state shared by every worker calling the same rate-limited API.
+
+    After a rate-limit error all workers wait until the same deadline. The delay
+    doubles on consecutive errors, halves on every success, and honors the
+    server's Retry-After header when present.
+    """
+
+    def __init__(self, max_delay: float = 60.0):
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._until = 0.0
+        self._delay = 0.0
+
+    def wait(self):
+        """Sleeps until the current backoff deadline, if any."""
+        with self._lock:
+            delay = self._until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def succeeded(self):
+        with self._lock:
+            self._delay /= 2
+
+    def rate_limited(self, error: Exception):
+        """Pushes back every worker after a rate-limit error."""
+        retry_after = None
+        response = getattr(error, "response", None)
+        if response is not None:
+            try:
+                retry_after = float(response.headers.get("retry-after"))
+            except (TypeError, ValueError):
+                pass
+        with self._lock:
+            self._delay = min(max(2 * self._delay, 1.0), self.max_delay)
+            delay = retry_after if retry_after is not None else self._delay * random.uniform(0.5, 1.0)
+            self._until = max(self._until, time.monotonic() + delay)
+
+    @staticmethod
+    def sleep_after_failure(attempt: int):
+        """Sleeps with jittered exponential backoff after a connection or server error."""
+        time.sleep(min(2 ** attempt, 30) * random.uniform(0.5, 1.0))
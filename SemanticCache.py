@@ -0,0 +1,154 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, List, Optional, Tuple
+import numpy as np
+
+
+class SemanticCache:
+    """
+    A cache of answers keyed by question embedding, so paraphrases share an entry.
+
+    A lookup scores the question's normalized embedding against every cached
+    one with a single matrix-vector product; the closest entry is a hit if its
+    cosine similarity is at least radius and it was stored under the same
+    scope (e.g. the president filter of the question). Entries live in the rows
+    of a preallocated matrix and are evicted least recently used first.
+
+    The cache is tied to a version of the knowledge base (see
+    ChatbotDatabase.knowledge_version): validate() empties it as soon as the
+    version changes, so added terms or facts are never hidden by stale answers.
+    """
+
+    def __init__(self, radius: float = 0.95, max_entries: int = 10_000):
+        """
+        Initializes an empty cache.
+
+        Parameters:
+            radius (float): The minimum cosine similarity between a question and a cached question for a hit.
+            max_entries (int): The maximum number of cached answers.
+        """
+        self.radius = radius
+        self.max_entries = max_entries
+        self._vectors = None  # (max_entries, dim), allocated on the first put
+        self._values: List[Optional[Tuple[Hashable, Any]]] = [None] * max_entries
+        self._lru: "OrderedDict[int, None]" = OrderedDict()  # Occupied rows, least recently used first
+        self._free = list(range(max_entries - 1, -1, -1))
+        self._lock = threading.Lock()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(x: np.ndarray) -> np.ndarray:
+        x = np.asarray(x, dtype=np.float32)
+        norms = np.linalg.norm(x, axis=-1, keepdims=True)
+        return x / np.where(norms == 0, 1, norms)
+
+    def validate(self, version: Hashable):
+        """Empties the cache if the knowledge base version differs from the one its entries were computed on."""
+        with self._lock:
+            if version != self.version:
+                if self._lru:
+                    self.invalidations += 1
+                self._clear()
+                self.version = version
+
+    def _clear(self):
+        self._values = [None] * self.max_entries
+        self._lru.clear()
+        self._free = list(range(self.max_entries - 1, -1, -1))
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def get_many(self, embeddings: np.ndarray, scopes: Optional[List[Hashable]] = None) -> List[Optional[Any]]:
+        """
+        Looks up several questions at once.
+
+        Parameters:
+            embeddings (np.ndarray): The (m, dim) question embeddings.
+            scopes (Optional[List[Hashable]]): The scope of each question; entries only match within their scope.
+
+        Returns:
+            List[Optional[Any]]: The cached value of each question, or None on a miss.
+        """
+        scopes = scopes or [None] * len(embeddings)
+        found = [None] * len(embeddings)
+        with self._lock:
+            if self._lru:
+                rows = np.fromiter(self._lru, dtype=np.int64, count=len(self._lru))
+                scores = self._normalize(embeddings) @ self._vectors[rows].T
+                # Try the closest entries first; a closer one in another scope must not hide a match
+                for i, (query_scores, scope) in enumerate(zip(scores, scopes)):
+                    candidates = np.flatnonzero(query_scores >= self.radius)
+                    for position in candidates[np.argsort(-query_scores[candidates])]:
+                        row = int(rows[position])
+                        entry_scope, value = self._values[row]
+                        if entry_scope == scope:
+                            self._lru.move_to_end(row)
+                            found[i] = value
+                            break
+            hits = sum(value is not None for value in found)
+            self.hits += hits
+            self.misses += len(found) - hits
+        return found
+
+    def get(self, embedding: np.ndarray, scope: Hashable = None) -> Optional[Any]:
+        return self.get_many(np.ravel(embedding)[None, :], [scope])[0]
+
+    def put_many(self, embeddings: np.ndarray, values: List[Any], scopes: Optional[List[Hashable]] = None,
+                 version: Hashable = None):
+        """
+        Stores the answers to several questions.
+
+        Parameters:
+            embeddings (np.ndarray): The (m, dim) question embeddings.
+            values (List[Any]): The answers; callers must not mutate them afterwards.
+            scopes (Optional[List[Hashable]]): The scope of each question.
+            version (Hashable): The knowledge base version the answers were computed on;
+                answers computed on another version than the current one are dropped.
+        """
+        scopes = scopes or [None] * len(values)
+        vectors = self._normalize(embeddings)
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, vectors.shape[1]), dtype=np.float32)
+            for vector, value, scope in zip(vectors, values, scopes):
+                if not self._free:
+                    evicted, _ = self._lru.popitem(last=False)
+                    self._values[evicted] = None
+                    self._free.append(evicted)
+                    self.evictions += 1
+                row = self._free.pop()
+                self._vectors[row] = vector
+                self._values[row] = (scope, value)
+                self._lru[row] = None
+
+    def put(self, embedding: np.ndarray, value: Any, scope: Hashable = None, version: Hashable = None):
+        self.put_many(np.ravel(embedding)[None, :], [value], [scope], version)
+
+    def stats(self) -> dict:
+        """Returns the hit/miss counters, the hit rate and the number of entries."""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self._lru),
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+
+# Example usage
+if __name__ == "__main__":
+    cache = SemanticCache(radius=0.9, max_entries=2)
+    cache.validate(version=(1, 1))
+    question = np.random.rand(256)
+    cache.put(question, "Abraham Lincoln was the 16th president.", version=(1, 1))
+    print(cache.get(question + 0.01 * np.random.rand(256)), cache.get(np.random.rand(256) - 0.5), cache.stats())
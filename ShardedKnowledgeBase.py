@@ -0,0 +1,417 @@
+import itertools
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+import numpy as np
+from EmbeddingIndex import EmbeddingMatrix
+from KnowledgeBase import ChatbotDatabase
+
+GENERAL_SHARD = '_general'  # Terms that mention no president
+SHARD_BITS = 40  # Global term id = (shard number << SHARD_BITS) | term id within the shard
+
+
+class ShardRouter:
+    """
+    Decides which shards a query is searched in.
+
+    A query that mentions presidents goes to their shards only. Otherwise the
+    query embedding is compared with the centroid of every shard: if the best
+    shard wins by at least margin, it is searched alone; if not, the query fans
+    out to every shard scoring within margin of the best (at most max_fanout),
+    plus the shards of the routing hint (e.g. the user's favorite president).
+    Without an embedding or centroids, every shard is searched.
+    """
+
+    def __init__(self, margin: float = 0.05, max_fanout: Optional[int] = None):
+        """
+        Parameters:
+            margin (float): The cosine-similarity lead the best shard needs to be searched alone.
+            max_fanout (Optional[int]): The maximum number of shards chosen by centroid; None for no limit.
+        """
+        self.margin = margin
+        self.max_fanout = max_fanout
+        self.keys: List[str] = []
+        self.centroids = np.zeros((0, 0), dtype=np.float32)
+
+    def set_centroids(self, centroids: Dict[str, np.ndarray]):
+        keys = sorted(centroids)
+        self.keys = keys
+        self.centroids = np.array([centroids[key] for key in keys], dtype=np.float32) if keys \
+            else np.zeros((0, 0), dtype=np.float32)
+
+    def route(self, shard_keys: Sequence[str], entity_ids: Sequence[str] = (),
+              embedding: Optional[np.ndarray] = None, hint: Sequence[str] = ()) -> List[str]:
+        """
+        Returns the keys of the shards to search, most likely first.
+
+        Parameters:
+            shard_keys (Sequence[str]): The existing shards.
+            entity_ids (Sequence[str]): The presidents the query mentions.
+            embedding (Optional[np.ndarray]): The query embedding.
+            hint (Sequence[str]): Presidents the conversation is about, searched whenever routing is unsure.
+        """
+        existing = set(shard_keys)
+        mentioned = [key for key in dict.fromkeys(entity_ids) if key in existing]
+        if mentioned:
+            return mentioned
+        hinted = [key for key in dict.fromkeys(hint) if key in existing]
+        if embedding is None or not len(self.keys):
+            return hinted + [key for key in shard_keys if key not in hinted]
+
+        scores = self.centroids @ EmbeddingMatrix.normalize(np.ravel(embedding).astype(np.float32))
+        order = np.argsort(-scores)
+        best = scores[order[0]]
+        if len(order) == 1 or best - scores[order[1]] >= self.margin:
+            return [self.keys[order[0]]]
+        chosen = [self.keys[i] for i in order if scores[i] >= best - self.margin][:self.max_fanout]
+        return chosen + [key for key in hinted if key not in chosen]
+
+
+class ShardedKnowledgeBase:
+    """
+    A knowledge base partitioned into one ChatbotDatabase per president.
+
+    Each term is stored in the shard of the first president it mentions (as
+    resolved by entity_resolver, e.g. PresidentIndex.resolve), or in the
+    general shard if it mentions none, so each shard has its own embedding
+    matrix and IVF index and a query scans only the shards a ShardRouter picks.
+    Queries routed to several shards are searched in parallel, and the
+    shard-local top-k lists are merged into one global top-k.
+
+    The class offers the retrieval and ingestion methods of ChatbotDatabase that
+    ChatBot and the ingestion tools use, so it can replace a single database.
+    Term ids are made global by prefixing the shard number (see SHARD_BITS).
+    Shard numbers are recorded in shards.json and never reused.
+    """
+
+    SHARDS_FILE = 'shards.json'
+
+    def __init__(self, directory: str, entity_resolver: Optional[Callable[[str], List[str]]] = None,
+                 router: Optional[ShardRouter] = None, max_workers: int = 8, **database_options):
+        """
+        Opens (or creates) the shards in a directory.
+
+        Parameters:
+            directory (str): The directory holding one SQLite database per shard.
+            entity_resolver (Optional[Callable[[str], List[str]]]): Maps a text to the president ids it
+                mentions; it assigns terms to shards and routes queries. Without it, every term goes
+                to the general shard.
+            router (Optional[ShardRouter]): The routing policy; a default ShardRouter if omitted.
+            max_workers (int): The number of shards searched in parallel.
+            database_options: Passed on to every shard's ChatbotDatabase (e.g. matrix_dtype).
+        """
+        self.directory = directory
+        self.entity_resolver = entity_resolver
+        self.router = router or ShardRouter()
+        self.database_options = database_options
+        self.shards: Dict[str, ChatbotDatabase] = {}
+        self.shard_numbers: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._centroid_generations: Dict[str, int] = {}
+        self._centroids: Dict[str, np.ndarray] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='shard-search')
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.SHARDS_FILE)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                self.shard_numbers = json.load(file)['shards']
+        for key in self.shard_numbers:
+            self._open(key)
+        self.shard(GENERAL_SHARD)  # Also holds the user preferences
+
+    # Shards and ids
+
+    def _open(self, key: str) -> ChatbotDatabase:
+        filename = re.sub(r'[^\w.-]', '_', key) + '.db'
+        database = ChatbotDatabase(os.path.join(self.directory, filename), entity_resolver=self.entity_resolver,
+                                   **self.database_options)
+        self.shards[key] = database
+        return database
+
+    def shard(self, key: str) -> ChatbotDatabase:
+        """Returns the shard with the given key, creating it if needed."""
+        database = self.shards.get(key)
+        if database is None:
+            with self._lock:
+                database = self.shards.get(key)
+                if database is None:
+                    self.shard_numbers[key] = max(self.shard_numbers.values(), default=-1) + 1
+                    path = os.path.join(self.directory, self.SHARDS_FILE)
+                    with open(path + '.tmp', 'w', encoding='utf-8') as file:
+                        json.dump({'shards': self.shard_numbers}, file, indent=1)
+                    os.replace(path + '.tmp', path)
+                    database = self._open(key)
+        return database
+
+    def shard_key_for(self, term: str) -> str:
+        """The shard a term belongs to: its first mentioned president, or the general shard."""
+        entity_ids = self.entity_resolver(term) if self.entity_resolver else []
+        return entity_ids[0] if entity_ids else GENERAL_SHARD
+
+    def global_id(self, key: str, term_id: int) -> int:
+        return (self.shard_numbers[key] << SHARD_BITS) | term_id
+
+    def split_id(self, term_id: int) -> Tuple[str, int]:
+        """Returns the shard key and shard-local id of a global term id."""
+        number = term_id >> SHARD_BITS
+        key = next(key for key, shard_number in self.shard_numbers.items() if shard_number == number)
+        return key, term_id & ((1 << SHARD_BITS) - 1)
+
+    def _group_ids(self, term_ids: Iterable[int]) -> Dict[str, List[int]]:
+        keys_by_number = {number: key for key, number in self.shard_numbers.items()}
+        groups = {}
+        for term_id in term_ids:
+            key = keys_by_number.get(term_id >> SHARD_BITS)
+            if key is not None:
+                groups.setdefault(key, []).append(term_id & ((1 << SHARD_BITS) - 1))
+        return groups
+
+    def _globalize(self, key: str, results: List[Tuple[int, str, float]]) -> List[Tuple[int, str, float]]:
+        return [(self.global_id(key, term_id), fact, score) for term_id, fact, score in results]
+
+    # Routing
+
+    def refresh_router(self):
+        """Recomputes the centroid of every shard whose embeddings changed since the last call."""
+        changed = False
+        for key, database in list(self.shards.items()):
+            database.refresh_if_stale()
+            if self._centroid_generations.get(key) == database.generation:
+                continue
+            vectors = database.embedding_matrix.float_vectors()
+            if len(vectors):
+                self._centroids[key] = EmbeddingMatrix.normalize(vectors.mean(axis=0))
+            else:
+                self._centroids.pop(key, None)
+            self._centroid_generations[key] = database.generation
+            changed = True
+        if changed:
+            self.router.set_centroids(self._centroids)
+
+    def route(self, query: Optional[str] = None, embedding: Optional[np.ndarray] = None,
+              hint: Sequence[str] = (), term_ids: Optional[List[int]] = None) -> Dict[str, Optional[List[int]]]:
+        """
+        Picks the shards a query is searched in. Call refresh_router first for the centroids
+        to reflect recent writes.
+
+        Returns:
+            Dict[str, Optional[List[int]]]: Per chosen shard, the shard-local term ids to restrict the
+            search to (None to search the whole shard).
+        """
+        if term_ids is not None:
+            return self._group_ids(term_ids)
+        entity_ids = self.entity_resolver(query) if query and self.entity_resolver else []
+        return {key: None for key in self.router.route(list(self.shards), entity_ids, embedding, hint)}
+
+    @staticmethod
+    def merge(results: List[List[Tuple[int, str, float]]], top_k: int, by_term: bool = False,
+              by_rank: bool = False) -> List[Tuple[int, str, float]]:
+        """
+        Merges shard-local (term_id, fact, similarity) lists, each best first, into one list.
+
+        The results of a single shard are kept in their own order. Several shards are
+        merged by similarity, or with by_rank by each fact's rank within its shard
+        (ties broken by similarity), which keeps the order of rankings whose scores
+        are not comparable between shards, such as reciprocal-rank fusion.
+
+        Parameters:
+            results (List[List[Tuple[int, str, float]]]): The results of each shard.
+            top_k (int): The number of facts kept, or with by_term the number of terms whose facts are kept.
+            by_term (bool): Counts top_k in terms, as retrieve_facts_by_embeddings does, instead of facts.
+            by_rank (bool): Interleaves the shards by rank instead of sorting by similarity.
+        """
+        results = [result for result in results if result]
+        if len(results) == 1:
+            ranked = results[0]
+        elif by_rank:
+            ranked = [match for _, _, _, match in sorted(
+                ((rank, -match[2], shard, match) for shard, shard_results in enumerate(results)
+                 for rank, match in enumerate(shard_results)), key=lambda entry: entry[:3])]
+        else:
+            # A stable sort keeps each shard's own order between facts of equal similarity
+            ranked = sorted(itertools.chain.from_iterable(results), key=lambda result: -result[2])
+        if not by_term:
+            return ranked[:top_k]
+        terms = set()
+        for position, (term_id, _, _) in enumerate(ranked):
+            if term_id not in terms:
+                if len(terms) == top_k:
+                    return ranked[:position]
+                terms.add(term_id)
+        return ranked
+
+    def _fan_out(self, routes: List[Dict[str, Optional[List[int]]]], search: Callable, top_k: int,
+                 by_term: bool = False, by_rank: bool = False) -> list:
+        """
+        Runs search(shard, positions, term_ids) once per shard for all queries routed to it, in
+        parallel, and merges each query's shard-local results (see merge).
+        """
+        positions_by_shard = {}
+        for position, route in enumerate(routes):
+            for key, term_ids in route.items():
+                group = (key, tuple(term_ids) if term_ids is not None else None)
+                positions_by_shard.setdefault(group, []).append(position)
+
+        def run(group):
+            key, term_ids = group
+            positions = positions_by_shard[group]
+            results = search(self.shards[key], positions, list(term_ids) if term_ids is not None else None)
+            return positions, [self._globalize(key, result) for result in results]
+
+        per_query = [[] for _ in routes]
+        for positions, results in self._executor.map(run, list(positions_by_shard)):
+            for position, result in zip(positions, results):
+                per_query[position].append(result)
+        return [self.merge(results, top_k, by_term, by_rank) for results in per_query]
+
+    # Retrieval
+
+    def retrieve_facts_by_embeddings(self, input_embeddings: np.ndarray, top_k: int = 5, search: str = 'exact',
+                                     nprobe: int = 8, term_ids: Optional[List[int]] = None,
+                                     hint: Sequence[str] = ()) -> List[List[Tuple[int, str, float]]]:
+        """As ChatbotDatabase.retrieve_facts_by_embeddings, searching only the shards each query is routed to."""
+        self.refresh_router()
+        routes = [self.route(embedding=embedding, hint=hint, term_ids=term_ids) for embedding in input_embeddings]
+        return self._fan_out(routes, lambda shard, positions, shard_term_ids: shard.retrieve_facts_by_embeddings(
+            input_embeddings[positions], top_k, search, nprobe, shard_term_ids), top_k, by_term=True)
+
+    def retrieve_facts_by_embedding(self, input_embedding: np.ndarray, top_k: int = 5, search: str = 'exact',
+                                    nprobe: int = 8, term_ids: Optional[List[int]] = None,
+                                    hint: Sequence[str] = ()) -> list:
+        matches = self.retrieve_facts_by_embeddings(np.ravel(input_embedding)[None, :], top_k, search, nprobe,
+                                                    term_ids, hint)[0]
+        return [(fact, similarity) for _, fact, similarity in matches]
+
+    def retrieve_facts_hybrid(self, queries: List[str], input_embeddings: np.ndarray, top_k: int = 5,
+                              depth: Optional[int] = None, rrf_k: int = 60, search: str = 'exact',
+                              nprobe: int = 8, term_ids: Optional[List[int]] = None,
+                              hint: Sequence[str] = ()) -> List[List[Tuple[int, str, float]]]:
+        """
+        As ChatbotDatabase.retrieve_facts_hybrid, fusing within each routed shard. A single shard's
+        ranking is returned as is; several are interleaved by rank (see merge), since fused
+        scores depend on each shard's own candidate lists.
+        hint (Sequence[str]) names the presidents the conversation is about; their shards are
+        searched whenever routing is unsure.
+        """
+        self.refresh_router()
+        routes = [self.route(query, embedding, hint, term_ids) for query, embedding in zip(queries, input_embeddings)]
+        return self._fan_out(routes, lambda shard, positions, shard_term_ids: shard.retrieve_facts_hybrid(
+            [queries[i] for i in positions], input_embeddings[positions], top_k, depth, rrf_k, search, nprobe,
+            shard_term_ids), top_k, by_rank=True)
+
+    def lexical_match(self, query: str, term_ids: Optional[List[int]] = None,
+                      limit: int = 20) -> Optional[List[Tuple[int, str, float]]]:
+        """As ChatbotDatabase.lexical_match; the routed shards are tried in turn."""
+        for key, shard_term_ids in self.route(query, term_ids=term_ids).items():
+            matches = self.shards[key].lexical_match(query, shard_term_ids, limit)
+            if matches is not None:
+                return self._globalize(key, matches)
+        return None
+
+    def retrieve_facts(self, term: str) -> List[str]:
+        return self.shard(self.shard_key_for(term)).retrieve_facts(term)
+
+    def retrieve_facts_by_term_ids(self, term_ids: List[int]) -> dict:
+        facts = {}
+        for key, local_ids in self._group_ids(term_ids).items():
+            facts.update((self.global_id(key, term_id), shard_facts)
+                         for term_id, shard_facts in self.shards[key].retrieve_facts_by_term_ids(local_ids).items())
+        return facts
+
+    def retrieve_terms_by_term_ids(self, term_ids: List[int]) -> dict:
+        terms = {}
+        for key, local_ids in self._group_ids(term_ids).items():
+            terms.update((self.global_id(key, term_id), term)
+                         for term_id, term in self.shards[key].retrieve_terms_by_term_ids(local_ids).items())
+        return terms
+
+    def term_ids_for_entities(self, entity_ids: List[str]) -> List[int]:
+        term_ids = []
+        for key, database in list(self.shards.items()):
+            term_ids += [self.global_id(key, term_id) for term_id in database.term_ids_for_entities(entity_ids)]
+        return term_ids
+
+    def knowledge_version(self) -> tuple:
+        return tuple(sorted((key, database.knowledge_version()) for key, database in list(self.shards.items())))
+
+    def build_ann_index(self, n_lists: Optional[int] = None):
+        for database in list(self.shards.values()):
+            database.build_ann_index(n_lists)
+
+    # Ingestion
+
+    def add_term_with_embedding(self, term: str, embedding: Union[bytes, np.ndarray]):
+        self.shard(self.shard_key_for(term)).add_term_with_embedding(term, embedding)
+
+    def add_fact(self, term: str, fact: str):
+        self.shard(self.shard_key_for(term)).add_fact(term, fact)
+
+    def _bulk_add(self, items: Iterable[tuple], add: Callable, batch_size: int) -> dict:
+        """Buffers rows per shard and writes each shard's buffer with add(shard, rows) when it fills up."""
+        start = time.perf_counter()
+        buffers, reports = {}, []
+        for item in items:
+            key = self.shard_key_for(item[0])
+            buffer = buffers.setdefault(key, [])
+            buffer.append(item)
+            if len(buffer) >= batch_size:
+                reports.append(add(self.shard(key), buffer))
+                buffers[key] = []
+        reports += [add(self.shard(key), buffer) for key, buffer in buffers.items() if buffer]
+        rows = sum(report['rows'] for report in reports)
+        seconds = time.perf_counter() - start
+        return {'rows': rows, 'skipped': sum(report.get('skipped', 0) for report in reports), 'seconds': seconds,
+                'rows_per_sec': rows / seconds if seconds > 0 else float('inf')}
+
+    def bulk_add_terms(self, items: Iterable[Tuple[str, Union[bytes, np.ndarray]]], batch_size: int = 10000) -> dict:
+        """As ChatbotDatabase.bulk_add_terms; each shard receives its terms in batches of up to batch_size."""
+        return self._bulk_add(items, lambda shard, rows: shard.bulk_add_terms(rows, batch_size), batch_size)
+
+    def bulk_add_facts(self, items: Iterable[Tuple[str, str]], batch_size: int = 10000) -> dict:
+        return self._bulk_add(items, lambda shard, rows: shard.bulk_add_facts(rows, batch_size), batch_size)
+
+    def import_database(self, source: ChatbotDatabase, batch_size: int = 10000) -> dict:
+        """Copies the terms, embeddings and facts of a single database into the shards."""
+        def terms():
+            for term, blob in source.execute_query(
+                    'SELECT term, embedding FROM Terms INNER JOIN Embeddings ON Terms.term_id = Embeddings.term_id'):
+                yield term, blob
+
+        def facts():
+            yield from source.execute_query(
+                'SELECT term, fact FROM Facts INNER JOIN Terms ON Facts.term_id = Terms.term_id ORDER BY fact_id')
+
+        return {'terms': self.bulk_add_terms(terms(), batch_size), 'facts': self.bulk_add_facts(facts(), batch_size)}
+
+    # Preferences live in the general shard
+
+    def upsert_preferences(self, rows: Iterable[Tuple[str, str, str, float]]):
+        self.shards[GENERAL_SHARD].upsert_preferences(rows)
+
+    def read_preferences(self, user_id: str) -> dict:
+        return self.shards[GENERAL_SHARD].read_preferences(user_id)
+
+    def stats(self) -> Dict[str, int]:
+        """The number of embedded terms per shard."""
+        return {key: database.embedding_matrix.size for key, database in self.shards.items()}
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for database in self.shards.values():
+            database.close()
+
+
+# Example usage
+if __name__ == "__main__":
+    from ChatBOT import DATABASE_PATH, PRESIDENT_INDEX_PATH
+    from PresidentIndex import PresidentIndex
+
+    president_index = PresidentIndex.load(PRESIDENT_INDEX_PATH)
+    sharded = ShardedKnowledgeBase('chatbot_shards', entity_resolver=president_index.resolve)
+    print(sharded.import_database(ChatbotDatabase(DATABASE_PATH)))
+    print(sharded.stats())
+    sharded.close()
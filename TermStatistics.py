@@ -0,0 +1,190 @@
+import heapq
+import math
+import os
+import re
+import sqlite3
+from collections import Counter
+from typing import Iterable, List, Optional, Tuple
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+# The same tokenization as TfidfVectorizer(stop_words='english')
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+
+class TermStatistics:
+    """
+    Incrementally maintained TF-IDF statistics of a corpus of cleaned text files.
+
+    For every term the store keeps its document frequency and the sum, over the
+    documents containing it, of its L2-normalized term frequency. Adding,
+    changing or removing a document only touches that document's terms, so
+    top-k scores are available on demand without re-reading the corpus, and
+    nothing but one document's term counts is ever held in memory.
+
+    Scores approximate the mean TF-IDF that TfidfVectorizer would give (smooth
+    idf, l2 norm). They are exact up to the normalization step: each document's
+    term frequencies are normalized before the idf is applied, because the idf
+    keeps changing as the corpus grows.
+    """
+
+    def __init__(self, path: str = ':memory:'):
+        """
+        Opens (or creates) the statistics store.
+
+        Parameters:
+            path (str): The SQLite file holding the statistics.
+        """
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS Documents (
+                doc_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT UNIQUE NOT NULL,
+                mtime REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS DocumentTerms (
+                doc_id INTEGER NOT NULL,
+                term TEXT NOT NULL,
+                weight REAL NOT NULL,
+                PRIMARY KEY (doc_id, term),
+                FOREIGN KEY (doc_id) REFERENCES Documents(doc_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS TermStats (
+                term TEXT PRIMARY KEY,
+                df INTEGER NOT NULL,
+                tf_sum REAL NOT NULL
+            ) WITHOUT ROWID;
+        ''')
+        self.connection.commit()
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        """Splits lowercased text into tokens of two or more word characters, without English stop words."""
+        return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in ENGLISH_STOP_WORDS]
+
+    @classmethod
+    def count_text(cls, text: str) -> Counter:
+        """Counts the terms of a text."""
+        return Counter(cls.tokenize(text))
+
+    @classmethod
+    def count_file(cls, path: str) -> Counter:
+        """Counts the terms of a text file, reading it line by line."""
+        counts = Counter()
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                counts.update(cls.tokenize(line))
+        return counts
+
+    @property
+    def n_documents(self) -> int:
+        return self.connection.execute('SELECT COUNT(*) FROM Documents').fetchone()[0]
+
+    def document_mtime(self, name: str) -> Optional[float]:
+        """Returns the modification time recorded for a document, or None if it is not in the store."""
+        row = self.connection.execute('SELECT mtime FROM Documents WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def _subtract_document(self, doc_id: int):
+        self.connection.execute('''
+            UPDATE TermStats SET
+                df = df - 1,
+                tf_sum = tf_sum - (SELECT weight FROM DocumentTerms WHERE doc_id = ? AND term = TermStats.term)
+            WHERE term IN (SELECT term FROM DocumentTerms WHERE doc_id = ?)
+        ''', (doc_id, doc_id))
+        self.connection.execute('DELETE FROM TermStats WHERE df <= 0')
+        self.connection.execute('DELETE FROM DocumentTerms WHERE doc_id = ?', (doc_id,))
+
+    def update_document(self, name: str, counts: Counter, mtime: float = 0.0):
+        """
+        Adds a document's term counts to the statistics, replacing its previous version if any.
+
+        Parameters:
+            name (str): The document's unique name.
+            counts (Counter): The number of occurrences of each term in the document.
+            mtime (float): The document's modification time, used to skip unchanged files.
+        """
+        norm = math.sqrt(sum(count * count for count in counts.values())) or 1.0
+        weights = [(term, count / norm) for term, count in counts.items()]
+        with self.connection:
+            row = self.connection.execute('SELECT doc_id FROM Documents WHERE name = ?', (name,)).fetchone()
+            if row:
+                doc_id = row[0]
+                self._subtract_document(doc_id)
+                self.connection.execute('UPDATE Documents SET mtime = ? WHERE doc_id = ?', (mtime, doc_id))
+            else:
+                doc_id = self.connection.execute(
+                    'INSERT INTO Documents (name, mtime) VALUES (?, ?)', (name, mtime)).lastrowid
+            self.connection.executemany('INSERT INTO DocumentTerms (doc_id, term, weight) VALUES (?, ?, ?)',
+                                        ((doc_id, term, weight) for term, weight in weights))
+            self.connection.executemany('''
+                INSERT INTO TermStats (term, df, tf_sum) VALUES (?, 1, ?)
+                ON CONFLICT(term) DO UPDATE SET df = df + 1, tf_sum = tf_sum + excluded.tf_sum
+            ''', weights)
+
+    def remove_document(self, name: str):
+        """Removes a document's contribution to the statistics."""
+        with self.connection:
+            row = self.connection.execute('SELECT doc_id FROM Documents WHERE name = ?', (name,)).fetchone()
+            if row:
+                self._subtract_document(row[0])
+                self.connection.execute('DELETE FROM Documents WHERE doc_id = ?', (row[0],))
+
+    def update_directory(self, directory: str, prune: bool = True) -> int:
+        """
+        Brings the statistics up to date with a directory of cleaned text files.
+
+        Only files that are new or were modified since they were last counted are
+        read. With prune set, documents whose file no longer exists are removed.
+
+        Returns:
+            int: The number of files that were (re)counted.
+        """
+        names = sorted(os.listdir(directory))
+        updated = 0
+        for name in names:
+            path = os.path.join(directory, name)
+            if not os.path.isfile(path):
+                continue
+            mtime = os.path.getmtime(path)
+            if self.document_mtime(name) == mtime:
+                continue
+            self.update_document(name, self.count_file(path), mtime)
+            updated += 1
+        if prune:
+            present = set(names)
+            for (name,) in self.connection.execute('SELECT name FROM Documents').fetchall():
+                if name not in present:
+                    self.remove_document(name)
+        return updated
+
+    @staticmethod
+    def idf(df: int, n_documents: int) -> float:
+        """The smooth inverse document frequency used by TfidfVectorizer."""
+        return math.log((1 + n_documents) / (1 + df)) + 1
+
+    def iter_scores(self) -> Iterable[Tuple[str, float]]:
+        """Yields (term, approximate mean tf-idf) for every term, streaming from the store."""
+        n_documents = self.n_documents
+        if not n_documents:
+            return
+        for term, df, tf_sum in self.connection.execute('SELECT term, df, tf_sum FROM TermStats'):
+            yield term, self.idf(df, n_documents) * tf_sum / n_documents
+
+    def top_terms(self, k: int = 40) -> List[Tuple[str, float]]:
+        """Returns the k terms with the highest approximate mean tf-idf, best first."""
+        return heapq.nlargest(k, self.iter_scores(), key=lambda item: item[1])
+
+    def close(self):
+        self.connection.close()
+
+
+# Example usage
+if __name__ == "__main__":
+    stats = TermStatistics("cleaned_content.termstats.db")
+    print(f"Counted {stats.update_directory('cleaned_content')} new or changed files")
+    for term, score in stats.top_terms(40):
+        print(f"{term}: {score}")
+    stats.close()
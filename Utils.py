@@ -1,75 +1,154 @@
 import os
 import spacy
 from spacy.lang.en.stop_words import STOP_WORDS
-from sklearn.feature_extraction.text import TfidfVectorizer
-import numpy as np
+from TermStatistics import TermStatistics
 
 
 
-def clean_text_file(input_dir, output_dir, filename):
-    """Cleans the content of a given file using NLP techniques."""
-    # Load the SpaCy model for English
-    nlp = spacy.load("en_core_web_sm")
+CLEANING_MODEL = "en_core_web_sm"
+CLEANING_DISABLED_PIPES = ["parser", "ner"]  # Only lemma/stop/punct flags are used
+CHUNK_CHARS = 100_000
+
+_cleaning_nlp = None
+
+
+def load_cleaning_model():
+    """Loads the spaCy model used for cleaning once per process, without the pipes cleaning does not use."""
+    global _cleaning_nlp
+    if _cleaning_nlp is None:
+        _cleaning_nlp = spacy.load(CLEANING_MODEL, disable=CLEANING_DISABLED_PIPES)
+    return _cleaning_nlp
+
+
+def clean_doc(doc):
+    """
+    Returns the lemmas of a processed document, without stop words, punctuation and whitespace.
+    Pipelines without a lemmatizer (e.g. spacy.blank) leave lemma_ empty; the lowercased word is used instead.
+    """
+    return " ".join(token.lemma_ or token.lower_ for token in doc
+                    if not (token.is_stop or token.is_punct or token.is_space))
+
+
+def read_chunks(path, chunk_chars=CHUNK_CHARS):
+    """
+    Reads a text file lowercased, in chunks of roughly chunk_chars characters.
 
+    Chunks end at the last newline (or whitespace) of each block, so words are
+    never split and memory stays bounded regardless of the file size.
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        remainder = ""
+        while True:
+            block = file.read(chunk_chars)
+            if not block:
+                break
+            text = remainder + block
+            cut = text.rfind("\n")
+            if cut <= 0:
+                cut = max(text.rfind(" "), 0)
+            chunk, remainder = (text[:cut], text[cut:]) if cut else (text, "")
+            if chunk.strip():
+                yield chunk.lower()  # Normalize text to lowercase
+        if remainder.strip():
+            yield remainder.lower()
+
+
+def is_up_to_date(input_path, output_path):
+    """Whether the output exists and is at least as new as its input."""
+    return os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(input_path)
+
+
+def clean_text_file(input_dir, output_dir, filename, nlp=None):
+    """Cleans the content of a given file using NLP techniques."""
+    nlp = nlp or load_cleaning_model()
     input_path = os.path.join(input_dir, filename)
     output_path = os.path.join(output_dir, filename)
-    
-    # Read the raw text
-    with open(input_path, 'r', encoding='utf-8') as file:
-        raw_text = file.read()
-    
-    # NLP Processing
-    doc = nlp(raw_text.lower())  # Normalize text to lowercase
-    cleaned_text = []
-    
-    for token in doc:
-        if token.is_stop or token.is_punct or token.is_space:
-            continue  # Skip stop words, punctuation, and whitespace
-        cleaned_text.append(token.lemma_)  # Use lemmatized form of the word
-    
-    # Write the cleaned text to a new file
-    with open(output_path, 'w', encoding='utf-8') as file:
-        file.write(" ".join(cleaned_text))
 
+    with open(output_path + '.tmp', 'w', encoding='utf-8') as file:
+        for i, doc in enumerate(nlp.pipe(read_chunks(input_path))):
+            file.write((" " if i else "") + clean_doc(doc))
+    os.replace(output_path + '.tmp', output_path)
 
-def process_directory(input_dir, output_dir):
-    """Processes each file in the input directory with the cleaning function."""
-    
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)  
-    
-    for filename in os.listdir(input_dir):
-        if filename.endswith('.txt'): 
-            clean_text_file(input_dir, output_dir, filename)
-            print(f"Processed {filename}")
 
+def process_directory(input_dir, output_dir, batch_size=16, n_process=None, chunk_chars=CHUNK_CHARS,
+                      force=False, nlp=None):
+    """
+    Processes each file in the input directory with the cleaning function.
+
+    The model is loaded once, and the chunks of every file are streamed through
+    nlp.pipe in batches, fanned out over n_process worker processes (all CPU
+    cores by default). Files whose cleaned output is newer than the input are
+    skipped unless force is set. Each output is written to a temporary file and
+    renamed when complete, so an interrupted run never leaves an output that
+    looks up to date.
+
+    Args:
+        input_dir (str): The directory of raw .txt files.
+        output_dir (str): The directory the cleaned files are written to.
+        batch_size (int): The number of chunks per nlp.pipe batch.
+        n_process (int): The number of worker processes; None uses every CPU core.
+        chunk_chars (int): The approximate size of the chunks large files are split into.
+        force (bool): Whether to reprocess files whose output is up to date.
+        nlp: A preloaded spaCy pipeline to use instead of the default cleaning model.
+
+    Returns:
+        list of str: The names of the files that were processed.
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
 
+    pending = [filename for filename in sorted(os.listdir(input_dir))
+               if filename.endswith('.txt')
+               and (force or not is_up_to_date(os.path.join(input_dir, filename),
+                                               os.path.join(output_dir, filename)))]
+    if not pending:
+        return []
+    nlp = nlp or load_cleaning_model()
+    n_process = n_process or os.cpu_count() or 1
+    if len(pending) == 1 and os.path.getsize(os.path.join(input_dir, pending[0])) <= chunk_chars:
+        n_process = 1  # Not worth starting worker processes for a single chunk
 
-def extract_important_terms(directory, max_features=40):
-    """Extracts important terms from cleaned text files in a directory using TF-IDF."""
-    texts = []
-    file_names = []
+    def chunks():
+        for filename in pending:
+            for chunk in read_chunks(os.path.join(input_dir, filename), chunk_chars):
+                yield chunk, filename
+            yield "", filename  # Marks the end of the file, even when it has no text
 
-    # Read and preprocess text files
-    for file_name in os.listdir(directory):
-        file_path = os.path.join(directory, file_name)
-        with open(file_path, 'r', encoding='utf-8') as file:
-            texts.append(file.read().lower())  # Ensure text is in lowercase
-            file_names.append(file_name)
+    # nlp.pipe yields in input order, so each file's chunks arrive contiguously
+    current, out = None, None
+    try:
+        for doc, filename in nlp.pipe(chunks(), as_tuples=True, batch_size=batch_size, n_process=n_process):
+            output_path = os.path.join(output_dir, filename)
+            if filename != current:
+                current, out, written = filename, open(output_path + '.tmp', 'w', encoding='utf-8'), False
+            if len(doc):
+                out.write((" " if written else "") + clean_doc(doc))
+                written = True
+            else:
+                out.close()
+                os.replace(output_path + '.tmp', output_path)
+                print(f"Processed {filename}")
+    finally:
+        if out is not None and not out.closed:
+            out.close()
+    return pending
 
-    # Calculate TF-IDF
-    vectorizer = TfidfVectorizer(stop_words='english', max_features=max_features)
-    tfidf_matrix = vectorizer.fit_transform(texts)
 
-    # Extract feature names and tf-idf scores
-    feature_names = vectorizer.get_feature_names_out()
-    scores = np.mean(tfidf_matrix, axis=0).tolist()[0]  # Mean tf-idf score for each term across all documents
-    terms_scores = list(zip(feature_names, scores))
 
-    # Sort terms by their score and select top 25 to 40
-    important_terms = sorted(terms_scores, key=lambda x: x[1], reverse=True)[:max_features]
+def extract_important_terms(directory, max_features=40, stats_path=None):
+    """
+    Extracts important terms from cleaned text files in a directory using TF-IDF.
 
-    return important_terms
+    Term statistics are kept in a SQLite store (by default next to the directory)
+    and updated with only the new or changed files, so repeated runs do not
+    re-read the corpus. See TermStatistics for how the scores are computed.
+    """
+    stats = TermStatistics(stats_path or os.path.normpath(directory) + '.termstats.db')
+    try:
+        stats.update_directory(directory)
+        return stats.top_terms(max_features)
+    finally:
+        stats.close()
 
 # Example usage
 #directory = "cleaned_content"
@@ -87,15 +166,34 @@ def extract_important_terms(directory, max_features=40):
 
 
 # Import necessary libraries
+import time
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 
-def fetch_page_content(url):
+try:
+    import lxml  # noqa: F401  (only needed as a BeautifulSoup backend)
+    DEFAULT_HTML_PARSER = 'lxml'
+except ImportError:
+    DEFAULT_HTML_PARSER = 'html.parser'
+
+# Only the elements the extractors read are materialized when parsing with these
+PRESIDENT_LINK_STRAINER = SoupStrainer('td', attrs={'data-sort-value': True})
+MAIN_CONTENT_STRAINER = SoupStrainer(id='mw-content-text')
+NON_TEXT_TAGS = ['script', 'style', 'sup', 'table']
+
+DEFAULT_TIMEOUT = 10
+# Saved listing and article pages that benchmark_parsers runs on by default
+PARSER_FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'pages')
+
+
+def fetch_page_content(url, session=None, timeout=DEFAULT_TIMEOUT):
     """
     Fetches the content of a webpage.
     
     Args:
         url (str): The URL of the webpage to fetch.
+        session (requests.Session): A session whose pooled connections are reused; None makes a one-off request.
+        timeout (float): The connect and read timeout in seconds.
         
     Returns:
         str: The HTML content of the page.
@@ -104,37 +202,74 @@ def fetch_page_content(url):
         requests.exceptions.RequestException: If an error occurs during the request.
     """
     try:
-        response = requests.get(url)
+        response = (session or requests).get(url, timeout=timeout)
         response.raise_for_status()  # Raises an HTTPError if the status is 4xx, 5xx
         return response.text
     except requests.exceptions.RequestException as e:
         print(f"Error fetching the page content: {e}")
         return None
 
-def parse_html(html_content):
+def parse_html(html_content, backend=None, parse_only=None):
     """
     Parses HTML content to create a BeautifulSoup object.
     
     Args:
         html_content (str): The HTML content to parse.
+        backend (str): The BeautifulSoup tree builder; defaults to lxml when it is installed.
+        parse_only (SoupStrainer): Builds only the matching elements (and their descendants).
         
     Returns:
         BeautifulSoup: The BeautifulSoup object for parsed HTML content.
     """
-    return BeautifulSoup(html_content, 'html.parser')
+    return BeautifulSoup(html_content, backend or DEFAULT_HTML_PARSER, parse_only=parse_only)
 
-def extract_links(soup, base_url):
+def parse_president_links(html_content, base_url, backend=None):
     """
-    Extracts and formats Wikipedia links related to US Presidents based on the provided HTML structure.
+    Extracts the (name, url) president links from the listing page, building only the td elements they live in.
     
     Args:
-        soup (BeautifulSoup): The BeautifulSoup object containing the parsed HTML content.
+        html_content (str): The HTML content of the listing page.
         base_url (str): The base URL to append to relative links for completeness.
+        backend (str): The BeautifulSoup tree builder.
         
     Returns:
-        list of str: A list of formatted strings containing president names and their Wikipedia links.
+        list of tuple: The president names and the full URLs of their pages.
+    """
+    return list(iter_president_links(parse_html(html_content, backend, PRESIDENT_LINK_STRAINER), base_url))
+
+def extract_main_text(html_content, backend=None):
+    """
+    Extracts the readable text of an article body.
+    
+    Only the Wikipedia content element is built; pages without one fall back to
+    the whole body. Scripts, styles, footnote markers and tables are dropped.
+    
+    Args:
+        html_content (str): The HTML content of the article.
+        backend (str): The BeautifulSoup tree builder.
+        
+    Returns:
+        str: The article text, one block per line.
+    """
+    root = parse_html(html_content, backend, MAIN_CONTENT_STRAINER).find(id='mw-content-text')
+    if root is None:
+        soup = parse_html(html_content, backend)
+        root = soup.body or soup
+    for tag in root.find_all(NON_TEXT_TAGS):
+        tag.decompose()
+    return root.get_text('\n', strip=True)
+
+def iter_president_links(soup, base_url):
+    """
+    Yields the Wikipedia links related to US Presidents based on the provided HTML structure.
+
+    Args:
+        soup (BeautifulSoup): The BeautifulSoup object containing the parsed HTML content.
+        base_url (str): The base URL to append to relative links for completeness.
+
+    Yields:
+        tuple of (str, str): The president's name and the full URL of their page.
     """
-    links = []
     # Find all 'td' elements with a 'data-sort-value' attribute, which contains the president's name
     for td in soup.find_all('td', {'data-sort-value': True}):
         # Extracting the name and the relative link
@@ -142,9 +277,20 @@ def extract_links(soup, base_url):
         link_tag = td.find('a', href=True)
         if link_tag and president_name:
             # Construct the full URL
-            full_link = base_url + link_tag['href']
-            links.append(f"{president_name}: {full_link}")
-    return links
+            yield president_name, base_url + link_tag['href']
+
+def extract_links(soup, base_url):
+    """
+    Extracts and formats Wikipedia links related to US Presidents based on the provided HTML structure.
+    
+    Args:
+        soup (BeautifulSoup): The BeautifulSoup object containing the parsed HTML content.
+        base_url (str): The base URL to append to relative links for completeness.
+        
+    Returns:
+        list of str: A list of formatted strings containing president names and their Wikipedia links.
+    """
+    return [f"{president_name}: {full_link}" for president_name, full_link in iter_president_links(soup, base_url)]
 
 def display_links(links):
     """
@@ -156,6 +302,48 @@ def display_links(links):
     for link in links:
         print(link)
 
+def benchmark_parsers(fixture_dir=PARSER_FIXTURE_DIR, backends=('html.parser', 'lxml', 'html5lib'), repeat=3):
+    """
+    Times link and main-text extraction on saved pages with every installed backend, with and without strainers.
+    
+    Args:
+        fixture_dir (str): A directory of saved .html pages; the committed fixtures by default.
+        backends (tuple of str): The BeautifulSoup tree builders to compare; missing ones are skipped.
+        repeat (int): The number of timed runs per mode; the best run is reported.
+        
+    Returns:
+        dict: Seconds per mode, keyed by backend and then by mode.
+    """
+    pages = []
+    for filename in sorted(os.listdir(fixture_dir)):
+        if filename.endswith(('.html', '.htm')):
+            with open(os.path.join(fixture_dir, filename), 'r', encoding='utf-8') as file:
+                pages.append(file.read())
+    modes = {
+        'full tree + extract_links': lambda html, backend: extract_links(parse_html(html, backend), ""),
+        'strained links': lambda html, backend: parse_president_links(html, "", backend),
+        'full tree + body text': lambda html, backend: parse_html(html, backend).get_text('\n', strip=True),
+        'strained main text': lambda html, backend: extract_main_text(html, backend),
+    }
+    results = {}
+    for backend in backends:
+        try:
+            BeautifulSoup("", backend)
+        except Exception:
+            print(f"Skipping backend {backend}: not installed")
+            continue
+        results[backend] = {}
+        for mode, extract in modes.items():
+            best = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for html in pages:
+                    extract(html, backend)
+                best = min(best, time.perf_counter() - start)
+            results[backend][mode] = best
+            print(f"{backend:12} {mode:28} {1000 * best:9.1f} ms for {len(pages)} pages")
+    return results
+
 # Main program function
 def main():
     url = "https://en.wikipedia.org/wiki/List_of_presidents_of_the_United_States"
@@ -163,11 +351,11 @@ def main():
     
     html_content = fetch_page_content(url)
     if html_content:
-        soup = parse_html(html_content)
+        soup = parse_html(html_content, parse_only=PRESIDENT_LINK_STRAINER)
         links = extract_links(soup, base_url)
         display_links(links)
     else:
         print("Failed to fetch or parse page content.")
 
-
-
+if __name__ == "__main__":
+    benchmark_parsers()
@@ -0,0 +1,311 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+from urllib import robotparser
+from urllib.parse import unquote, urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from Utils import DEFAULT_TIMEOUT, extract_main_text, fetch_page_content, parse_president_links
+
+LISTING_URL = "https://en.wikipedia.org/wiki/List_of_presidents_of_the_United_States"
+BASE_URL = "https://en.wikipedia.org"
+USER_AGENT = "ChatbotCrawler/1.0 (+https://github.com/IamArmanNikkhah/Chatbot)"
+
+
+class _HostSlot:
+    """Per-host politeness state: a concurrency limit and the earliest time of the next request."""
+
+    def __init__(self, concurrency: int):
+        self.semaphore = threading.Semaphore(concurrency)
+        self.lock = threading.Lock()
+        self.next_request_at = 0.0
+        self.robots = None
+
+
+class WebCrawler:
+    """
+    A resumable, polite crawler that writes page text into the scraped_content layout.
+
+    URLs wait in a persistent frontier until they are fetched; fetched pages are
+    remembered together with their ETag and Last-Modified headers, so a later
+    crawl of the same URL is a conditional GET that costs a 304 when the page
+    is unchanged. Both live in a SQLite file, so an interrupted crawl resumes
+    where it stopped. Requests share one pooled requests.Session and are spread
+    over a thread pool, with at most per_host_concurrency requests in flight
+    per host, at least delay seconds apart (or the host's robots.txt
+    Crawl-delay, if longer).
+
+    Each page is saved as <output_dir>/<page name>.txt, the input that
+    Utils.process_directory consumes.
+    """
+
+    def __init__(self, output_dir: str = "scraped_content", state_path: Optional[str] = None,
+                 max_workers: int = 8, per_host_concurrency: int = 2, delay: float = 1.0,
+                 timeout: float = DEFAULT_TIMEOUT, max_attempts: int = 3, respect_robots: bool = True,
+                 session: Optional[requests.Session] = None):
+        """
+        Initializes the crawler.
+
+        Parameters:
+            output_dir (str): The directory page texts are written to.
+            state_path (Optional[str]): The SQLite file of the frontier and visited set;
+                defaults to crawl_state.db inside output_dir's parent directory.
+            max_workers (int): The number of pages fetched concurrently across all hosts.
+            per_host_concurrency (int): The number of requests in flight per host.
+            delay (float): The minimum interval between request starts to the same host.
+            timeout (float): The connect and read timeout of every request.
+            max_attempts (int): How often a URL is tried before it is dropped from the frontier.
+            respect_robots (bool): Whether to obey each host's robots.txt.
+            session (Optional[requests.Session]): The session to use; one with a connection
+                pool sized to max_workers is created by default.
+        """
+        self.output_dir = output_dir
+        self.max_workers = max_workers
+        self.per_host_concurrency = per_host_concurrency
+        self.delay = delay
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.respect_robots = respect_robots
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['User-Agent'] = USER_AGENT
+        self.session = session
+        self._hosts: Dict[str, _HostSlot] = {}
+        self._hosts_lock = threading.Lock()
+
+        os.makedirs(output_dir, exist_ok=True)
+        state_path = state_path or os.path.join(os.path.dirname(os.path.abspath(output_dir)), 'crawl_state.db')
+        self.connection = sqlite3.connect(state_path, check_same_thread=False)
+        self._state_lock = threading.Lock()
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS Frontier (
+                url TEXT PRIMARY KEY,
+                name TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                added_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS Visited (
+                url TEXT PRIMARY KEY,
+                name TEXT,
+                status INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                output_file TEXT,
+                fetched_at REAL NOT NULL
+            );
+        ''')
+        self.connection.commit()
+
+    # Frontier and visited set
+
+    def add(self, url: str, name: Optional[str] = None) -> bool:
+        """Adds a URL to the frontier unless it is already queued or visited. Returns whether it was added."""
+        return self.add_many([(name, url)]) == 1
+
+    def add_many(self, links: Iterable[Tuple[Optional[str], str]]) -> int:
+        """Adds (name, url) pairs to the frontier, skipping queued and visited URLs. Returns the number added."""
+        now = time.time()
+        with self._state_lock, self.connection:
+            added = 0
+            for name, url in links:
+                added += self.connection.execute('''
+                    INSERT OR IGNORE INTO Frontier (url, name, added_at)
+                    SELECT ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM Visited WHERE url = ?)
+                ''', (url, name, now, url)).rowcount
+            return added
+
+    def seed_from_listing(self, listing_url: str = LISTING_URL, base_url: str = BASE_URL) -> int:
+        """Fetches the presidents listing page and queues every president page it links to."""
+        html_content = fetch_page_content(listing_url, session=self.session, timeout=self.timeout)
+        if not html_content:
+            return 0
+        return self.add_many(parse_president_links(html_content, base_url))
+
+    def revisit(self) -> int:
+        """Queues every visited URL again; unchanged pages will answer the conditional GET with a 304."""
+        with self._state_lock, self.connection:
+            return self.connection.execute('''
+                INSERT OR IGNORE INTO Frontier (url, name, added_at) SELECT url, name, ? FROM Visited
+            ''', (time.time(),)).rowcount
+
+    def pending(self) -> int:
+        """Returns the number of URLs waiting in the frontier."""
+        with self._state_lock:
+            return self.connection.execute('SELECT COUNT(*) FROM Frontier').fetchone()[0]
+
+    def _validators(self, url: str) -> Optional[Tuple[str, str, str]]:
+        with self._state_lock:
+            return self.connection.execute(
+                'SELECT etag, last_modified, output_file FROM Visited WHERE url = ?', (url,)).fetchone()
+
+    def _mark_visited(self, url: str, name: Optional[str], status: int, etag: Optional[str] = None,
+                      last_modified: Optional[str] = None, output_file: Optional[str] = None):
+        with self._state_lock, self.connection:
+            self.connection.execute('''
+                INSERT INTO Visited (url, name, status, etag, last_modified, output_file, fetched_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET
+                    status = excluded.status,
+                    etag = COALESCE(excluded.etag, etag),
+                    last_modified = COALESCE(excluded.last_modified, last_modified),
+                    output_file = COALESCE(excluded.output_file, output_file),
+                    fetched_at = excluded.fetched_at
+            ''', (url, name, status, etag, last_modified, output_file, time.time()))
+            self.connection.execute('DELETE FROM Frontier WHERE url = ?', (url,))
+
+    def _mark_failed(self, url: str):
+        with self._state_lock, self.connection:
+            self.connection.execute('UPDATE Frontier SET attempts = attempts + 1 WHERE url = ?', (url,))
+            self.connection.execute('DELETE FROM Frontier WHERE url = ? AND attempts >= ?', (url, self.max_attempts))
+
+    # Politeness
+
+    def _host_slot(self, url: str) -> _HostSlot:
+        host = urlsplit(url).netloc
+        with self._hosts_lock:
+            slot = self._hosts.get(host)
+            if slot is None:
+                slot = self._hosts[host] = _HostSlot(self.per_host_concurrency)
+        return slot
+
+    def _robots(self, url: str, slot: _HostSlot) -> Optional[robotparser.RobotFileParser]:
+        """Fetches and caches the host's robots.txt; a missing or unreadable file allows everything."""
+        with slot.lock:
+            if slot.robots is None:
+                parts = urlsplit(url)
+                robots = robotparser.RobotFileParser(f"{parts.scheme}://{parts.netloc}/robots.txt")
+                try:
+                    response = self.session.get(robots.url, timeout=self.timeout)
+                    robots.parse(response.text.splitlines() if response.status_code == 200 else [])
+                except requests.exceptions.RequestException:
+                    robots.parse([])
+                slot.robots = robots
+            return slot.robots
+
+    def _wait_for_turn(self, slot: _HostSlot, delay: float):
+        with slot.lock:
+            now = time.monotonic()
+            wait = slot.next_request_at - now
+            slot.next_request_at = max(slot.next_request_at, now) + delay
+        if wait > 0:
+            time.sleep(wait)
+
+    # Fetching
+
+    @staticmethod
+    def output_name(url: str, name: Optional[str] = None) -> str:
+        """The scraped_content file name of a page: its URL slug (or name), made filesystem-safe."""
+        slug = unquote(urlsplit(url).path.rstrip('/').rsplit('/', 1)[-1]) or name or 'index'
+        return re.sub(r'[^\w.\-]+', '_', slug).strip('._') + '.txt'
+
+    def fetch(self, url: str, name: Optional[str] = None) -> str:
+        """
+        Fetches one frontier URL and records the outcome.
+
+        Returns:
+            str: 'fetched', 'not_modified', 'disallowed' or 'failed'.
+        """
+        slot = self._host_slot(url)
+        delay = self.delay
+        if self.respect_robots:
+            robots = self._robots(url, slot)
+            if not robots.can_fetch(self.session.headers.get('User-Agent', '*'), url):
+                self._mark_visited(url, name, 403)
+                return 'disallowed'
+            delay = max(delay, robots.crawl_delay(self.session.headers.get('User-Agent', '*')) or 0)
+
+        headers = {}
+        validators = self._validators(url)
+        if validators and validators[2] and os.path.exists(os.path.join(self.output_dir, validators[2])):
+            etag, last_modified, _ = validators
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        with slot.semaphore:
+            self._wait_for_turn(slot, delay)
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                print(f"Error fetching {url}: {e}")
+                self._mark_failed(url)
+                return 'failed'
+
+        if response.status_code == 304:
+            self._mark_visited(url, name, 304)
+            return 'not_modified'
+        if response.status_code >= 500 or response.status_code == 429:
+            print(f"Error fetching {url}: HTTP {response.status_code}")
+            self._mark_failed(url)
+            return 'failed'
+        if response.status_code >= 400:
+            print(f"Error fetching {url}: HTTP {response.status_code}")
+            self._mark_visited(url, name, response.status_code)
+            return 'failed'
+
+        output_file = self.output_name(url, name)
+        output_path = os.path.join(self.output_dir, output_file)
+        with open(output_path + '.tmp', 'w', encoding='utf-8') as file:
+            file.write(extract_main_text(response.text))
+        os.replace(output_path + '.tmp', output_path)
+        self._mark_visited(url, name, response.status_code, response.headers.get('ETag'),
+                           response.headers.get('Last-Modified'), output_file)
+        return 'fetched'
+
+    def _crawl(self, limit: Optional[int] = None) -> Iterator[Tuple[str, Optional[str], str]]:
+        """Fetches the frontier URLs on the thread pool, yielding (url, name, outcome) in frontier order."""
+        with self._state_lock:
+            batch = self.connection.execute('SELECT url, name FROM Frontier ORDER BY added_at, url' +
+                                            (' LIMIT ?' if limit is not None else ''),
+                                            (limit,) if limit is not None else ()).fetchall()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for (url, name), outcome in zip(batch, executor.map(lambda row: self.fetch(*row), batch)):
+                yield url, name, outcome
+
+    def crawl(self, limit: Optional[int] = None) -> Dict[str, int]:
+        """
+        Fetches the URLs in the frontier until it is empty (or limit URLs were tried).
+
+        URLs that fail transiently stay in the frontier and are retried by a later
+        crawl, up to max_attempts times.
+
+        Returns:
+            Dict[str, int]: The number of URLs per outcome.
+        """
+        stats = {'fetched': 0, 'not_modified': 0, 'disallowed': 0, 'failed': 0}
+        for _, _, outcome in self._crawl(limit):
+            stats[outcome] += 1
+        return stats
+
+    def iter_pages(self, limit: Optional[int] = None) -> Iterator[Tuple[str, str]]:
+        """
+        Crawls the frontier like crawl, yielding (file name, text) for every page
+        that was fetched or confirmed unchanged, as soon as it is available.
+        """
+        for url, name, outcome in self._crawl(limit):
+            if outcome not in ('fetched', 'not_modified'):
+                continue
+            output_file = self.output_name(url, name)
+            with open(os.path.join(self.output_dir, output_file), 'r', encoding='utf-8') as file:
+                yield output_file, file.read()
+
+    def close(self):
+        self.session.close()
+        self.connection.close()
+
+
+# Example usage
+if __name__ == "__main__":
+    crawler = WebCrawler("scraped_content")
+    print(f"Queued {crawler.seed_from_listing()} new president pages")
+    print(crawler.crawl())
+    crawler.close()
@@ -0,0 +1,14 @@
+import os
+import Benchmark
+
+
+def test_clean_and_tfidf_work_on_real_tokens_offline(tmp_path):
+    workdir = str(tmp_path)
+    results = Benchmark.bench_clean(workdir, n_documents=3, seed=0)
+    assert results['items'] == 3
+    for filename in os.listdir(os.path.join(workdir, 'clean')):
+        with open(os.path.join(workdir, 'clean', filename), encoding='utf-8') as file:
+            assert file.read().split()
+
+    tfidf = Benchmark.bench_tfidf(workdir, seed=0)
+    assert tfidf['full']['items'] == 3
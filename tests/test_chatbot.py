@@ -0,0 +1,95 @@
+import pytest
+from ChatBOT import ChatBot
+from KnowledgeBase import ChatbotDatabase
+from OpenAIEmbedder import FakeEmbedder
+
+
+class Preferences:
+    def __init__(self, saved):
+        self.saved = saved
+
+    def get(self, user_id):
+        return self.saved.get(user_id, {})
+
+    def set(self, user_id, **preferences):
+        self.saved[user_id] = preferences
+
+
+@pytest.fixture
+def make_chatbot():
+    databases = []
+
+    def make(saved, answers, monkeypatch):
+        databases.append(ChatbotDatabase(':memory:'))
+        bot = ChatBot(embedder=FakeEmbedder(), database=databases[-1], preferences=Preferences(saved))
+        bot.extract_name = lambda text: text
+        bot.extract_president = lambda text: text.title()
+        replies = iter(answers)
+        monkeypatch.setattr('builtins.input', lambda prompt='': next(replies))
+        return bot
+
+    yield make
+    for database in databases:
+        database.close()
+
+
+def test_new_user_is_greeted_once(make_chatbot, monkeypatch, capsys):
+    bot = make_chatbot({}, ["Ada", "lincoln"], monkeypatch)
+    bot.introduce_and_ask_info()
+    output = capsys.readouterr().out
+    assert "Nice to meet you, Ada!" in output and "Welcome back" not in output
+    assert bot.preferences.get("Ada")["favorite_president"] == "Lincoln"
+
+
+@pytest.mark.parametrize("answer, expected", [("y", "Grant"), ("", "Grant"), ("n", "Lincoln")])
+def test_returning_user_may_keep_their_president(make_chatbot, monkeypatch, capsys, answer, expected):
+    saved = {"Ada": {"favorite_president": "Grant", "favorite_president_ids": []}}
+    bot = make_chatbot(saved, ["Ada", answer, "lincoln"], monkeypatch)
+    bot.introduce_and_ask_info()
+    output = capsys.readouterr().out
+    assert "Welcome back, Ada! Last time you asked about Grant." in output and "Nice to meet you" not in output
+    assert bot.favorite_president == expected
+    assert saved["Ada"]["favorite_president"] == expected
+
+
+class CountingEmbedder(FakeEmbedder):
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def get_embeddings(self, texts):
+        self.calls.append(list(texts))
+        return super().get_embeddings(texts)
+
+
+def test_questions_are_answered_as_one_batch():
+    terms = ["Who was Lincoln?", "What did Grant do?", "When was Hayes elected?"]
+    database = ChatbotDatabase(':memory:')
+    database.bulk_add_terms(zip(terms, FakeEmbedder().get_embeddings(terms)))
+    database.bulk_add_facts((term, f"Answer to {term}") for term in terms)
+    embedder = CountingEmbedder()
+    bot = ChatBot(embedder=embedder, database=database, preferences=Preferences({}))
+
+    questions = ["what did grant do", "When was Hayes elected ?", "Who was Lincoln"]
+    results = bot.answer_questions(questions)
+    assert [result.question for result in results] == questions
+    assert [result.source for result in results] == ["lexical", "lexical", "lexical"]
+    assert [result.fact for result in results] == ["Answer to What did Grant do?", "Answer to When was Hayes elected?",
+                                                   "Answer to Who was Lincoln?"]
+    assert embedder.calls == []
+
+    questions = ["Tell me about Grant please", "Tell me about Lincoln please"]
+    first = bot.answer_questions(questions)
+    assert embedder.calls == [questions]  # One embedding call for the whole batch
+    assert [result.source for result in first] == ["hybrid", "hybrid"]
+    again = bot.answer_questions(questions)
+    assert [result.source for result in again] == ["cache", "cache"]
+    assert [result.fact for result in again] == [result.fact for result in first]
+
+    embeddings = FakeEmbedder().get_embeddings(questions)
+    batched = database.retrieve_facts_by_embeddings(embeddings, top_k=2)
+    for embedding, matches in zip(embeddings, batched):
+        single = database.retrieve_facts_by_embeddings(embedding[None, :], top_k=2)[0]
+        assert [match[:2] for match in matches] == [match[:2] for match in single]
+        assert [match[2] for match in matches] == pytest.approx([match[2] for match in single], abs=1e-6)
+    database.close()
@@ -0,0 +1,53 @@
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from ConnectionPool import ConnectionPool
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'pool.db'))
+    pool.write(lambda connection: connection.execute('CREATE TABLE Items (name TEXT UNIQUE)'))
+    yield pool
+    pool.close()
+
+
+def insert(name):
+    return lambda connection: connection.execute('INSERT INTO Items (name) VALUES (?)', (name,)).lastrowid
+
+
+def test_failing_write_does_not_roll_back_its_group(pool):
+    started, release = threading.Event(), threading.Event()
+
+    def blocker(connection):
+        started.set()
+        release.wait(5)
+        return insert('first')(connection)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        first = executor.submit(pool.write, blocker)
+        started.wait(5)  # The writer is now busy with the first write
+        futures = [executor.submit(pool.write, insert(name)) for name in ('a', 'first', 'b')]
+        while pool._write_queue.qsize() < 3:  # The other writes queue up behind it, to be committed as one group
+            time.sleep(0.01)
+        release.set()
+        first.result()
+        with pytest.raises(sqlite3.IntegrityError):
+            futures[1].result()
+        assert futures[0].result() and futures[2].result()
+
+    assert sorted(name for name, in pool.read('SELECT name FROM Items')) == ['a', 'b', 'first']
+
+
+def test_nested_writes_join_the_enclosing_transaction(pool):
+    def outer(connection):
+        insert('outer')(connection)
+        return pool.write(insert('inner'))
+
+    pool.write(outer)
+    assert pool.read('SELECT count(*) FROM Items') == [(2,)]
+    pool.close()
+    with pytest.raises(sqlite3.ProgrammingError):
+        pool.write(insert('late'))
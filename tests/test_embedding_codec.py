@@ -0,0 +1,64 @@
+import sqlite3
+import numpy as np
+import pytest
+from EmbeddingCodec import HEADER, decode_embedding, decode_header, encode_embedding
+from KnowledgeBase import ChatbotDatabase
+
+
+# The largest round-trip error relative to max(|x|): float16 keeps 11 significant bits,
+# and int8 rounds to half of a max(|x|) / 127 step
+@pytest.mark.parametrize("dtype, relative_error", [('float32', 1e-7), ('float16', 2 ** -11), ('int8', 1 / 254)])
+def test_round_trip_error_is_bounded(dtype, relative_error):
+    rng = np.random.default_rng(0)
+    for vector in rng.normal(size=(20, 256)):
+        vector /= np.linalg.norm(vector)
+        blob = encode_embedding(vector, dtype)
+        assert decode_header(blob)[:2] == (dtype, 256)
+        assert len(blob) == HEADER.size + 256 * np.dtype(dtype).itemsize
+        decoded = decode_embedding(blob)
+        assert np.abs(decoded - vector).max() <= relative_error * np.abs(vector).max() + 1e-7
+        assert decoded @ vector > 0.999
+
+
+def test_legacy_float64_blobs_are_read_and_migrated(tmp_path):
+    path = str(tmp_path / 'legacy.db')
+    ChatbotDatabase(path).close()
+    vectors = {"Who was Lincoln?": np.array([1.0, 0.0, 0.0]), "Who was Grant?": np.array([0.6, 0.8, 0.0])}
+    with sqlite3.connect(path) as connection:
+        for term, vector in vectors.items():
+            term_id = connection.execute('INSERT INTO Terms (term) VALUES (?)', (term,)).lastrowid
+            connection.execute('INSERT INTO Embeddings (term_id, embedding) VALUES (?, ?)',
+                               (term_id, vector.astype(np.float64).tobytes()))
+            connection.execute('INSERT INTO Facts (term_id, fact) VALUES (?, ?)', (term_id, f"Fact for {term}"))
+    connection.close()
+    assert decode_embedding(np.arange(3, dtype=np.float64).tobytes()).tolist() == [0.0, 1.0, 2.0]
+    assert decode_embedding(b'\x00' * 7) is None
+
+    database = ChatbotDatabase(path, snapshot_path=str(tmp_path / 'none'))
+    assert database.retrieve_facts_by_embedding(np.array([0.0, 1.0, 0.0]), top_k=1) == [
+        ("Fact for Who was Grant?", pytest.approx(0.8))]
+    database.migrate_embeddings('int8')
+    blobs = [blob for _, blob in database.pool.read('SELECT term_id, embedding FROM Embeddings')]
+    assert all(decode_header(blob)[0] == 'int8' for blob in blobs)
+    assert [fact for fact, _ in database.retrieve_facts_by_embedding(np.array([1.0, 0.1, 0.0]), top_k=2)] == [
+        "Fact for Who was Lincoln?", "Fact for Who was Grant?"]
+    database.close()
+
+
+def test_quantized_matrix_is_reranked_against_stored_embeddings():
+    rng = np.random.default_rng(2)
+    vectors, queries = rng.normal(size=(200, 64)), rng.normal(size=(5, 64))
+    exact = ChatbotDatabase(':memory:')
+    quantized = ChatbotDatabase(':memory:', matrix_dtype='int8', rerank_factor=8)
+    for database in (exact, quantized):
+        database.bulk_add_terms((f"term {i}", vector) for i, vector in enumerate(vectors))
+        database.bulk_add_facts((f"term {i}", f"fact {i}") for i in range(len(vectors)))
+
+    expected = exact.retrieve_facts_by_embeddings(queries, top_k=5)
+    found = quantized.retrieve_facts_by_embeddings(queries, top_k=5)
+    for expected_matches, matches in zip(expected, found):
+        assert [fact for _, fact, _ in matches] == [fact for _, fact, _ in expected_matches]
+        assert [similarity for _, _, similarity in matches] == pytest.approx(
+            [similarity for _, _, similarity in expected_matches], abs=1e-6)
+    exact.close()
+    quantized.close()
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+from EmbeddingDataset import EmbeddingDataset
+
+
+def test_append_round_trips_texts_extra_fields_and_embeddings(tmp_path):
+    dataset = EmbeddingDataset(str(tmp_path / 'dataset'))
+    embeddings = np.arange(8, dtype=np.float32).reshape(2, 4)
+    dataset.append(["Lincoln", "Grant"], embeddings, [{'id': 1}, {'id': 2}])
+    dataset.append(["Hayes"], np.ones((1, 4)))
+
+    reopened = EmbeddingDataset(str(tmp_path / 'dataset'))
+    assert list(reopened.iter_records()) == [{'id': 1, 'text': "Lincoln"}, {'id': 2, 'text': "Grant"},
+                                             {'text': "Hayes"}]
+    assert (reopened.embeddings()[:2] == embeddings).all()
+
+
+def test_append_rejects_extra_fields_that_do_not_match_the_texts(tmp_path):
+    dataset = EmbeddingDataset(str(tmp_path / 'dataset'))
+    with pytest.raises(ValueError, match='1 for 2 texts'):
+        dataset.append(["Lincoln", "Grant"], np.ones((2, 4)), [{'id': 1}])
+    with pytest.raises(ValueError, match='0 for 1 texts'):
+        dataset.append(["Lincoln"], np.ones((1, 4)), [])
+    assert len(dataset) == 0 and dataset.texts() == []
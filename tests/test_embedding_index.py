@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from EmbeddingIndex import EmbeddingMatrix, IVFIndex, benchmark_recall
+from KnowledgeBase import ChatbotDatabase
+
+
+def brute_force(vectors, queries, k):
+    """The k best rows of each query by cosine similarity, computed the slow way."""
+    vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    scores = queries @ vectors.T
+    return np.argsort(-scores, axis=1)[:, :k], np.sort(scores, axis=1)[:, ::-1][:, :k]
+
+
+def test_exact_top_k_matches_brute_force():
+    rng = np.random.default_rng(0)
+    vectors, queries = rng.normal(size=(500, 32)), rng.normal(size=(7, 32))
+    term_ids = np.arange(1000, 1500)
+    matrix = EmbeddingMatrix()
+    matrix.upsert_many(term_ids, vectors)
+
+    expected_rows, expected_scores = brute_force(vectors, queries, 10)
+    found_ids, found_scores = matrix.top_k_many(queries, 10)
+    assert (found_ids == term_ids[expected_rows]).all()
+    assert np.allclose(found_scores, expected_scores, atol=1e-5)
+
+    found_ids, found_scores = matrix.top_k(queries[0], 600)
+    assert len(found_ids) == 500 and (np.diff(found_scores) <= 0).all()
+
+    subset = term_ids[::3]
+    expected_rows, _ = brute_force(vectors[::3], queries, 5)
+    assert (matrix.top_k_many(queries, 5, subset)[0] == subset[expected_rows]).all()
+
+
+def test_query_with_the_wrong_dimension_names_both_dimensions():
+    matrix = EmbeddingMatrix()
+    matrix.upsert_many([1, 2], np.eye(2, 4))
+    with pytest.raises(ValueError, match='dimension 3.*dimension 4'):
+        matrix.top_k(np.ones(3), 1)
+
+    database = ChatbotDatabase(':memory:')
+    database.add_term_with_embedding("What is the tariff?", np.ones(4))
+    with pytest.raises(ValueError, match='dimension 8.*dimension 4'):
+        database.retrieve_facts_by_embeddings(np.ones((1, 8)))
+    database.close()
+
+
+def test_ivf_recall_on_clustered_data():
+    results = benchmark_recall(n=20000, dim=64, n_queries=50, k=5, nprobes=(4, 16, 32))
+    recalls = [recall for _, recall, _ in results[1:]]
+    assert recalls == sorted(recalls)
+    assert recalls[-1] >= 0.95
+
+
+def test_ivf_full_probe_is_exact_and_survives_save_and_load(tmp_path):
+    rng = np.random.default_rng(1)
+    vectors, query = rng.normal(size=(300, 16)), rng.normal(size=16)
+    term_ids = np.arange(300)
+    index = IVFIndex.train(vectors, n_lists=10)
+    index.add_all(term_ids, vectors)
+    index.upsert(7, query)
+    index.remove(8)
+    vectors[7] = query
+
+    expected_rows, _ = brute_force(np.delete(vectors, 8, axis=0), query[None, :], 5)
+    expected = np.delete(term_ids, 8)[expected_rows[0]]
+    assert (index.top_k(query, 5, nprobe=10)[0] == expected).all()
+
+    index.save(str(tmp_path / 'ivf.npz'))
+    loaded = IVFIndex.load(str(tmp_path / 'ivf.npz'))
+    assert loaded.size == 299
+    assert (loaded.top_k(query, 5, nprobe=10)[0] == expected).all()
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from KnowledgeBase import ChatbotDatabase
+
+
+@pytest.fixture
+def database():
+    database = ChatbotDatabase(':memory:')
+    yield database
+    database.close()
+
+
+def test_lexical_search_only_returns_real_matches_in_a_small_corpus(database):
+    topics = ['bank'] * 9 + ['tariff']
+    database.bulk_add_terms((f"term {i}", np.ones(4)) for i in range(10))
+    database.bulk_add_facts((f"term {i}", f"fact {i} about the {topic}") for i, topic in enumerate(topics))
+
+    assert database.retrieve_facts_lexical("fact 3", top_k=20) == []
+    matches = database.retrieve_facts_lexical("fact about the tariff", top_k=20)
+    assert [fact for _, fact, _ in matches] == ["fact 9 about the tariff"]
+    assert matches[0][2] > 0.1
+
+
+def test_snapshot_is_mapped_until_another_connection_writes(tmp_path):
+    path = str(tmp_path / 'kb.db')
+    writer = ChatbotDatabase(path)
+    writer.bulk_add_terms([("Who was Lincoln?", np.array([1.0, 0.0, 0.0])),
+                           ("Who was Grant?", np.array([0.0, 1.0, 0.0]))])
+    writer.add_fact("Who was Grant?", "Grant led the Union army.")
+    writer.export_snapshot()
+
+    reader = ChatbotDatabase(path)
+    assert not reader.embedding_matrix.vectors.flags.writeable  # Mapped read-only from the snapshot
+    assert reader.generation == writer.generation
+    assert reader.retrieve_facts_by_embedding(np.array([0.1, 1.0, 0.0]), top_k=1)[0][0] == "Grant led the Union army."
+
+    writer.add_term_with_embedding("Who was Hayes?", np.array([0.0, 0.0, 1.0]))
+    writer.add_fact("Who was Hayes?", "Hayes ended Reconstruction.")
+    assert reader.retrieve_facts_by_embedding(np.array([0.0, 0.1, 1.0]), top_k=1)[0][0] == "Hayes ended Reconstruction."
+    assert reader.generation == writer.generation and reader.embedding_matrix.size == 3
+    assert reader.embedding_matrix.vectors.flags.writeable  # Reloaded from SQLite: the snapshot is stale
+    reader.close()
+    writer.close()
+
+
+def test_bulk_ingest_streams_batches_and_replaces_existing_terms(database):
+    database.add_term_with_embedding("term 0", np.array([0.0, 0.0, 0.0, 1.0]))
+    items = ((f"term {i}", np.eye(4)[i % 4]) for i in range(10))
+    assert database.bulk_add_terms(items, batch_size=3)['rows'] == 10
+    assert database.embedding_matrix.size == 10
+    assert database.retrieve_facts_by_embeddings(np.eye(4)[:1], top_k=3) == [[]]  # No facts yet
+
+    report = database.bulk_add_facts([("term 0", "fact 0"), ("missing", "lost"), ("term 4", "fact 4")], batch_size=2)
+    assert (report['rows'], report['skipped']) == (2, 1)
+    matches = database.retrieve_facts_by_embeddings(np.eye(4)[:1], top_k=3)[0]
+    assert sorted(fact for _, fact, _ in matches) == ["fact 0", "fact 4"]
+    assert all(similarity == pytest.approx(1.0) for _, _, similarity in matches)
+
+
+def test_failed_bulk_ingest_leaves_nothing_behind(database):
+    def items():
+        for i in range(5):
+            yield f"term {i}", np.eye(4)[i % 4]
+        raise RuntimeError("The source broke")
+
+    with pytest.raises(RuntimeError, match='source broke'):
+        database.bulk_add_terms(items(), batch_size=2)
+    assert database.pool.read('SELECT count(*) FROM Terms')[0][0] == 0
+    assert database.embedding_matrix.size == 0
@@ -0,0 +1,129 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import openai
+import pytest
+from OpenAIEmbedder import EMBEDDING_DIMENSIONS, OpenAIEmbedder
+
+
+class EmbeddingsServer:
+    """
+    A local stand-in for the embeddings endpoint. Every text gets a fixed vector,
+    listed in reverse input order; the first rate_limited requests answer 429,
+    batches containing a poisoned text answer 400 and a dropped text is left out.
+    """
+
+    def __init__(self, rate_limited: int = 0, poisoned: str = "poison", dropped: str = "drop", width: int = 512):
+        self.rate_limited = rate_limited
+        self.width = width
+        self.poisoned = poisoned
+        self.dropped = dropped
+        self.batches = []
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def vector(text: str, width: int = 512) -> list:
+        return np.random.default_rng(sum(map(ord, text))).normal(size=width).tolist()
+
+    def respond(self, body: dict):
+        with self.lock:
+            self.batches.append(body['input'])
+            if self.rate_limited:
+                self.rate_limited -= 1
+                return 429, {'error': {'message': "Rate limit reached", 'type': 'requests'}}, {'retry-after': '0.05'}
+        if self.poisoned in body['input']:
+            return 400, {'error': {'message': "Invalid input", 'type': 'invalid_request_error'}}, {}
+        data = [{'object': 'embedding', 'index': i, 'embedding': self.vector(text, self.width)}
+                for i, text in reversed(list(enumerate(body['input']))) if text != self.dropped]
+        return 200, {'object': 'list', 'data': data, 'model': body['model'],
+                     'usage': {'prompt_tokens': 1, 'total_tokens': 1}}, {}
+
+
+@pytest.fixture
+def server():
+    state = EmbeddingsServer()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            status, payload, headers = state.respond(json.loads(self.rfile.read(int(self.headers['Content-Length']))))
+            data = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    state.base_url = f"http://127.0.0.1:{httpd.server_address[1]}/v1"
+    yield state
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def make_embedder(server, **options) -> OpenAIEmbedder:
+    # The client must not retry on its own, so the embedder's backoff is what gets tested
+    client = openai.OpenAI(api_key="test", base_url=server.base_url, max_retries=0)
+    embedder = OpenAIEmbedder(client=client, **options)
+    embedder.MAX_BATCH_SIZE = 2
+    return embedder
+
+
+def expected(text: str) -> np.ndarray:
+    return OpenAIEmbedder.normalize_l2(np.array(EmbeddingsServer.vector(text)[:EMBEDDING_DIMENSIONS]))
+
+
+def test_batches_deduplicates_and_keeps_order(server):
+    texts = ["Lincoln", "Grant", "Lincoln", "Hayes", "Garfield"]
+    embeddings = make_embedder(server, max_concurrency=1).get_embeddings(texts)
+
+    assert [len(batch) for batch in server.batches] == [2, 2]
+    assert sorted(text for batch in server.batches for text in batch) == ["Garfield", "Grant", "Hayes", "Lincoln"]
+    assert embeddings.shape == (5, EMBEDDING_DIMENSIONS)
+    for text, embedding in zip(texts, embeddings):
+        np.testing.assert_allclose(embedding, expected(text), rtol=1e-5, atol=1e-6)
+
+
+def test_rate_limited_requests_are_retried(server):
+    server.rate_limited = 2
+    embedder = make_embedder(server, max_concurrency=1)
+    embeddings = embedder.get_embeddings(["Lincoln", "Grant"])
+
+    assert len(server.batches) == 3
+    assert not np.isnan(embeddings).any()
+    np.testing.assert_allclose(embeddings[1], expected("Grant"), rtol=1e-5, atol=1e-6)
+
+
+def test_failed_batch_rows_are_nan(server):
+    embeddings = make_embedder(server, max_concurrency=2).get_embeddings(["Lincoln", "Grant", "poison", "Hayes"])
+
+    assert np.isnan(embeddings[2:]).all()  # "poison" and "Hayes" shared the rejected batch
+    assert not np.isnan(embeddings[:2]).any()
+
+
+def test_rows_are_placed_by_index_and_missing_ones_are_nan(server, tmp_path):
+    from EmbeddingCache import EmbeddingCache
+    cache = EmbeddingCache(str(tmp_path / 'cache.db'))
+    embedder = make_embedder(server, max_concurrency=1, cache=cache)
+    embeddings = embedder.get_embeddings(["Lincoln", "drop", "Grant"])
+
+    np.testing.assert_allclose(embeddings[0], expected("Lincoln"), rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(embeddings[2], expected("Grant"), rtol=1e-5, atol=1e-6)
+    assert np.isnan(embeddings[1]).all()
+    assert sorted(cache.get_many(embedder.model, ["Lincoln", "drop", "Grant"])) == [0, 2]
+
+
+def test_embedding_width_comes_from_the_response(server):
+    server.width = 64
+    embedder = make_embedder(server)
+    raw = embedder._create_embeddings(["Lincoln", "Grant"])
+
+    assert raw.shape == (2, 64)
+    np.testing.assert_allclose(raw[1], EmbeddingsServer.vector("Grant", 64))
+    assert np.isnan(embedder.get_embeddings(["Lincoln"])).all()  # Narrower than the stored 256 columns
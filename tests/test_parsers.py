@@ -0,0 +1,28 @@
+import os
+from Utils import PARSER_FIXTURE_DIR, benchmark_parsers, extract_main_text, parse_president_links
+
+
+def read_fixture(name):
+    with open(os.path.join(PARSER_FIXTURE_DIR, name), 'r', encoding='utf-8') as file:
+        return file.read()
+
+
+def test_president_links_from_listing_fixture():
+    links = parse_president_links(read_fixture('List_of_presidents_of_the_United_States.html'),
+                                  "https://en.wikipedia.org")
+    assert len(links) == 47  # Cleveland and Trump are listed twice
+    assert links[15] == ('Lincoln, Abraham', 'https://en.wikipedia.org/wiki/Abraham_Lincoln')
+
+
+def test_main_text_drops_markup_around_the_article():
+    text = extract_main_text(read_fixture('Abraham_Lincoln.html'))
+    assert "Emancipation Proclamation" in text
+    assert "Main page" not in text  # Navigation outside the content element
+    assert "[1]" not in text  # Footnote markers
+    assert "Preceded by" not in text  # Infobox table
+
+
+def test_benchmark_parsers_runs_on_fixtures():
+    results = benchmark_parsers(backends=('html.parser',), repeat=1)
+    assert set(results['html.parser']) == {'full tree + extract_links', 'strained links',
+                                           'full tree + body text', 'strained main text'}
@@ -0,0 +1,64 @@
+import json
+import re
+import threading
+from types import SimpleNamespace
+from ChatGPTCrawler import PresidentsQA
+
+
+class ChatStub:
+    """Answers each term prompt with num_pairs Q&A pairs; a term named "fail" gets no pairs."""
+
+    def __init__(self):
+        self.prompts = []
+        self.lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages):
+        prompt = messages[-1]['content']
+        with self.lock:
+            self.prompts.append(prompt)
+        num_pairs = int(re.match(r"Generate (\d+)", prompt).group(1))
+        term = re.search(r"the term '(.*?)'", prompt).group(1)
+        content = "" if term == "fail" else "\n".join(
+            f"Q: What is question {i} about {term}?\nA: Answer {i} about {term}." for i in range(num_pairs))
+        # Every term also asks the same question, up to case and punctuation
+        content += "\nQ: Who was the FIRST president??\nA: George Washington." if term != "fail" else ""
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def prompted_terms(stub):
+    return sorted(re.search(r"the term '(.*?)'", prompt).group(1) for prompt in stub.prompts)
+
+
+def test_checkpoint_resume_and_dedupe(tmp_path):
+    checkpoint = str(tmp_path / 'qa_checkpoint.jsonl')
+    stub = ChatStub()
+    qa = PresidentsQA(client=stub)
+    pairs = qa.generate_for_terms(["tariff", "fail", "treaty"], 2, max_workers=2, checkpoint_path=checkpoint)
+
+    assert prompted_terms(stub) == ["fail", "tariff", "treaty"]
+    assert len(pairs) == 5  # 2 per term, and the shared question once
+    assert sum(PresidentsQA.question_key(q) == PresidentsQA.question_key("who was the first president")
+               for q in pairs) == 1
+    with open(checkpoint, encoding='utf-8') as file:
+        records = [json.loads(line) for line in file]
+    assert sorted(record['term'] for record in records) == ["tariff", "treaty"]
+    assert all(record['num_pairs'] == 2 for record in records)
+
+    # A rerun only calls the API for the terms that are not finished
+    stub.prompts.clear()
+    resumed = qa.generate_for_terms(["tariff", "treaty", "veto"], 2, checkpoint_path=checkpoint)
+    assert prompted_terms(stub) == ["veto"]
+    assert set(pairs) <= set(resumed) and len(resumed) == 7
+
+
+def test_checkpoint_is_not_reused_for_another_num_pairs(tmp_path):
+    checkpoint = str(tmp_path / 'qa_checkpoint.jsonl')
+    stub = ChatStub()
+    qa = PresidentsQA(client=stub)
+    qa.generate_for_terms(["tariff"], 2, checkpoint_path=checkpoint)
+    stub.prompts.clear()
+
+    pairs = qa.generate_for_terms(["tariff"], 4, checkpoint_path=checkpoint)
+    assert prompted_terms(stub) == ["tariff"]
+    assert len(pairs) == 5
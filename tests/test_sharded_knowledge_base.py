@@ -0,0 +1,140 @@
+import numpy as np
+import pytest
+from ChatBOT import ChatBot
+from KnowledgeBase import ChatbotDatabase
+from OpenAIEmbedder import FakeEmbedder
+from ShardedKnowledgeBase import GENERAL_SHARD, SHARD_BITS, ShardedKnowledgeBase
+
+PRESIDENTS = {'Lincoln': 'Abraham_Lincoln', 'Grant': 'Ulysses_S._Grant'}
+TOPICS = ["tariff", "treaty", "railroad", "bank", "army", "navy", "slavery", "homestead", "court", "tax"]
+
+
+def resolve(text):
+    return [president_id for name, president_id in PRESIDENTS.items() if name in text]
+
+
+def corpus(names):
+    """Questions about each named president (or about no one, for None) with two facts each."""
+    terms, facts = [], []
+    for name in names:
+        for i, topic in enumerate(TOPICS):
+            term = f"What did {name} do about the {topic}?" if name else f"What is a {topic} law number {i}?"
+            terms.append(term)
+            facts += [(term, f"{name or 'Congress'} changed the {topic} in year {1860 + i}."),
+                      (term, f"The {topic} mattered to {name or 'voters'} and the {TOPICS[i - 1]}.")]
+    return terms, facts
+
+
+def fill(database, names):
+    terms, facts = corpus(names)
+    database.bulk_add_terms(zip(terms, FakeEmbedder().get_embeddings(terms)))
+    database.bulk_add_facts(facts)
+    return database
+
+
+class NoPreferences:
+    def get(self, user_id):
+        return {}
+
+
+def chatbot(database):
+    return ChatBot(embedder=FakeEmbedder(), database=database, preferences=NoPreferences())
+
+
+@pytest.fixture
+def sharded(tmp_path):
+    database = ShardedKnowledgeBase(str(tmp_path / 'shards'), entity_resolver=resolve)
+    yield database
+    database.close()
+
+
+def test_single_shard_hybrid_matches_single_database(sharded):
+    single = fill(ChatbotDatabase(':memory:', entity_resolver=resolve), ['Lincoln'])
+    fill(sharded, ['Lincoln'])
+    queries = ["Lincoln tariff treaty", "What did Lincoln do about the railroad bank?", "Lincoln army in 1865"]
+    embeddings = FakeEmbedder().get_embeddings(queries)
+
+    expected = single.retrieve_facts_hybrid(queries, embeddings, top_k=6)
+    found = sharded.retrieve_facts_hybrid(queries, embeddings, top_k=6)
+    assert [[(sharded.split_id(term_id)[1], fact, similarity) for term_id, fact, similarity in result]
+            for result in found] == expected
+
+    answers = [(result.fact, result.related_questions) for result in chatbot(single).answer_questions(queries)]
+    assert [(result.fact, result.related_questions)
+            for result in chatbot(sharded).answer_questions(queries)] == answers
+    single.close()
+
+
+def test_merge_keeps_a_single_ranking_and_interleaves_several_by_rank():
+    fused = [(1, 'a', 0.2), (2, 'b', 0.9), (3, 'c', 0.5)]
+    assert ShardedKnowledgeBase.merge([fused, []], 2, by_rank=True) == fused[:2]
+
+    other = [(7, 'x', 0.4), (8, 'y', 0.8)]
+    assert ShardedKnowledgeBase.merge([fused, other], 4, by_rank=True) == [
+        (7, 'x', 0.4), (1, 'a', 0.2), (2, 'b', 0.9), (8, 'y', 0.8)]
+    assert ShardedKnowledgeBase.merge([fused, other], 3) == [(2, 'b', 0.9), (8, 'y', 0.8), (3, 'c', 0.5)]
+
+
+def test_cached_answers_are_scoped_by_routing_hint(sharded):
+    fill(sharded, ['Lincoln', 'Grant'])
+    bot = chatbot(sharded)
+    question = ["Which law came first?"]
+    bot.answer_questions(question, hint=['Abraham_Lincoln'])
+    assert bot.answer_questions(question, hint=['Abraham_Lincoln'])[0].source == "cache"
+    assert bot.answer_questions(question, hint=['Ulysses_S._Grant'])[0].source != "cache"
+
+
+def test_terms_are_stored_in_their_president_shard_with_global_ids(sharded, tmp_path):
+    fill(sharded, ['Lincoln', 'Grant', None])
+    assert sharded.stats() == {GENERAL_SHARD: 10, 'Abraham_Lincoln': 10, 'Ulysses_S._Grant': 10}
+
+    number = sharded.shard_numbers['Ulysses_S._Grant']
+    global_id = sharded.global_id('Ulysses_S._Grant', 3)
+    assert global_id == (number << SHARD_BITS) | 3
+    assert sharded.split_id(global_id) == ('Ulysses_S._Grant', 3)
+
+    grant_ids = sharded.term_ids_for_entities(['Ulysses_S._Grant'])
+    assert len(grant_ids) == 10 and {global_id >> SHARD_BITS for global_id in grant_ids} == {number}
+    terms = sharded.retrieve_terms_by_term_ids(grant_ids)
+    assert sorted(terms.values()) == sorted(term for term in corpus(['Grant'])[0])
+    assert all(len(facts) == 2 for facts in sharded.retrieve_facts_by_term_ids(grant_ids).values())
+
+    # Shard numbers survive a reopen, so global ids stay valid
+    sharded.close()
+    reopened = ShardedKnowledgeBase(str(tmp_path / 'shards'), entity_resolver=resolve)
+    assert reopened.shard_numbers == sharded.shard_numbers
+    assert reopened.retrieve_terms_by_term_ids(grant_ids) == terms
+    reopened.close()
+
+
+def test_routing_by_mention_centroid_and_hint(sharded):
+    fill(sharded, ['Lincoln', 'Grant', None])
+    sharded.refresh_router()
+    assert list(sharded.route("What did Grant do?")) == ['Ulysses_S._Grant']
+
+    lincoln = sharded.shards['Abraham_Lincoln'].embedding_matrix.float_vectors().mean(axis=0)
+    sharded.router.margin = 0.0
+    assert list(sharded.route("Which law came first?", lincoln)) == ['Abraham_Lincoln']
+    sharded.router.margin = 2.0  # Never sure: every shard, with the hinted one included
+    routes = sharded.route("Which law came first?", lincoln, hint=['Ulysses_S._Grant'])
+    assert set(routes) == {GENERAL_SHARD, 'Abraham_Lincoln', 'Ulysses_S._Grant'}
+
+    grant_ids = sharded.term_ids_for_entities(['Ulysses_S._Grant'])
+    assert sharded.route(term_ids=grant_ids[:2]) == {'Ulysses_S._Grant': [1, 2]}
+
+
+def test_lexical_match_and_embedding_search_across_shards(sharded):
+    fill(sharded, ['Lincoln', 'Grant', None])
+    term = "What did Grant do about the navy?"
+    matches = sharded.lexical_match(term.upper())
+    assert sharded.split_id(matches[0][0])[0] == 'Ulysses_S._Grant'
+    assert [fact for term_id, fact, similarity in matches if similarity == 1.0] == [
+        fact for fact_term, fact in corpus(['Grant'])[1] if fact_term == term]
+    assert sharded.lexical_match("What did Grant do about the moon?") is None
+
+    # Every shard is searched for an embedding alone; top_k counts terms, as in a single database
+    embedding = FakeEmbedder().get_embeddings(["What is a bank law number 3?"])
+    found = sharded.retrieve_facts_by_embeddings(embedding, top_k=3)[0]
+    assert len({term_id for term_id, _, _ in found}) == 3 and len(found) == 6
+    assert sharded.split_id(found[0][0])[0] == GENERAL_SHARD and found[0][2] == pytest.approx(1.0)
+    assert [similarity for _, _, similarity in found] == sorted((s for _, _, s in found), reverse=True)
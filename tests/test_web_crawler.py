@@ -0,0 +1,126 @@
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from WebCrawler import WebCrawler
+
+PAGE = "<html><body><div id='mw-content-text'><p>{name} was a president.</p></div></body></html>"
+ROBOTS = "User-agent: *\nDisallow: /private/\n"
+
+
+class Site:
+    """A local wiki: pages carry an ETag and answer a matching If-None-Match with 304."""
+
+    def __init__(self):
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.started_at = []
+        self.lock = threading.Lock()
+        self.page_delay = 0.0
+
+
+@pytest.fixture
+def site():
+    state = Site()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            with state.lock:
+                state.requests.append((self.path, self.headers.get('If-None-Match')))
+            if self.path == '/robots.txt':
+                self._reply(200, ROBOTS)
+                return
+            with state.lock:
+                state.in_flight += 1
+                state.max_in_flight = max(state.max_in_flight, state.in_flight)
+                state.started_at.append(time.monotonic())
+            try:
+                time.sleep(state.page_delay)
+                etag = f'"{self.path}-v1"'
+                if self.headers.get('If-None-Match') == etag:
+                    self._reply(304, None)
+                else:
+                    self._reply(200, PAGE.format(name=self.path.rsplit('/', 1)[-1]), {'ETag': etag})
+            finally:
+                with state.lock:
+                    state.in_flight -= 1
+
+        def _reply(self, status, body, headers=None):
+            self.send_response(status)
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            data = body.encode('utf-8') if body is not None else b''
+            if status != 304:
+                self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    state.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+def make_crawler(tmp_path, **options):
+    options.setdefault('delay', 0.0)
+    return WebCrawler(str(tmp_path / 'scraped_content'), state_path=str(tmp_path / 'crawl_state.db'), **options)
+
+
+def test_conditional_get_after_revisit(site, tmp_path):
+    crawler = make_crawler(tmp_path)
+    crawler.add(f"{site.url}/wiki/Abraham_Lincoln")
+    assert crawler.crawl() == {'fetched': 1, 'not_modified': 0, 'disallowed': 0, 'failed': 0}
+    with open(tmp_path / 'scraped_content' / 'Abraham_Lincoln.txt', encoding='utf-8') as file:
+        assert file.read() == "Abraham_Lincoln was a president."
+
+    assert crawler.revisit() == 1
+    assert crawler.crawl()['not_modified'] == 1
+    page_requests = [etag for path, etag in site.requests if path == '/wiki/Abraham_Lincoln']
+    assert page_requests == [None, '"/wiki/Abraham_Lincoln-v1"']
+    crawler.close()
+
+
+def test_robots_txt_is_fetched_once_and_obeyed(site, tmp_path):
+    crawler = make_crawler(tmp_path)
+    crawler.add_many([(None, f"{site.url}/wiki/George_Washington"), (None, f"{site.url}/private/Secret")])
+    stats = crawler.crawl()
+    assert stats['fetched'] == 1 and stats['disallowed'] == 1
+    paths = [path for path, _ in site.requests]
+    assert paths.count('/robots.txt') == 1
+    assert '/private/Secret' not in paths
+    crawler.close()
+
+
+def test_per_host_concurrency_and_delay(site, tmp_path):
+    site.page_delay = 0.05
+    crawler = make_crawler(tmp_path, max_workers=4, per_host_concurrency=1, delay=0.1)
+    crawler.add_many((None, f"{site.url}/wiki/President_{i}") for i in range(4))
+    assert crawler.crawl()['fetched'] == 4
+    assert site.max_in_flight == 1
+    gaps = [later - earlier for earlier, later in zip(site.started_at, site.started_at[1:])]
+    assert min(gaps) >= 0.09
+    crawler.close()
+
+
+def test_interrupted_crawl_resumes_from_frontier(site, tmp_path):
+    crawler = make_crawler(tmp_path)
+    urls = [f"{site.url}/wiki/President_{i}" for i in range(3)]
+    crawler.add_many((None, url) for url in urls)
+    assert crawler.crawl(limit=1)['fetched'] == 1
+    crawler.close()
+
+    resumed = make_crawler(tmp_path)
+    assert resumed.pending() == 2
+    assert resumed.add(urls[0]) is False  # Already visited
+    assert resumed.crawl()['fetched'] == 2
+    assert resumed.pending() == 0
+    assert sorted(os.listdir(tmp_path / 'scraped_content')) == [f"President_{i}.txt" for i in range(3)]
+    resumed.close()